@@ -0,0 +1,63 @@
+import argparse
+import os, sys
+import random
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.append (os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'validation'))
+sys.path.append (os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from date_validation import _compile_parser, compile_date_parser
+
+DATE_FORMAT = '%Y-%m-%d'
+
+def strptime_check (value, data_format=DATE_FORMAT):
+    """The string:date check used before date_validation: strptime/strftime round trip on every value."""
+    try:
+        return datetime.strptime(value, data_format).strftime(data_format) == value
+    except Exception:
+        return False
+
+def make_values (count, distinct, invalid_rate, seed=0):
+    """
+    count date strings drawn from `distinct` dates, invalid_rate of them malformed, mimicking a submission where
+    collection and upload dates repeat across records.
+    """
+    rng = random.Random(seed)
+    start = datetime(1990, 1, 1)
+    pool = [(start + timedelta(days=rng.randrange(12000))).strftime(DATE_FORMAT) for _ in range(distinct)]
+    values = []
+    for _ in range(count):
+        value = rng.choice(pool)
+        if rng.random() < invalid_rate:
+            value = rng.choice([value.replace('-', '/'), value[:-2] + '32', value[2:], value + ' '])
+        values.append(value)
+    return values
+
+def bench (check, values, repeat):
+    best = min(timeit.repeat(lambda: [check(value) for value in values], number=1, repeat=repeat))
+    return best / len(values) * 1e9
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="""Micro-benchmark of the string:date validator: per-value cost of the strptime/strftime round trip next to the
+compiled and the memoized checks of date_validation.
+
+Usage: python bench_dates.py --values 100000 --distinct 500
+""")
+    parser.add_argument("--values", type=int, default=100000, help="Number of date strings checked per run.")
+    parser.add_argument("--distinct", type=int, default=500, help="Number of distinct dates the values are drawn from.")
+    parser.add_argument("--invalid-rate", type=float, default=0.02, help="Fraction of malformed values.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per implementation; the best one is reported.")
+    args = parser.parse_args()
+
+    values = make_values (args.values, args.distinct, args.invalid_rate)
+    compiled = _compile_parser (DATE_FORMAT)
+    memoized = compile_date_parser (DATE_FORMAT)
+    assert [strptime_check(value) for value in values] == [compiled(value) is not None for value in values] == [memoized(value) is not None for value in values]
+
+    baseline = bench (strptime_check, values, args.repeat)
+    print (f"{'implementation':<24}{'ns/value':>10}{'speedup':>10}")
+    for name, check in (('strptime+strftime', strptime_check), ('compiled', compiled), ('compiled+memoized', memoized)):
+        cost = baseline if check is strptime_check else bench (check, values, args.repeat)
+        print (f"{name:<24}{cost:>10.0f}{baseline / cost:>9.1f}x")
@@ -0,0 +1,61 @@
+import argparse
+import os, sys
+import random
+import timeit
+
+sys.path.append (os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'validation'))
+from sequence_validation import SequenceCounts, count_sequences
+
+def scalar_counts (sequence):
+    """Per-character reference: what a check written as a loop over the sequence computes."""
+    bases = ambiguous = gaps = invalid = 0
+    for symbol in sequence:
+        if symbol in 'ACGTUacgtu':
+            bases += 1
+        elif symbol in 'RYSWKMBDHVNryswkmbdhvn':
+            ambiguous += 1
+        elif symbol == '-':
+            gaps += 1
+        else:
+            invalid += 1
+    return SequenceCounts(len(sequence), bases, ambiguous, gaps, invalid)
+
+def make_sequences (count, ambiguous_rate, invalid_rate, seed=0):
+    """count barcode-length sequences (500-658 bp); ambiguous_rate of the symbols are N, invalid_rate of the sequences carry an X."""
+    rng = random.Random(seed)
+    sequences = []
+    for _ in range(count):
+        symbols = [rng.choice('ACGT') if rng.random() >= ambiguous_rate else 'N' for _ in range(rng.randint(500, 658))]
+        if rng.random() < invalid_rate:
+            symbols[rng.randrange(len(symbols))] = 'X'
+        sequences.append(''.join(symbols))
+    return sequences
+
+def bench (count, sequences, repeat):
+    best = min(timeit.repeat(lambda: count(sequences), number=1, repeat=repeat))
+    return sum(map(len, sequences)) / best / 1e6
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="""Micro-benchmark of the nuc validator: throughput of a per-character loop next to the batched count_sequences of
+sequence_validation, at several batch sizes.
+
+Usage: python bench_sequences.py --sequences 20000 --ambiguous-rate 0.001
+""")
+    parser.add_argument("--sequences", type=int, default=20000, help="Number of sequences checked per run.")
+    parser.add_argument("--ambiguous-rate", type=float, default=0.001, help="Fraction of N symbols.")
+    parser.add_argument("--invalid-rate", type=float, default=0.02, help="Fraction of sequences with an invalid symbol.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per implementation; the best one is reported.")
+    args = parser.parse_args()
+
+    sequences = make_sequences (args.sequences, args.ambiguous_rate, args.invalid_rate)
+    assert [scalar_counts(sequence) for sequence in sequences] == count_sequences (sequences)
+
+    baseline = bench (lambda batch: [scalar_counts(sequence) for sequence in batch], sequences, 1)
+    print (f"{'implementation':<24}{'MB/s':>10}{'speedup':>10}")
+    print (f"{'per-character loop':<24}{baseline:>10.1f}{1:>9.1f}x")
+    for batch_size in (1, 100, 1000, args.sequences):
+        rate = bench (lambda batch: [counts for start in range(0, len(batch), batch_size) for counts in count_sequences (batch[start:start + batch_size])],
+                      sequences, args.repeat)
+        print (f"{f'count_sequences/{batch_size}':<24}{rate:>10.1f}{rate / baseline:>9.1f}x")
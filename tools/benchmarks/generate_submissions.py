@@ -0,0 +1,166 @@
+import argparse
+import json, sys, os
+import random
+import string
+from datetime import datetime, timedelta
+
+sys.path.append (os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+sys.path.append (os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'validation'))
+from compiled_tables import read_table
+from vocabulary import COUNTRY_COLUMNS
+
+_BCDM_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir)
+_POOL_SIZE = 256          # distinct values pre-generated per field
+_ARRAY_TYPES = ('array', 'array of string')
+_DATE_FORMAT = '%Y-%m-%d'
+_DATE_RANGES = [('collection_date_start', 'collection_date_end')]
+
+# field -> generator of realistic values for fields whose data_type alone says too little
+_WORDS = ['alpha', 'boreal', 'coastal', 'delta', 'estuary', 'forest', 'granite', 'harbour', 'island', 'juniper', 'kelp', 'lagoon']
+
+def _nuc (rng):
+    return ''.join(rng.choice('ACGT') for _ in range(rng.randint(500, 658)))
+
+def _words (rng, count=3):
+    return ' '.join(rng.choice(_WORDS) for _ in range(count))
+
+def _format_string (rng, data_format):
+    value = data_format
+    for placeholder, make in (('%s', lambda: rng.choice(_WORDS)), ('%d', lambda: str(rng.randint(0, 99999))), ('%f', lambda: f"{rng.uniform(0, 100):.3f}")):
+        while placeholder in value:
+            value = value.replace(placeholder, make(), 1)
+    return value
+
+def _date (rng):
+    return (datetime(1990, 1, 1) + timedelta(days=rng.randrange(12000))).strftime(_DATE_FORMAT)
+
+FIELD_GENERATORS = {
+    'nuc': _nuc,
+    'coord': lambda rng: f"{rng.uniform(-90, 90):.5f},{rng.uniform(-180, 180):.5f}",
+    'bold_recordset_code_arr': lambda rng: ','.join(f"DS-{rng.choice(string.ascii_uppercase)}{rng.randint(100, 999)}" for _ in range(rng.randint(1, 2))),
+}
+
+def generate_value (rng, field, data_type, data_format, terms=None):
+    if terms:
+        if data_type in _ARRAY_TYPES:
+            return ','.join(rng.sample(terms, min(len(terms), rng.randint(1, 2))))
+        return rng.choice(terms)
+    if field in FIELD_GENERATORS:
+        return FIELD_GENERATORS[field](rng)
+    if data_type in ('int', 'integer'):
+        return str(rng.randint(0, 100000))
+    if data_type in ('float', 'number'):
+        return f"{rng.uniform(-1000, 1000):.4f}"
+    if data_type == 'char':
+        return rng.choice(string.ascii_uppercase)
+    if data_type == 'geopoint':
+        return f"{rng.uniform(-90, 90):.5f},{rng.uniform(-180, 180):.5f}"
+    if data_type == 'json':
+        return json.dumps({rng.choice(_WORDS): rng.randint(0, 100)})
+    if data_type in _ARRAY_TYPES:
+        return ','.join(rng.choice(_WORDS) for _ in range(rng.randint(1, 3)))
+    if data_type == 'string:date':
+        return _date(rng)
+    if data_type == 'string' and data_format and data_format != 'default':
+        return _format_string(rng, data_format)
+    return _words(rng)
+
+def invalid_value (rng, data_type, data_format, terms=None):
+    """A value the acceptability check rejects for a field of this type, format or vocabulary."""
+    if terms:
+        return 'Unlisted ' + rng.choice(_WORDS)
+    if data_type in ('int', 'integer'):
+        return f"{rng.randint(0, 99)}a"
+    if data_type in ('float', 'number'):
+        return 'n/a'
+    if data_type == 'char':
+        return 'ab'
+    if data_type == 'geopoint':
+        return f"{rng.uniform(-90, 90):.5f}"
+    if data_type == 'json':
+        return '{'
+    if data_type == 'string:date':
+        return rng.choice(['2021-02-30', '2021/01/01', '21-01-01'])
+    return 'invalid-' + rng.choice(_WORDS)
+
+class SubmissionGenerator:
+    """
+    Synthetic submission packets built from field_definitions.tsv: every field gets values of its data_type and
+    data_format, controlled and country fields draw from the vocabulary TSVs.  A fraction invalid_rate of the
+    records carries exactly one invalid value, so the expected acceptance rate is 1 - invalid_rate.
+    """
+    def __init__ (self, bcdm_def, vocabularies=None, countries=None, invalid_rate=0.0, fill_rate=0.6, seed=0):
+        self.rng = random.Random(seed)
+        self.invalid_rate = invalid_rate
+        self.fill_rate = fill_rate
+        self.fields = [(row['field'], row['data_type'], row['data_format']) for row in read_table(bcdm_def) if row.get('field')]
+
+        self.terms = {}
+        if vocabularies:
+            for row in read_table(vocabularies):
+                if row.get('field') and row.get('term'):
+                    self.terms.setdefault(row['field'], []).append(row['term'])
+        if countries:
+            for row in read_table(countries):
+                for field, columns in COUNTRY_COLUMNS.items():
+                    self.terms.setdefault(field, []).extend(row[column] for column in columns if row.get(column))
+
+        self.pools = {field: [generate_value(self.rng, field, data_type, data_format, self.terms.get(field)) for _ in range(_POOL_SIZE)]
+                      for field, data_type, data_format in self.fields}
+        self.checked_fields = [(field, data_type, data_format) for field, data_type, data_format in self.fields
+                               if field in self.terms or data_type not in ('string', *_ARRAY_TYPES) or data_format not in ('', 'default')]
+
+    def packet (self, i):
+        rng = self.rng
+        packet = {field: rng.choice(self.pools[field]) for field, _, _ in self.fields if rng.random() < self.fill_rate}
+        packet['sampleid'] = f"SMP{i:09d}"
+        packet['processid'] = f"PROC{i:09d}"
+        packet['bold_recordset_code_arr'] = rng.choice(self.pools['bold_recordset_code_arr'])
+        packet.pop('record_id', None)
+        for start_field, end_field in _DATE_RANGES:
+            if packet.get(start_field) and packet.get(end_field) and packet[start_field] > packet[end_field]:
+                packet[start_field], packet[end_field] = packet[end_field], packet[start_field]
+        if packet.get('nuc') and 'nuc_basecount' in packet:
+            packet['nuc_basecount'] = str(sum(packet['nuc'].count(base) for base in 'ACGT'))
+
+        if self.checked_fields and rng.random() < self.invalid_rate:
+            field, data_type, data_format = rng.choice(self.checked_fields)
+            packet[field] = invalid_value(rng, data_type, data_format, self.terms.get(field))
+        return packet
+
+    def records (self, count):
+        for i in range(count):
+            yield {'id': f"r{i}", 'submission_type': 'specimen', 'submission_packet': self.packet(i)}
+
+def write_records (generator, count, stream, buffer_lines=1000):
+    lines = []
+    for record in generator.records(count):
+        lines.append(json.dumps(record))
+        if len(lines) >= buffer_lines:
+            stream.write("\n".join(lines) + "\n")
+            lines = []
+    if lines:
+        stream.write("\n".join(lines) + "\n")
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="""This tool writes synthetic BCDM submission JSONL for benchmarking.  Values follow the data_type/data_format of
+field_definitions.tsv and the controlled vocabulary and country lists; --invalid-rate of the records carry one invalid value.
+
+Usage: python generate_submissions.py --records 100000 --invalid-rate 0.02 > submissions.jsonl
+""")
+    parser.add_argument("--records", type=int, default=10000, help="Number of records to generate.")
+    parser.add_argument("--invalid-rate", type=float, default=0.02, help="Fraction of records carrying one invalid value.")
+    parser.add_argument("--fill-rate", type=float, default=0.6, help="Probability that an optional field is present in a record.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed; the same seed always produces the same file.")
+    parser.add_argument("--bcdm-def", type=str, default=os.path.join(_BCDM_DIR, 'field_definitions.tsv'), help="File path for the BCDM field definitions.")
+    parser.add_argument("--vocabularies", type=str, default=os.path.join(_BCDM_DIR, 'controlled_vocabularies.tsv'), help="File path for the controlled vocabularies.")
+    parser.add_argument("--countries", type=str, default=os.path.join(_BCDM_DIR, 'registered_soverign_and_maritime_areas.tsv'), help="File path for the country/ISO list.")
+    args = parser.parse_args()
+
+    if not 0 <= args.invalid_rate <= 1 or not 0 <= args.fill_rate <= 1:
+        parser.error("--invalid-rate and --fill-rate must be between 0 and 1")
+
+    generator = SubmissionGenerator (args.bcdm_def, args.vocabularies, args.countries, args.invalid_rate, args.fill_rate, args.seed)
+    write_records (generator, args.records, sys.stdout)
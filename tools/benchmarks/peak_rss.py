@@ -0,0 +1,35 @@
+"""
+Runs a tool script as __main__ and, at exit, writes its peak RSS in kB to the file given as first argument.
+
+ru_maxrss of a child also carries the high-water mark of the process it was spawned from (Linux records the old
+address space on exec), so the benchmark runner would otherwise see its own RSS as every tool's floor.  VmHWM of
+/proc/self/status only covers the address space of the tool itself.
+
+Usage: python peak_rss.py rss.txt ../validation/2_validate.py --bcdm-def field_definitions.tsv
+"""
+import atexit
+import os
+import resource
+import runpy
+import sys
+
+def peak_rss_kb ():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def _report (rss_path):
+    with open(rss_path, 'w') as rss_file:
+        rss_file.write(str(peak_rss_kb()))
+
+if __name__ == "__main__":
+    rss_path, script = sys.argv[1], sys.argv[2]
+    sys.argv = sys.argv[2:]
+    sys.path[0] = os.path.dirname(os.path.abspath(script))
+    atexit.register(_report, rss_path)
+    runpy.run_path(script, run_name='__main__')
@@ -0,0 +1,172 @@
+import argparse
+import json, sys, os
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from generate_submissions import SubmissionGenerator, write_records
+
+_TOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+_BCDM_DIR = os.path.join(_TOOLS_DIR, os.pardir)
+_PEAK_RSS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'peak_rss.py')
+
+def tool_commands (args):
+    """
+    Returns [(name, argv)] for the four tools in pipeline order.
+    """
+    python = sys.executable
+    validation = os.path.join(_TOOLS_DIR, 'validation')
+    conversion = os.path.join(_TOOLS_DIR, 'conversion')
+    return [
+        ('1_acceptability_check', [python, os.path.join(validation, '1_acceptability_check.py'), '--bcdm-def', args.bcdm_def,
+                                   '--vocabularies', args.vocabularies, '--countries', args.countries]),
+        ('2_validate', [python, os.path.join(validation, '2_validate.py'), '--bcdm-def', args.bcdm_def]),
+        ('3_convert_BCDM_to_DB', [python, os.path.join(conversion, '3_convert_BCDM_to_DB.py'), '--mapping', args.mapping]),
+        ('4_convert_to_verbatim', [python, os.path.join(conversion, '4_convert_to_verbatim.py'), '--mapping-verbatim', args.mapping_verbatim]),
+    ]
+
+def run_stages (commands, input_path, output_path, stderr_path):
+    """
+    Run one tool, or several piped into each other, on input_path.  The stages run with their normal output
+    buffering, so records/sec is what the pipeline gets.  Per-record latency percentiles come from each stage's
+    own --metrics-out file, peak RSS is reported by peak_rss.py from inside each stage, CPU time comes from wait4().
+    """
+    procs = []
+    with open(input_path, 'rb') as stdin, open(stderr_path, 'wb') as stderr:
+        start = time.perf_counter()
+        for i, argv in enumerate(commands):
+            proc_stdin = stdin if i == 0 else procs[-1].stdout
+            argv = argv[:1] + [_PEAK_RSS, f"{output_path}.rss{i}"] + argv[1:] + ['--metrics-out', f"{output_path}.metrics{i}"]
+            procs.append(subprocess.Popen(argv, stdin=proc_stdin, stdout=subprocess.PIPE, stderr=stderr))
+            if i > 0:
+                procs[-2].stdout.close()     # the next stage owns the pipe now
+
+        first_output = None
+        count = 0
+        with open(output_path, 'wb') as out:
+            for block in iter(lambda: procs[-1].stdout.read1(1 << 16), b''):
+                if first_output is None:
+                    first_output = time.perf_counter() - start
+                out.write(block)
+                count += block.count(b"\n")
+
+        stages = []
+        for i, proc in enumerate(procs):
+            _, status, rusage = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            peak_rss_mb = None       # not reported if the stage was killed
+            if os.path.exists(f"{output_path}.rss{i}"):
+                with open(f"{output_path}.rss{i}") as rss_file:
+                    peak_rss_mb = round(int(rss_file.read()) / 1024, 1)
+                os.remove(f"{output_path}.rss{i}")
+            latency_ms = None
+            if os.path.exists(f"{output_path}.metrics{i}"):
+                with open(f"{output_path}.metrics{i}") as metrics_file:
+                    latency_ms = json.load(metrics_file).get('latency_ms')
+                os.remove(f"{output_path}.metrics{i}")
+            stages.append({'exit_code': proc.returncode, 'peak_rss_mb': peak_rss_mb, 'latency_ms': latency_ms,
+                           'cpu_s': round(rusage.ru_utime + rusage.ru_stime, 3)})
+        wall = time.perf_counter() - start
+
+    return {
+        'wall_s': round(wall, 3),
+        'output_records': count,
+        'first_output_s': round(first_output, 4) if first_output is not None else None,
+        'peak_rss_mb': max((stage['peak_rss_mb'] or 0) for stage in stages),
+        'total_rss_mb': round(sum((stage['peak_rss_mb'] or 0) for stage in stages), 1),
+        'cpu_s': round(sum(stage['cpu_s'] for stage in stages), 3),
+        'stages': stages,
+    }
+
+def _p99 (result):
+    """p99 per-record latency of every stage of a result, in ms."""
+    return [(stage['latency_ms'] or {}).get('p99') for stage in result['stages']]
+
+def count_lines (path):
+    with open(path, 'rb') as f:
+        return sum(chunk.count(b"\n") for chunk in iter(lambda: f.read(1 << 20), b""))
+
+def git_commit ():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=_TOOLS_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main (args):
+
+    for filepath in (args.bcdm_def, args.vocabularies, args.countries, args.mapping, args.mapping_verbatim, args.input):
+        if filepath and not os.path.exists(filepath):
+            print ( f"[ABORT] File path not found: {filepath}", file=sys.stderr)
+            sys.exit (1)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='bcdm-bench-')
+    os.makedirs(work_dir, exist_ok=True)
+    input_path = args.input
+    if input_path is None:
+        input_path = os.path.join(work_dir, 'submissions.jsonl')
+        generator = SubmissionGenerator (args.bcdm_def, args.vocabularies, args.countries, args.invalid_rate, seed=args.seed)
+        with open(input_path, 'w') as stream:
+            write_records (generator, args.records, stream)
+    input_records = count_lines(input_path)
+    print (f"[INFO] {input_records} records in {input_path}", file=sys.stderr)
+
+    # Each tool is measured on the output of the previous one, as it runs in the pipeline
+    results = {}
+    commands = tool_commands(args)
+    stage_input = input_path
+    for name, argv in commands:
+        stage_output = os.path.join(work_dir, f"{name}.jsonl")
+        result = run_stages([argv], stage_input, stage_output, os.path.join(work_dir, f"{name}.err"))
+        result['input_records'] = count_lines(stage_input)
+        result['records_per_sec'] = round(result['input_records'] / result['wall_s'], 1)
+        results[name] = result
+        print (f"[INFO] {name}: {result['records_per_sec']} records/s, p99 {_p99(result)[0]} ms, peak RSS {result['peak_rss_mb']} MB", file=sys.stderr)
+        stage_input = stage_output
+
+    result = run_stages([argv for _, argv in commands], input_path, os.path.join(work_dir, 'chain.jsonl'), os.path.join(work_dir, 'chain.err'))
+    result['input_records'] = input_records
+    result['records_per_sec'] = round(input_records / result['wall_s'], 1)
+    results['chain'] = result
+    print (f"[INFO] chain: {result['records_per_sec']} records/s, p99 per stage {_p99(result)} ms, total RSS {result['total_rss_mb']} MB", file=sys.stderr)
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'input': {'path': input_path, 'records': input_records, 'generated': args.input is None,
+                  'invalid_rate': args.invalid_rate if args.input is None else None, 'seed': args.seed if args.input is None else None},
+        'results': results,
+    }
+    with open(args.output, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="""This tool benchmarks 1_acceptability_check.py, 2_validate.py, 3_convert_BCDM_to_DB.py, 4_convert_to_verbatim.py and
+their piped chain on synthetic (or given) submissions, and writes records/sec, per-stage p50/p99 per-record latency (from each
+tool's --metrics-out) and peak RSS to a JSON file so runs can be compared across commits.
+
+Usage: python run_benchmarks.py --records 100000 --invalid-rate 0.02 --output bench_$(git rev-parse --short HEAD).json
+""")
+    parser.add_argument("--records", type=int, default=10000, help="Number of records to generate (ignored with --input).")
+    parser.add_argument("--invalid-rate", type=float, default=0.02, help="Fraction of generated records carrying one invalid value.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the generator.")
+    parser.add_argument("--input", type=str, required=False, help="Benchmark this JSONL file instead of generating one.")
+    parser.add_argument("--output", type=str, required=True, help="File path for the JSON results.")
+    parser.add_argument("--work-dir", type=str, required=False, help="Directory for the generated input and the outputs of every stage.  Defaults to a new temporary directory.")
+    parser.add_argument("--bcdm-def", type=str, default=os.path.join(_BCDM_DIR, 'field_definitions.tsv'), help="File path for the BCDM field definitions.")
+    parser.add_argument("--vocabularies", type=str, default=os.path.join(_BCDM_DIR, 'controlled_vocabularies.tsv'), help="File path for the controlled vocabularies.")
+    parser.add_argument("--countries", type=str, default=os.path.join(_BCDM_DIR, 'registered_soverign_and_maritime_areas.tsv'), help="File path for the country/ISO list.")
+    parser.add_argument("--mapping", type=str, default=os.path.join(_BCDM_DIR, 'mapping_BCDM_to_BOLD.tsv'), help="File path for the BCDM field to BOLD DB field mapping.")
+    parser.add_argument("--mapping-verbatim", type=str, default=os.path.join(_BCDM_DIR, 'mapping_verbatim_to_BOLD.tsv'), help="File path for the verbatim to BOLD DB field mapping.")
+    args = parser.parse_args()
+
+    if not 0 <= args.invalid_rate <= 1:
+        parser.error("--invalid-rate must be between 0 and 1")
+
+    main(args)
@@ -0,0 +1,127 @@
+import atexit
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import sys
+from contextlib import contextmanager, redirect_stderr
+
+_COMMIT_EVERY = 1000      # stored lines between two commits; a killed run loses at most this many results
+
+def line_hash (line):
+    if isinstance(line, str):
+        line = line.rstrip("\n").encode('utf-8')
+    return hashlib.blake2b(line, digest_size=16).digest()
+
+def source_digest (tool_path):
+    """
+    Hash of the Python sources a tool may run on: every module of the tools tree (tools/ and its directories, as
+    tools import helpers across them) and next to the tool script.  Hashed by content, so a checkout that only
+    touches modification times keeps the checkpoint.
+    """
+    tools_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    directories = {tools_dir, os.path.dirname(os.path.abspath(tool_path))}
+    directories.update(os.path.join(tools_dir, name) for name in os.listdir(tools_dir) if os.path.isdir(os.path.join(tools_dir, name)))
+    digest = hashlib.sha256()
+    for directory in sorted (directories):
+        for name in sorted (os.listdir(directory)):
+            if name.endswith('.py'):
+                with open(os.path.join(directory, name), 'rb') as source:
+                    digest.update(name.encode('utf-8') + b'\0' + source.read() + b'\0')
+    return digest.hexdigest()
+
+def fingerprint (tool_path, args, names):
+    """
+    Hash of what a line's result depends on besides the line itself: the tool's sources (see source_digest) and the
+    given options.  Options naming a file (field definitions, mappings, reference DB) contribute its size and
+    modification time, so editing a table invalidates the checkpoint.
+    """
+    parts = {'__sources__': source_digest (tool_path)}
+    for name in ['__tool__'] + list(names):
+        value = tool_path if name == '__tool__' else getattr(args, name)
+        if isinstance(value, str) and os.path.isfile(value):
+            stat = os.stat(value)
+            value = [os.path.abspath(value), stat.st_size, stat.st_mtime_ns]
+        parts[name] = value
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+class Checkpoint:
+    """
+    --checkpoint: a SQLite file of the results of the lines a tool has processed, keyed on the hash of the line.
+    A result is the verdict, the output line (NULL when the tool passes the input line through unchanged) and what
+    the tool wrote to stderr for it.  On a rerun over the same or a corrected input, lines found here are replayed
+    instead of processed.  Results only stand for one tool fingerprint; a checkpoint written with other options,
+    tables or tool code starts over.
+    """
+    def __init__ (self, path, tool_fingerprint):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS results (hash BLOB PRIMARY KEY, accepted INTEGER NOT NULL, output TEXT, messages TEXT NOT NULL)")
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+        if row is not None and row[0] != tool_fingerprint:
+            print (f"[WARNING] Checkpoint {path} was written with other options, tables or tool code, starting over", file=sys.stderr)
+            self.conn.execute("DELETE FROM results")
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('fingerprint', ?)", (tool_fingerprint,))
+        self.conn.commit()
+        self.replayed = 0
+        self.stored = 0
+        atexit.register(self.close)
+
+    def lookup (self, line):
+        """
+        Returns (accepted, output, messages) stored for line, output being line itself for pass-through results, or
+        None if the line has not been processed yet.
+        """
+        row = self.conn.execute("SELECT accepted, output, messages FROM results WHERE hash = ?", (line_hash(line),)).fetchone()
+        if row is None:
+            return None
+        self.replayed += 1
+        accepted, output, messages = row
+        return bool(accepted), (line if output is None and accepted else output), messages
+
+    def split (self, lines):
+        """Returns the lookup() result of every line and the lines that still need processing."""
+        replays = [self.lookup (line) for line in lines]
+        return replays, [line for line, replay in zip (lines, replays) if replay is None]
+
+    def store (self, line, accepted, output=None, messages=''):
+        self.conn.execute("INSERT OR REPLACE INTO results (hash, accepted, output, messages) VALUES (?, ?, ?, ?)",
+                          (line_hash(line), int(accepted), output, messages))
+        self.stored += 1
+        if self.stored % _COMMIT_EVERY == 0:
+            self.conn.commit()
+
+    def close (self):
+        atexit.unregister(self.close)
+        if self.conn is None:
+            return
+        self.conn.commit()
+        self.conn.close()
+        self.conn = None
+        print (f"[INFO] checkpoint: {self.replayed} lines replayed, {self.stored} processed", file=sys.stderr)
+
+def open_checkpoint (args, tool_path, names):
+    """Checkpoint for --checkpoint, or None when the flag is off."""
+    if not getattr(args, 'checkpoint', None):
+        return None
+    return Checkpoint (args.checkpoint, fingerprint (tool_path, args, names))
+
+@contextmanager
+def captured_stderr (checkpoint):
+    """
+    Yields a buffer collecting what is written to stderr while one line is processed, for checkpoint.store(), and
+    passes it on to stderr afterwards.  A no-op yielding None when checkpoint is None.
+    """
+    if checkpoint is None:
+        yield None
+        return
+    err = io.StringIO()
+    try:
+        with redirect_stderr (err):
+            yield err
+    finally:
+        sys.stderr.write (err.getvalue())
@@ -0,0 +1,108 @@
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+import sys
+import tempfile
+
+# name -> file name of the reference tables shipped at the repository root
+KNOWN_TABLES = {
+    'field_definitions': 'field_definitions.tsv',
+    'mapping_BCDM_to_BOLD': 'mapping_BCDM_to_BOLD.tsv',
+    'mapping_verbatim_to_BOLD': 'mapping_verbatim_to_BOLD.tsv',
+    'mapping_BCDM_to_DWC': 'mapping_BCDM_to_DWC.tsv',
+    'mapping_BOLD_to_BCDM': 'mapping_BOLD_to_BCDM.tsv',
+    'controlled_vocabularies': 'controlled_vocabularies.tsv',
+    'registered_soverign_and_maritime_areas': 'registered_soverign_and_maritime_areas.tsv',
+}
+_FORMAT_VERSION = 1
+
+_loaded = {}        # (name, path, mtime, size) of every table -> tables already compiled or loaded by this process
+
+def cache_dir ():
+    if os.environ.get('BCDM_CACHE_DIR'):
+        return os.environ['BCDM_CACHE_DIR']
+    return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'bcdm')
+
+def table_paths (filepath):
+    """
+    Returns name -> path for the known tables found next to filepath, with filepath itself under its own name (or
+    under its file name if it is not one of the known tables).
+    """
+    directory = os.path.dirname(os.path.abspath(filepath))
+    paths = {name: os.path.join(directory, filename) for name, filename in KNOWN_TABLES.items()
+             if os.path.exists(os.path.join(directory, filename))}
+    name = next((name for name, filename in KNOWN_TABLES.items() if os.path.basename(filepath) == filename), os.path.basename(filepath))
+    paths[name] = os.path.abspath(filepath)
+    return paths, name
+
+def parse_tsv (content):
+    return [row for row in csv.DictReader(io.StringIO(content.decode('utf-8'), newline=''), delimiter="\t") if row]
+
+def compile_tables (paths):
+    """
+    Returns name -> list of row dicts for every table in paths.  The parsed tables are stored as one JSON artifact
+    in cache_dir() keyed by the content hash of all tables, so any edit to a TSV invalidates it automatically.
+    Within a process the result is kept per set of table paths, modification times and sizes, so later calls
+    neither hash the tables nor parse the artifact again.  The rows are shared: callers must not modify them.
+    """
+    stats = []
+    for name in sorted(paths):
+        stat = os.stat(paths[name])
+        stats.append((name, paths[name], stat.st_mtime_ns, stat.st_size))
+    stats = tuple(stats)
+    if stats not in _loaded:
+        _loaded[stats] = _load_tables (paths)
+    return _loaded[stats]
+
+def _load_tables (paths):
+    contents = {}
+    digest = hashlib.sha256(str(_FORMAT_VERSION).encode())
+    for name in sorted(paths):
+        with open(paths[name], 'rb') as table_file:
+            contents[name] = table_file.read()
+        digest.update(name.encode() + b'\0' + contents[name] + b'\0')
+    artifact = os.path.join(cache_dir(), f"bcdm-tables-{digest.hexdigest()[:32]}.json")
+
+    try:
+        with open(artifact) as artifact_file:
+            return json.load(artifact_file)
+    except (OSError, ValueError):
+        pass
+
+    tables = {name: parse_tsv(content) for name, content in contents.items()}
+    try:
+        os.makedirs(os.path.dirname(artifact), exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(artifact), suffix='.tmp', delete=False) as tmp_file:
+            json.dump(tables, tmp_file)
+        os.replace(tmp_file.name, artifact)
+    except OSError as e:
+        print (f"[WARNING] Could not write table cache {artifact}: {e}", file=sys.stderr)
+    return tables
+
+def read_table (filepath):
+    """
+    Rows of the TSV at filepath, served from the compiled artifact of its directory.
+    """
+    paths, name = table_paths(filepath)
+    return compile_tables(paths)[name]
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="""This tool compiles the BCDM definition, mapping and vocabulary TSVs of a directory into the cached artifact used by the
+validation and conversion tools.  The tools compile on demand as well; running this ahead of time only moves the one-off cost.
+
+Usage: python compiled_tables.py --dir /path/to/BCDM
+""")
+    parser.add_argument("--dir", type=str, required=True, help="Directory holding field_definitions.tsv and the mapping TSVs.")
+    args = parser.parse_args()
+
+    paths = {name: os.path.join(args.dir, filename) for name, filename in KNOWN_TABLES.items() if os.path.exists(os.path.join(args.dir, filename))}
+    if not paths:
+        print (f"[ABORT] No BCDM tables found in {args.dir}", file=sys.stderr)
+        sys.exit (1)
+    tables = compile_tables(paths)
+    print (f"Compiled {len(tables)} tables into {cache_dir()}", file=sys.stderr)
@@ -0,0 +1,133 @@
+import atexit
+import json
+import math
+import re
+import sys
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_BLOCK_SIZE = 1 << 20         # bytes asked for per read of the input
+_WRITE_BUFFER = 1 << 16       # bytes of output lines collected before a write
+
+# In stdlib output: strings (skipped), non-finite floats and floats in exponent notation
+_STDLIB_TOKENS = re.compile(r'"(?:[^"\\]|\\.)*"|NaN|-?Infinity|-?[0-9.]+e[-+][0-9]+')
+
+def _reject_constant (name):
+    raise ValueError (f"{name} is not a valid JSON value")
+
+def _finite_float (text):
+    value = float(text)
+    if not math.isfinite(value):
+        raise ValueError (f"number {text} is out of range")
+    return value
+
+def _orjson_token (match):
+    """
+    Rewrites a stdlib token the way orjson writes it: non-finite floats as null, exponents without '+' or zero
+    padding, and 1e-05 <= |x| < 1e-04 in decimal notation.  The digits are the same, both being shortest repr.
+    """
+    token = match.group()
+    if token[0] == '"':
+        return token
+    if token[-1] in 'Ny':
+        return 'null'
+    mantissa, exponent = token.split('e')
+    if int(exponent) == -5:
+        sign, digits = ('-', mantissa[1:]) if mantissa[0] == '-' else ('', mantissa)
+        return f"{sign}0.0000{digits.replace('.', '')}"
+    return f"{mantissa}e{int(exponent)}"
+
+# Built once: json.loads/json.dumps construct a new decoder/encoder on every call given options
+_DECODER = json.JSONDecoder(parse_constant=_reject_constant, parse_float=_finite_float)
+_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), allow_nan=False)
+_NAN_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+def loads (data):
+    """
+    Parses one JSON document from bytes or str, with orjson when it is installed.  NaN, Infinity and numbers out of
+    float range are rejected with ValueError on both paths, as orjson does.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass        # integers beyond 64 bits, ...: the stdlib decides, with its usual error message
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode(json.detect_encoding(data), 'surrogatepass')       # as json.loads does
+    return _DECODER.decode(data)
+
+def dumps (obj):
+    """
+    Serializes obj to compact UTF-8 JSON bytes.  The stdlib fallback rewrites floats the way orjson formats them
+    (see _orjson_token), non-finite ones included, so the output of the tools does not depend on whether orjson is
+    installed.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass        # integers beyond 64 bits
+    try:
+        text = _ENCODER.encode(obj)
+        rewrite = 'e-' in text or 'e+' in text        # far cheaper than running the regex over every line
+    except ValueError:
+        text = _NAN_ENCODER.encode(obj)
+        rewrite = True
+    if rewrite:
+        text = _STDLIB_TOKENS.sub(_orjson_token, text)
+    return text.encode('utf-8')
+
+def read_lines (stream=None, block_size=_BLOCK_SIZE):
+    """
+    Yields the lines of a binary stream (sys.stdin.buffer by default) as bytes without the line terminator.  read1()
+    returns whatever the pipe holds, up to block_size, so a stage does not wait for a full block before it starts.
+    """
+    stream = stream if stream is not None else sys.stdin.buffer
+    read = getattr(stream, 'read1', stream.read)
+    rest = b''
+    while True:
+        block = read(block_size)
+        if not block:
+            break
+        lines = block.split(b'\n')
+        if rest:
+            lines[0] = rest + lines[0]
+        rest = lines.pop()
+        yield from lines
+    if rest:
+        yield rest
+
+class JsonlWriter:
+    """
+    Buffered JSONL output on a binary stream (sys.stdout.buffer by default): lines are written in blocks of about
+    buffer_size bytes rather than one write per record.  Flushed by flush() and at exit.
+    """
+    def __init__ (self, stream=None, buffer_size=_WRITE_BUFFER):
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.lines = []
+        self.size = 0
+        atexit.register(self.flush)
+
+    def write (self, line):
+        """Adds one line (bytes, or str) without its terminator."""
+        if isinstance(line, str):
+            line = line.encode('utf-8')
+        self.lines.append(line)
+        self.size += len(line) + 1
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def flush (self):
+        if self.stream is None:
+            sys.stdout.flush()        # anything print()ed before goes first
+        out = self.stream if self.stream is not None else sys.stdout.buffer
+        if self.lines:
+            self.lines.append(b'')
+            out.write(b'\n'.join(self.lines))
+            self.lines = []
+            self.size = 0
+        out.flush()
@@ -0,0 +1,164 @@
+import atexit
+import heapq
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+from contextlib import contextmanager, nullcontext
+
+_PROGRESS_EVERY = 1000        # records between two checks of the progress clock
+_LATENCY_STEPS = 8            # latency histogram buckets per doubling of the time: percentiles within 9%
+
+class CheckStats:
+    """
+    Cumulative calls, time and failures of the value checks, per BCDM field and per checker (the field's data_type,
+    or 'vocabulary').  Attached to a schema as schema.check_stats only while metrics are collected.
+    """
+    def __init__ (self):
+        self.fields = {}      # field -> [calls, seconds, failures]
+        self.checkers = {}    # checker -> [calls, seconds, failures]
+
+    def add (self, field, checker, seconds, failures, calls=1):
+        for table, key in ((self.fields, field), (self.checkers, checker)):
+            stats = table.get(key)
+            if stats is None:
+                stats = table[key] = [0, 0.0, 0]
+            stats[0] += calls
+            stats[1] += seconds
+            stats[2] += failures
+
+    def merge (self, other):
+        for table, other_table in ((self.fields, other.fields), (self.checkers, other.checkers)):
+            for key, (calls, seconds, failures) in other_table.items():
+                stats = table.setdefault(key, [0, 0.0, 0])
+                stats[0] += calls
+                stats[1] += seconds
+                stats[2] += failures
+
+    def take (self):
+        """Returns the stats collected so far and starts over, for shipping worker stats to the parent process."""
+        taken = CheckStats()
+        taken.fields, taken.checkers = self.fields, self.checkers
+        self.fields, self.checkers = {}, {}
+        return taken
+
+    def to_dict (self):
+        def table (stats):
+            ordered = sorted(stats.items(), key=lambda item: -item[1][1])
+            return {key: {'calls': calls, 'seconds': round(seconds, 6), 'failures': failures} for key, (calls, seconds, failures) in ordered}
+        return {'fields': table(self.fields), 'checkers': table(self.checkers)}
+
+class Metrics:
+    """
+    Opt-in run metrics of one tool (--metrics-out): records in/out/rejected, wall and CPU time per stage, value
+    check stats, per-record latency percentiles and the slowest records.  The JSON file is rewritten every interval seconds while the tool runs
+    (status 'running') and once more at exit (status 'done').  Tools keep metrics = None when the flag is off, so
+    the only cost then is a None test per record.
+    """
+    def __init__ (self, tool, path, slowest=10, interval=10.0):
+        self.tool = tool
+        self.path = path
+        self.slowest_count = slowest
+        self.interval = interval
+        self.checks = CheckStats()
+        self.stages = {}          # stage -> [wall seconds, cpu seconds]
+        self.records_in = 0
+        self.records_out = 0
+        self.rejected = 0
+        self.replayed = 0         # records taken from a --checkpoint, included in the counts above
+        self.slowest = []         # min-heap of (seconds, request_id)
+        self.latencies = {}       # log-scale bucket -> records, see add_latency
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self._next_progress = self._started + interval
+        atexit.register(self.close)
+
+    @contextmanager
+    def stage (self, name):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            stats = self.stages.setdefault(name, [0.0, 0.0])
+            stats[0] += time.perf_counter() - wall
+            stats[1] += time.process_time() - cpu
+
+    def record (self, request_id, seconds, accepted, replayed=False):
+        """Counts one record; replayed records (from a checkpoint) are also counted apart and never among the slowest."""
+        self.records_in += 1
+        if accepted:
+            self.records_out += 1
+        else:
+            self.rejected += 1
+        if replayed:
+            self.replayed += 1
+        else:
+            self.add_latency(seconds)
+            self.add_slowest([(seconds, request_id)])
+        if self.records_in % _PROGRESS_EVERY == 0:
+            self.progress()
+
+    def add_slowest (self, timings):
+        for seconds, request_id in timings:
+            timing = (seconds, str(request_id))
+            if len(self.slowest) < self.slowest_count:
+                heapq.heappush(self.slowest, timing)
+            elif timing[0] > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, timing)
+
+    def add_latency (self, seconds):
+        bucket = int(math.log2(seconds * 1e6) * _LATENCY_STEPS) if seconds > 1e-6 else 0
+        self.latencies[bucket] = self.latencies.get(bucket, 0) + 1
+
+    def latency_percentile (self, q):
+        """Upper bound, in ms, of the histogram bucket holding the q quantile of the per-record latencies."""
+        total = sum(self.latencies.values())
+        if not total:
+            return None
+        rank = min(total, int(q * total) + 1)
+        for bucket in sorted(self.latencies):
+            rank -= self.latencies[bucket]
+            if rank <= 0:
+                return round(2 ** ((bucket + 1) / _LATENCY_STEPS) / 1000, 4)
+
+    def progress (self):
+        if time.perf_counter() >= self._next_progress:
+            self._next_progress = time.perf_counter() + self.interval
+            self.write('running')
+
+    def to_dict (self, status):
+        elapsed = time.perf_counter() - self._started
+        return {
+            'tool': self.tool,
+            'status': status,
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(self.started_at)),
+            'elapsed_s': round(elapsed, 3),
+            'cpu_s': round(time.process_time(), 3),
+            'records': {'in': self.records_in, 'out': self.records_out, 'rejected': self.rejected, 'replayed': self.replayed,
+                        'per_sec': round(self.records_in / elapsed, 1) if elapsed > 0 else None},
+            'stages': {name: {'wall_s': round(wall, 6), 'cpu_s': round(cpu, 6)} for name, (wall, cpu) in self.stages.items()},
+            'checks': self.checks.to_dict(),
+            'latency_ms': {'p50': self.latency_percentile(0.50), 'p99': self.latency_percentile(0.99),
+                           'max': round(max(self.slowest)[0] * 1000, 4) if self.slowest else None},
+            'slowest_records': [{'id': request_id, 'seconds': round(seconds, 6)} for seconds, request_id in sorted(self.slowest, reverse=True)],
+        }
+
+    def write (self, status):
+        """Replace the metrics file atomically so a reader never sees a partial JSON document."""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp', delete=False) as tmp_file:
+                json.dump(self.to_dict(status), tmp_file, indent=2)
+            os.replace(tmp_file.name, self.path)
+        except OSError as e:
+            print (f"[WARNING] Could not write metrics to {self.path}: {e}", file=sys.stderr)
+
+    def close (self):
+        atexit.unregister(self.close)
+        self.write('done')
+
+def timed_stage (metrics, name):
+    """metrics.stage(name), or a no-op context when metrics are off."""
+    return metrics.stage(name) if metrics is not None else nullcontext()
@@ -0,0 +1,88 @@
+RECORD_ID_FIELDS = ['processid', 'sampleid']      # in order of precedence for the specimen key
+
+class IdentityConflict (Exception):
+    pass
+
+def record_identifiers (values):
+    """
+    The (field, value) pairs of the record identifiers set in values (field -> value), in order of precedence.
+    Values are compared as text; the field name is part of the identifier, so processid 'X' and sampleid 'X' are
+    different specimens.
+    """
+    return [(field, str(values[field])) for field in RECORD_ID_FIELDS if values.get(field) not in (None, '')]
+
+def specimen_key (identifiers):
+    field, value = identifiers[0]
+    return f"{field}:{value}"
+
+class IdentityIndex:
+    """
+    Maps record identifiers to one key per specimen: the specimen_key of the identifiers it was first seen with.  A
+    record naming processid P and sampleid S links both to its specimen, so a later record carrying only one of
+    them resolves to the same key.  Kept in dicts; SqliteIdentityIndex keeps it in a table.
+    """
+    def __init__ (self):
+        self.keys = {}            # (field, value) -> specimen key
+        self.identities = {}      # specimen key -> {field: value}
+
+    def _lookup (self, field, value):
+        return self.keys.get((field, value))
+
+    def _identity (self, key):
+        return self.identities.get(key, {})
+
+    def _register (self, field, value, key):
+        self.keys[(field, value)] = key
+        self.identities.setdefault(key, {})[field] = value
+
+    def resolve (self, identifiers):
+        """
+        Returns the specimen key for identifiers (as returned by record_identifiers), registering the ones not seen
+        before.  Raises IdentityConflict if they name two known specimens, or a field value other than the one
+        the specimen already has.
+        """
+        keys = []
+        for field, value in identifiers:
+            key = self._lookup (field, value)
+            if key is not None and key not in keys:
+                keys.append(key)
+        if len(keys) > 1:
+            raise IdentityConflict (f"{' and '.join (f'{field} {value}' for field, value in identifiers)} belong to different specimens")
+        if not keys:
+            key = specimen_key (identifiers)
+            for field, value in identifiers:
+                self._register (field, value, key)
+            return key
+
+        key = keys[0]
+        known = self._identity (key)
+        for field, value in identifiers:
+            if field in known and known[field] != value:
+                raise IdentityConflict (f"{field} {value} conflicts with {field} {known[field]} of the same specimen")
+        for field, value in identifiers:
+            if field not in known:
+                self._register (field, value, key)
+        return key
+
+class SqliteIdentityIndex (IdentityIndex):
+    """IdentityIndex kept in a table of an open SQLite connection, for indexes that outgrow memory or persist."""
+    def __init__ (self, conn, table='record_identifiers'):
+        self.conn = conn
+        self.table = table
+        conn.execute(f'CREATE TABLE IF NOT EXISTS "{table}" (field TEXT NOT NULL, value TEXT NOT NULL, specimen_key TEXT NOT NULL, PRIMARY KEY (field, value))')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS "{table}_specimen_key" ON "{table}" (specimen_key)')
+
+    def _lookup (self, field, value):
+        row = self.conn.execute(f'SELECT specimen_key FROM "{self.table}" WHERE field = ? AND value = ?', (field, value)).fetchone()
+        return row[0] if row else None
+
+    def _identity (self, key):
+        return dict(self.conn.execute(f'SELECT field, value FROM "{self.table}" WHERE specimen_key = ?', (key,)))
+
+    def _register (self, field, value, key):
+        self.conn.execute(f'INSERT INTO "{self.table}" (field, value, specimen_key) VALUES (?, ?, ?)', (field, value, key))
+
+    def load (self, index):
+        """Copies the entries of an in-memory IdentityIndex."""
+        self.conn.executemany(f'INSERT INTO "{self.table}" (field, value, specimen_key) VALUES (?, ?, ?)',
+                              ((field, value, key) for (field, value), key in index.keys.items()))
@@ -0,0 +1,85 @@
+import shutil
+import sys
+import tempfile
+
+_SPOOL_MEMORY = 8 * 1024 * 1024      # bytes kept in memory before a batch spool rolls over to disk
+
+class TransactionalOutput:
+    """
+    stdout writer for all-or-nothing mode.  The accepted lines of the current batch are spooled to a temporary file
+    (in memory up to spool_memory bytes, on disk beyond that) and copied to stdout only when the batch commits, so
+    memory use does not grow with the input size.
+
+    Without batch_size the whole input is a single batch.  With batch_size every batch_size records form their own
+    all-or-nothing batch and a commit/abort summary is written to stderr for each of them.
+    """
+    def __init__ (self, batch_size=None, spool_memory=_SPOOL_MEMORY, stream=None):
+        if batch_size is not None and batch_size < 1:
+            raise ValueError (f"batch_size must be positive, got {batch_size}")
+        self.batch_size = batch_size
+        self.spool_memory = spool_memory
+        self.stream = stream
+        self.batch_number = 0
+        self.committed_batches = 0
+        self.aborted_batches = 0
+        self.records_seen = 0
+        self._open_batch()
+
+    def _open_batch (self):
+        self.batch_number += 1
+        self.batch_start = self.records_seen + 1
+        self.batch_records = 0
+        self.batch_errors = 0
+        self.spool = tempfile.SpooledTemporaryFile(max_size=self.spool_memory)
+
+    @property
+    def failed (self):
+        """True if the current batch already contains a rejected record."""
+        return self.batch_errors > 0
+
+    def write (self, line):
+        """Add the output line (str or bytes) of an accepted record to the current batch."""
+        self.spool.write(line.encode('utf-8') if isinstance(line, str) else line)
+        self.spool.write(b'\n')
+        self._end_record()
+
+    def reject (self):
+        """Count a rejected record; the current batch will be aborted."""
+        self.batch_errors += 1
+        self._end_record()
+
+    def _end_record (self):
+        self.records_seen += 1
+        self.batch_records += 1
+        if self.batch_size is not None and self.batch_records >= self.batch_size:
+            self._close_batch()
+            self._open_batch()
+
+    def _close_batch (self):
+        if self.batch_errors == 0:
+            sys.stdout.flush()
+            out = self.stream or sys.stdout.buffer
+            self.spool.seek(0)
+            shutil.copyfileobj(self.spool, out)
+            out.flush()
+            self.committed_batches += 1
+        else:
+            self.aborted_batches += 1
+        self.spool.close()
+
+        if self.batch_size is not None:
+            batch_range = f"({self.batch_start}-{self.records_seen})"
+            if self.batch_errors == 0:
+                print (f"[BATCH {self.batch_number}] committed: {self.batch_records} records {batch_range}", file=sys.stderr)
+            else:
+                print (f"[BATCH {self.batch_number}][ABORT] all-or-nothing: {self.batch_errors} of {self.batch_records} records invalid {batch_range}, batch discarded", file=sys.stderr)
+
+    def close (self):
+        """
+        Commit or abort the last batch.  Returns True if every batch was committed.
+        """
+        if self.batch_records > 0:
+            self._close_batch()
+        else:
+            self.spool.close()
+        return self.aborted_batches == 0
@@ -1,23 +1,34 @@
 import argparse
-import json, sys, os, csv
-
-import urllib.parse
-
-__ACCEPTED_RECORDID_FIELDS = ['processid', 'sampleid']
+import sys, os
+import time
+
+sys.path.append (os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from transactional_output import TransactionalOutput
+from compiled_tables import read_table
+from metrics import Metrics, timed_stage
+from checkpoint import open_checkpoint
+from jsonl_io import JsonlWriter, dumps, loads, read_lines
+from fk_resolver import ForeignKeyResolver
+from coalesce import Coalescer
+from record_identity import RECORD_ID_FIELDS, IdentityConflict, record_identifiers
+
+__ACCEPTED_RECORDID_FIELDS = RECORD_ID_FIELDS
 __EXCLUDED_FIELDS = ['record_id']
+metrics = None      # Metrics when --metrics-out is set
 
 
 ########## Helper Functions ##########
 
+def get_record_identifiers (json_obj):
+    """The (field, value) identifiers of a submission, processid first; raises if it has neither processid nor sampleid."""
+    identifiers = record_identifiers (json_obj['submission_packet'])
+    if not identifiers:
+        raise Exception (f"[ERROR][Request {json_obj['id']}] {' or '.join (__ACCEPTED_RECORDID_FIELDS)} is required.")
+    return identifiers
+
 def convert_upload_single_package (json_obj, bcdm_to_bold_mapping):
     data_json = json_obj['submission_packet']
-    
-    record_identifier = None
-    for field in __ACCEPTED_RECORDID_FIELDS:
-        if field in data_json and data_json[field]:
-            record_identifier = data_json[field]
-    if record_identifier is None:
-        raise Exception (f"[ERROR][Request {json_obj['id']}] {' or '.join (__ACCEPTED_RECORDID_FIELDS)} is required.")
+    get_record_identifiers (json_obj)
 
     converted_obj = {}
     for bcdm_field in bcdm_to_bold_mapping:
@@ -32,66 +43,174 @@ def convert_upload_single_package (json_obj, bcdm_to_bold_mapping):
                 converted_obj [bcdm_field][0]['value']= None   # This translate to null in DB
     return converted_obj #{record_identifier:converted_obj}
 
-def get_bcdm_to_bold_mapping (excluded_fields=None):   
+def get_array_fields (bcdm_def):
+    """BCDM fields holding comma separated lists."""
+    return [row['field'] for row in read_table (bcdm_def) if row.get('field') and row.get('data_type') in ('array', 'array of string')]
+
+def get_bcdm_to_bold_mapping (excluded_fields=None, filepath=None):   
     """
     This function returned a dictionary of db_field mapping where the keys are the universal fields.  If the optional param excluded_fields 
-    is provided, the fields matching to ones in this list will NOT be returned.
+    is provided, the fields matching to ones in this list will NOT be returned.  filepath defaults to the --mapping argument.
     """
     delimiter = '__'
-    filepath = args.mapping
+    filepath = filepath or args.mapping
     db_mapping = {}
 
-    with open (filepath ) as mapping_file:
-        rows = csv.DictReader(mapping_file, delimiter="\t")
-        for row in rows:
-            if len(row)==0: continue
-            if not excluded_fields or row['bcdm_field'] not in excluded_fields:        # Remove this after testing. 
-                info = row['bold_field'].split('.')
-                if len(info) >2: # foreign key
-                    #print (info, file=sys.stderr)
-                    table = info[0].split(delimiter)[0] + delimiter + info[1]
-                    field = info[0].split(delimiter)[1] + delimiter + info[2]
-                else: 
-                    table = info[0]
-                    field = info [1]
-                db_mapping [row['bcdm_field']]= {'db': 'newdb12','table': table, 'field': field}
+    for row in read_table (filepath):
+        if len(row)==0: continue
+        if not excluded_fields or row['bcdm_field'] not in excluded_fields:        # Remove this after testing. 
+            info = row['bold_field'].split('.')
+            if len(info) >2: # foreign key
+                #print (info, file=sys.stderr)
+                table = info[0].split(delimiter)[0] + delimiter + info[1]
+                field = info[0].split(delimiter)[1] + delimiter + info[2]
+            else: 
+                table = info[0]
+                field = info [1]
+            db_mapping [row['bcdm_field']]= {'db': 'newdb12','table': table, 'field': field, 
+                'sub_table_field': (row.get('sub_table_field') or '').strip(), 
+                'constraint': (row.get('constraint') or '').strip(), 
+                'policy': (row.get('policy') or '').strip()}
 
     return db_mapping
 
 
+def read_batches (stream, batch_size):
+    batch = []
+    for line in stream:
+        batch.append (line)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def convert_batch (lines, bcdm_to_bold_mapping, resolver=None):
+    """
+    Converts a batch of JSONL lines.  Returns a (sub_obj, converted_obj, error) triple per line, error being the
+    exception to report for records that could not be converted.  If a ForeignKeyResolver is given, the foreign keys of the whole
+    batch are resolved together.
+    """
+    results = []
+    timings = []
+    for line in lines:
+        if metrics is not None:
+            start = time.perf_counter()
+        sub_obj = loads(line)
+        try:
+            converted_obj = convert_upload_single_package (sub_obj, bcdm_to_bold_mapping) 
+            if not converted_obj: 
+                raise Exception (f"[ERROR][Request {sub_obj['id']}]Error converting bcdm record to upload json object")
+            results.append ((sub_obj, converted_obj, None))
+        except Exception as e:
+            results.append ((sub_obj, None, e))
+        if metrics is not None:
+            timings.append (time.perf_counter() - start)
+
+    if resolver is not None:
+        converted = [(i, result[1]) for i, result in enumerate(results) if result[1] is not None]
+        with timed_stage (metrics, 'resolve_fk'):
+            unresolved = resolver.resolve ([converted_obj for _, converted_obj in converted])
+        for (i, _), failures in zip (converted, unresolved):
+            if failures:
+                sub_obj = results[i][0]
+                details = ', '.join (f"{field}='{value}'" for field, value in failures)
+                results[i] = (sub_obj, None, Exception (f"[ERROR][Request {sub_obj['id']}] Unresolved foreign key: {details}"))
+    if metrics is not None:
+        for (sub_obj, _, error), seconds in zip (results, timings):
+            metrics.record (sub_obj.get('id'), seconds, error is None)
+    return results
+
 def main(args):
+    global metrics
 
     # Param processing
-    if not os.path.exists(args.mapping):
-        print ( f"[ABORT] Mapping file path not found: {args.mapping}", file=sys.stderr)
-        sys.exit (1)
+    if args.reference_db:
+        mapping_dir = os.path.dirname(os.path.abspath(args.mapping))
+        args.bcdm_def = args.bcdm_def or os.path.join(mapping_dir, 'field_definitions.tsv')
+        args.countries = args.countries or os.path.join(mapping_dir, 'registered_soverign_and_maritime_areas.tsv')
+    for filepath in (args.mapping, args.reference_db, args.bcdm_def, args.countries):
+        if filepath and not os.path.exists(filepath):
+            print ( f"[ABORT] Mapping file path not found: {filepath}", file=sys.stderr)
+            sys.exit (1)
 
     count_rows = 0 #len(list(reader))
     error_records = []
 
     # Input Submission Processing (ALL or NOTHING)
-    bcdm_to_bold_mapping = get_bcdm_to_bold_mapping(__EXCLUDED_FIELDS)
-
-    results = []        # Only use if all_or_nothing
-    for line in sys.stdin:
-        sub_obj = json.loads(line.strip("\n"))
-        try:
-            converted_obj = convert_upload_single_package (sub_obj, bcdm_to_bold_mapping) 
-            if not converted_obj: 
-                raise Exception (f"[ERROR][Request {sub_obj['id']}]Error converting bcdm record to upload json object")
-            else:  
-                if not args.all_or_nothing:
-                    print (json.dumps(converted_obj))
+    if args.metrics_out:
+        metrics = Metrics ('3_convert_BCDM_to_DB', args.metrics_out, args.metrics_slowest)
+    with timed_stage (metrics, 'load'):
+        bcdm_to_bold_mapping = get_bcdm_to_bold_mapping(__EXCLUDED_FIELDS)
+        resolver = None
+        if args.reference_db:
+            resolver = ForeignKeyResolver (args.reference_db, bcdm_to_bold_mapping, args.fk_cache_size, get_array_fields (args.bcdm_def), args.countries)
+
+    output = TransactionalOutput (args.batch_size) if args.all_or_nothing else None       # Only use if all_or_nothing
+    coalescer = Coalescer (bcdm_to_bold_mapping, args.coalesce_memory) if args.coalesce else None
+    checkpoint = open_checkpoint (args, __file__, ['mapping', 'reference_db', 'bcdm_def', 'countries'])
+    stdout = JsonlWriter ()
+    aborted = False
+    with timed_stage (metrics, 'convert'):
+        for lines in read_batches (read_lines (), args.fk_batch_size if resolver else 1):
+            replays, fresh = checkpoint.split (lines) if checkpoint else ([None] * len(lines), lines)
+            converted = iter (convert_batch (fresh, bcdm_to_bold_mapping, resolver)) if fresh else None
+            for line, replay in zip (lines, replays):
+                if replay is None:
+                    sub_obj, converted_obj, error = next (converted)
+                    output_line = dumps(converted_obj) if error is None and (coalescer is None or checkpoint) else None
+                    if checkpoint:
+                        checkpoint.store (line, error is None, output_line, '' if error is None else str(error))
                 else:
-                    results.append (json.dumps(converted_obj))
-        except Exception as e: 
-            print (e, file=sys.stderr)
-            if args.all_or_nothing:
-                print (f"[ABORT] all-or-nothing: detected invalid record. ", file=sys.stderr)
+                    accepted, output_line, err_text = replay
+                    error = None if accepted else err_text
+                    if metrics is not None:
+                        metrics.record (None, 0.0, accepted, replayed=True)
+                    if accepted and coalescer is not None:
+                        sub_obj, converted_obj = loads(line), loads(output_line)
+                if error is None and coalescer is not None:
+                    try:
+                        coalescer.add (get_record_identifiers (sub_obj), converted_obj)
+                        continue
+                    except IdentityConflict as e:
+                        error = f"[ERROR][Request {sub_obj['id']}] {e}"
+                if error is None:
+                    if not args.all_or_nothing:
+                        stdout.write (output_line)
+                    else:
+                        output.write (output_line)
+                    continue
+                print (error, file=sys.stderr)
+                if args.all_or_nothing:
+                    output.reject()
+                    if args.batch_size is None:
+                        print (f"[ABORT] all-or-nothing: detected invalid record. ", file=sys.stderr)
+                        aborted = True
+                        break
+            if aborted:
                 break
-                
-    if len(results) > 0:
-        print ("\n".join (results))
+
+    if coalescer is not None:
+        # Merged objects are only complete at the end of the stream
+        with timed_stage (metrics, 'coalesce'):
+            if not aborted:
+                for converted_obj in coalescer:
+                    if not args.all_or_nothing:
+                        stdout.write (dumps(converted_obj))
+                    else:
+                        output.write (dumps(converted_obj))
+                spilled = " (index spilled to disk)" if coalescer.spilled else ""
+                print (f"[INFO] coalesced {coalescer.added} records into {coalescer.specimens} specimens{spilled}", file=sys.stderr)
+            coalescer.close()
+    stdout.flush()
+    if resolver:
+        print (f"[INFO] foreign keys resolved with {resolver.queries} queries", file=sys.stderr)
+    with timed_stage (metrics, 'commit'):
+        committed = output.close() if output else True
+    if checkpoint:
+        checkpoint.close()
+    if not committed:
+        sys.exit (1)
         
 if __name__ == "__main__":
     
@@ -106,7 +225,28 @@ Usage: python orchestrator_submission.py --data-tsv data_records.tsv --server-ur
     #parser.add_argument("--update", default=False, action=argparse.BooleanOptionalAction, help="If set, record existence is required to proceed with the update. Otherwise, new record submission is requested.")
     parser.add_argument("--mapping", type=str, required=True, help="File path for the BCDM field to BOLD DB field mapping")
     parser.add_argument("--all-or-nothing", action="store_true", help="True indicates all or nothing mode")
+    parser.add_argument("--batch-size", type=int, required=False, help="If set, the all-or-nothing applies to each batch.  Alternatively, all records submitted will be converted in single batch.")
+    parser.add_argument("--reference-db", type=str, required=False, help="SQLite snapshot of the reference tables (geopol, tax, inst, primer).  If set, foreign key values are resolved to ids ('fk_id').")
+    parser.add_argument("--bcdm-def", type=str, required=False, help="Path to the BCDM definition file, for the array fields whose comma separated terms are resolved one by one (only used with --reference-db).  Defaults to field_definitions.tsv next to --mapping.")
+    parser.add_argument("--countries", type=str, required=False, help="File path for the country/ISO list, to match country/ocean and country_iso as validation does (only used with --reference-db).  Defaults to registered_soverign_and_maritime_areas.tsv next to --mapping.")
+    parser.add_argument("--fk-batch-size", type=int, default=1000, help="Number of records whose foreign keys are resolved together (only used with --reference-db).")
+    parser.add_argument("--fk-cache-size", type=int, default=100000, help="Number of resolved foreign key values kept in the LRU cache.")
+    parser.add_argument("--coalesce", action="store_true", help="Merge repeated updates of a specimen (same processid/sampleid) into one converted object, later values over earlier ones.  Output is written once the input has been read.")
+    parser.add_argument("--coalesce-memory", type=int, default=100000, help="Number of specimens kept in memory before the coalescing index spills to a temporary SQLite file (only used with --coalesce).")
+    parser.add_argument("--checkpoint", type=str, required=False, help="SQLite file recording the output or error of every converted line.  On a rerun, lines already in it are replayed instead of converted (and resolved).")
+    parser.add_argument("--metrics-out", type=str, required=False, help="If set, per-stage timings, record counts and the slowest records are written to this JSON file (periodically while running and at exit).")
+    parser.add_argument("--metrics-slowest", type=int, default=10, help="Number of slowest records kept in the metrics (only used with --metrics-out).")
 
     args = parser.parse_args()
+
+    # Enforce dependency
+    if args.batch_size is not None and args.batch_size < 1:
+        parser.error("--batch-size must be positive")
+    if args.batch_size is not None and not args.all_or_nothing:
+        parser.error("--batch-size requires --all-or-nothing")
+    if args.fk_batch_size < 1:
+        parser.error("--fk-batch-size must be positive")
+    if args.coalesce and args.batch_size is not None:
+        parser.error("--coalesce applies all-or-nothing to the whole input and cannot be combined with --batch-size")
  
     main(args)
@@ -1,21 +1,37 @@
 import argparse
-import json, sys, os, csv
+import sys, os
+import time
 
-import pandas as pd
+sys.path.append (os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from transactional_output import TransactionalOutput
+from compiled_tables import read_table
+from metrics import Metrics, timed_stage
+from checkpoint import open_checkpoint
+from jsonl_io import JsonlWriter, dumps, loads, read_lines
+
+metrics = None      # Metrics when --metrics-out is set
 
 ########## Helper Functions ##########
 
 def get_verbatim_mapping (mapping_verbatim_to_bold):
-    return pd.read_csv(mapping_verbatim_to_bold, sep="\t")  # columns: bcdm_field, bold_field
+    """
+    Returns a bold_field -> verbatim_field dictionary (columns: verbatim_field, bold_field).  The first row wins when
+    a bold_field is listed more than once.
+    """
+    verbatim_mapping = {}
+    for row in read_table (mapping_verbatim_to_bold):
+        verbatim_mapping.setdefault (row['bold_field'], row['verbatim_field'])
+    return verbatim_mapping
     
 def get_verbatim_mapping_OLD (mapping_verbatim_to_bold, mapping_bcdm_to_bold):
+    import pandas as pd
     df1 = pd.read_csv(mapping_verbatim_to_bold, sep="\t")  # columns: bcdm_field, bold_field
     df2 = pd.read_csv(mapping_bcdm_to_bold, sep="\t")  # columns: bold_field, verbatim_field
 
     merged_df = pd.merge(df1, df2, on="bold_field", how="left")
     return merged_df
 
-def modify_update_obj (update_json, mapping_DF, mode = "add"):
+def modify_update_obj (update_json, verbatim_mapping, mode = "add"):
     verbatim_db_mapping = {}
     for bcdm_field in update_json.keys():
         #print (f"In function modify_update_obj for field {bcdm_field}")
@@ -23,11 +39,10 @@ def modify_update_obj (update_json, mapping_DF, mode = "add"):
         live_db_field_name = update_json[bcdm_field][0]['db_field'].split("__")[0]
         
         lookup_bold_field = live_db_table_name+'.'+live_db_field_name
-        if (mapping_DF['bold_field'] == lookup_bold_field).any():
+        if lookup_bold_field in verbatim_mapping:
             #print (f"\t\tFound bold_field in mapping{lookup_bold_field}")
-            row = mapping_DF.loc[mapping_DF['bold_field']== lookup_bold_field].iloc[0].to_dict()
-            verbatim_table = row['verbatim_field'].split(".")[0]
-            verbatim_field = row['verbatim_field'].split(".")[1]
+            verbatim_table = verbatim_mapping[lookup_bold_field].split(".")[0]
+            verbatim_field = verbatim_mapping[lookup_bold_field].split(".")[1]
         
             if mode == 'add':
                 update_json[bcdm_field].append ({'db_table': verbatim_table, 'db_field': verbatim_field, 'value': update_json[bcdm_field][0]['value']})
@@ -37,6 +52,7 @@ def modify_update_obj (update_json, mapping_DF, mode = "add"):
 
                 
 def main(args):
+    global metrics
 
     if not os.path.exists(args.mapping_verbatim):
         print ( f"[ABORT] Mapping file path not found: {args.mapping_verbatim}", file=sys.stderr)
@@ -44,27 +60,59 @@ def main(args):
 
     # Input Submission Processing (ALL or NOTHING)
     excluded_fields = ['record_id']
-    vebatim_to_bold_mapping_DF = get_verbatim_mapping (args.mapping_verbatim) #get_verbatim_mapping (args.mapping_verbatim, args.mapping)
+    if args.metrics_out:
+        metrics = Metrics ('4_convert_to_verbatim', args.metrics_out, args.metrics_slowest)
+    with timed_stage (metrics, 'load'):
+        verbatim_mapping = get_verbatim_mapping (args.mapping_verbatim) #get_verbatim_mapping (args.mapping_verbatim, args.mapping)
+    checkpoint = open_checkpoint (args, __file__, ['mapping_verbatim', 'mode'])
+
+    output = TransactionalOutput (args.batch_size) if args.all_or_nothing else None
+    stdout = JsonlWriter ()
+    with timed_stage (metrics, 'convert'):
+        for line_number, line in enumerate (read_lines (), 1):
+            replay = checkpoint.lookup (line) if checkpoint else None
+            if metrics is not None:
+                start = time.perf_counter()
+            if replay is None:
+                update_obj = loads(line)
+            try:
+                if replay is not None:
+                    converted, converted_line, err_text = replay
+                    if not converted:
+                        raise Exception (err_text)
+                else:
+                    modify_update_obj (update_obj, verbatim_mapping, args.mode)
+                    converted_line = dumps(update_obj)
+                    if checkpoint:
+                        checkpoint.store (line, True, converted_line)
+
+                if args.all_or_nothing:
+                    output.write (converted_line)
+                else:
+                    stdout.write (converted_line)
+                if metrics is not None:
+                    metrics.record (f"line {line_number}", time.perf_counter() - start, True, replayed=replay is not None)     # converted objects carry no request id
+                
+            except Exception as e: 
+                print (e, file=sys.stderr)
+                if checkpoint and replay is None:
+                    checkpoint.store (line, False, None, str(e))
+                if metrics is not None:
+                    metrics.record (f"line {line_number}", time.perf_counter() - start, False, replayed=replay is not None)
+                if args.all_or_nothing:
+                    output.reject()
+                    if args.batch_size is None:
+                        print (f"[ABORT] all-or-nothing: detected invalid record. ", file=sys.stderr)
+                        break
 
-    results =[]
-    for line in sys.stdin:
-        update_obj = json.loads(line.strip("\n"))
-        try:
-            modify_update_obj (update_obj, vebatim_to_bold_mapping_DF, args.mode)
-            
-            if args.all_or_nothing:
-                results.append (json.dumps(update_obj))
-            else:
-                print (json.dumps(update_obj))
-            
-        except Exception as e: 
-            print (e, file=sys.stderr)
-            if args.all_or_nothing:
-                print (f"[ABORT] all-or-nothing: detected invalid record. ", file=sys.stderr)
-                break
+    stdout.flush()
+    with timed_stage (metrics, 'commit'):
+        committed = output.close() if output else True
+    if checkpoint:
+        checkpoint.close()
+    if not committed:
+        sys.exit (1)
 
-    if len(results) > 0:
-        print ("\n".join (results))
 if __name__ == "__main__":
     
     parser = argparse.ArgumentParser(
@@ -76,6 +124,16 @@ Usage: python orchestrator_submission.py --data-tsv data_records.tsv --server-ur
     parser.add_argument("--mapping-verbatim", type=str, required=True, help="File path for the verbatim to BOLD DB field mapping")
     parser.add_argument("--mode", type = str, required=False, choices = ["add", "replace"], default="add")
     parser.add_argument("--all-or-nothing", action="store_true", help="True indicates all or nothing mode")
+    parser.add_argument("--batch-size", type=int, required=False, help="If set, the all-or-nothing applies to each batch.  Alternatively, all records submitted will be converted in single batch.")
+    parser.add_argument("--checkpoint", type=str, required=False, help="SQLite file recording the output or error of every converted line.  On a rerun, lines already in it are replayed instead of converted.")
+    parser.add_argument("--metrics-out", type=str, required=False, help="If set, per-stage timings, record counts and the slowest records are written to this JSON file (periodically while running and at exit).")
+    parser.add_argument("--metrics-slowest", type=int, default=10, help="Number of slowest records kept in the metrics (only used with --metrics-out).")
     args = parser.parse_args()
+
+    # Enforce dependency
+    if args.batch_size is not None and args.batch_size < 1:
+        parser.error("--batch-size must be positive")
+    if args.batch_size is not None and not args.all_or_nothing:
+        parser.error("--batch-size requires --all-or-nothing")
  
     main(args)
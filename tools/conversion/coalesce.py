@@ -0,0 +1,106 @@
+import os
+import sqlite3
+import tempfile
+
+from jsonl_io import dumps, loads
+from record_identity import IdentityIndex, SqliteIdentityIndex
+
+_APPEND_POLICY = 'append'
+
+def merge_converted (earlier, later, policies):
+    """
+    Merges two converted objects of the same specimen, later over earlier.  Every field follows last writer wins,
+    an explicit empty value (None, a DB null) included, except fields with the 'append' policy: their db entries
+    are accumulated in submission order, duplicates and empty values being skipped, so a later request can add a
+    province but never clears the ones before it.
+    """
+    for bcdm_field, entries in later.items():
+        if policies.get(bcdm_field) != _APPEND_POLICY or bcdm_field not in earlier:
+            earlier[bcdm_field] = entries
+            continue
+        merged = [entry for entry in earlier[bcdm_field] if entry['value'] not in (None, '')]
+        seen = [entry['value'] for entry in merged]
+        for entry in entries:
+            if entry['value'] not in (None, '') and entry['value'] not in seen:
+                merged.append(entry)
+                seen.append(entry['value'])
+        earlier[bcdm_field] = merged or entries
+    return earlier
+
+class Coalescer:
+    """
+    Collects converted objects by specimen and merges repeated updates of a specimen with merge_converted, so one
+    object per specimen is written in order of first appearance.  Records are matched on their (field, value)
+    identifiers through an IdentityIndex, so an update naming only the processid meets one naming processid and
+    sampleid.  Up to memory_records specimens are kept in a dict; beyond that objects and index spill to a temporary
+    SQLite file keyed on the specimen key and the merge continues on disk.
+    """
+    def __init__ (self, bcdm_to_bold_mapping, memory_records=100000, spill_dir=None):
+        self.policies = {bcdm_field: info.get('policy', '') for bcdm_field, info in bcdm_to_bold_mapping.items()}
+        self.memory_records = memory_records
+        self.spill_dir = spill_dir
+        self.records = {}       # specimen key -> converted object, while in memory
+        self.index = IdentityIndex ()
+        self.conn = None        # SQLite file once spilled
+        self.spill_path = None
+        self.added = 0
+        self.specimens = 0
+
+    @property
+    def spilled (self):
+        return self.conn is not None
+
+    def add (self, identifiers, converted_obj):
+        """
+        Adds the converted object of a record with the given (field, value) identifiers (see record_identifiers).
+        Raises IdentityConflict, leaving the collected specimens unchanged, if the identifiers contradict earlier ones.
+        """
+        key = self.index.resolve (identifiers)
+        self.added += 1
+        if self.conn is None:
+            if key in self.records:
+                merge_converted (self.records[key], converted_obj, self.policies)
+                return
+            self.records[key] = converted_obj
+            self.specimens += 1
+            if len(self.records) > self.memory_records:
+                self._spill()
+            return
+
+        row = self.conn.execute("SELECT obj FROM records WHERE specimen_key = ?", (key,)).fetchone()
+        if row is not None:
+            merged = merge_converted (loads(row[0]), converted_obj, self.policies)
+            self.conn.execute("UPDATE records SET obj = ? WHERE specimen_key = ?", (dumps(merged), key))
+        else:
+            self.conn.execute("INSERT INTO records (specimen_key, obj) VALUES (?, ?)", (key, dumps(converted_obj)))
+            self.specimens += 1
+
+    def _spill (self):
+        fd, self.spill_path = tempfile.mkstemp(prefix='bcdm-coalesce-', suffix='.db', dir=self.spill_dir)
+        os.close(fd)
+        self.conn = sqlite3.connect(self.spill_path)
+        self.conn.execute("PRAGMA journal_mode = OFF")
+        self.conn.execute("PRAGMA synchronous = OFF")
+        self.conn.execute("CREATE TABLE records (seq INTEGER PRIMARY KEY, specimen_key TEXT UNIQUE NOT NULL, obj TEXT NOT NULL)")
+        self.conn.executemany("INSERT INTO records (specimen_key, obj) VALUES (?, ?)",
+                              ((key, dumps(converted_obj)) for key, converted_obj in self.records.items()))
+        index = SqliteIdentityIndex (self.conn)
+        index.load (self.index)
+        self.records = {}
+        self.index = index
+
+    def __iter__ (self):
+        """Yields the coalesced converted objects in order of first appearance."""
+        if self.conn is None:
+            yield from self.records.values()
+            return
+        for (obj,) in self.conn.execute("SELECT obj FROM records ORDER BY seq"):
+            yield loads(obj)
+
+    def close (self):
+        self.records = {}
+        self.index = IdentityIndex ()
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+            os.remove(self.spill_path)
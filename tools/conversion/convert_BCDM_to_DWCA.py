@@ -0,0 +1,261 @@
+import argparse
+import json, sys, os
+import re
+import time
+import zipfile
+import xml.etree.ElementTree as ET
+from datetime import date, datetime
+from functools import lru_cache
+
+sys.path.append (os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from compiled_tables import read_table
+from jsonl_io import loads, read_lines
+
+__ACCEPTED_RECORDID_FIELDS = ['processid', 'sampleid']
+_DWC_NS = 'http://rs.tdwg.org/dwc/terms/'
+_ARRAY_TYPES = ('array', 'array of string')
+_ARRAY_SEPARATOR = ' | '       # GBIF's recommended delimiter for multiple values in one DwC term
+_WRITE_LINES = 1000            # occurrence lines buffered per write into the zip
+
+########## Value Converters ##########
+
+def _number (value, cast):
+    """value as DwC text if cast accepts it; submitted text is kept as is so no precision or notation changes."""
+    cast(value)
+    return value.strip() if isinstance(value, str) else str(value)
+
+def _format_regex (data_format):
+    regex = re.escape(data_format)
+    for placeholder in ('%s', '%d', '%f'):
+        regex = regex.replace(re.escape(placeholder), '(.+?)')
+    return re.compile(regex)
+
+def compile_reformat (bcdm_format, dwc_format):
+    """
+    Returns a converter moving the placeholder values of a bcdm_format (e.g. 'BOLD:%s') into dwc_format.  A value not
+    written in bcdm_format is used as the single placeholder value.
+    """
+    if bcdm_format == dwc_format:
+        return str
+    bcdm_regex = _format_regex(bcdm_format) if bcdm_format != 'default' else None
+    def reformat (value):
+        match = bcdm_regex.fullmatch(value) if bcdm_regex else None
+        parts = list(match.groups()) if match else [value]
+        return re.sub(r'%[sdf]', lambda _: parts.pop(0) if parts else '', dwc_format)
+    return reformat
+
+def compile_converter (bcdm_type, bcdm_format, dwc_type, dwc_format):
+    """
+    Returns convert(value) -> [dwc values] for one mapping row, following its bcdm_type/dwc_type and
+    bcdm_format/dwc_format columns.  Raises ValueError for values that cannot be converted.
+    """
+    bcdm_format = bcdm_format or 'default'
+    dwc_format = dwc_format or 'default'
+
+    if dwc_format.startswith('{'):                 # vocabulary mapping, e.g. sex: {"M":"male",...}
+        terms = json.loads(dwc_format)
+        return lambda value: [terms.get(str(value), str(value))]
+
+    if bcdm_type == 'geopoint':                    # 'lat,lon' -> decimalLatitude, decimalLongitude
+        def convert_geopoint (value):
+            coordinates = value if isinstance(value, list) else str(value).split(',')
+            if len(coordinates) != 2:
+                raise ValueError(f"expected 2 coordinates, got {len(coordinates)}")
+            return [_number(coordinate, float) for coordinate in coordinates]
+        return convert_geopoint
+
+    if bcdm_type in _ARRAY_TYPES:
+        reformat = compile_reformat('default', dwc_format) if dwc_format != 'default' else str
+        def convert_array (value):
+            items = value if isinstance(value, list) else str(value).split(',')
+            return [_ARRAY_SEPARATOR.join(reformat(str(item).strip()) for item in items if str(item).strip())]
+        return convert_array
+
+    if bcdm_type == 'string:date':
+        dwc_format = dwc_format if dwc_format != 'default' else bcdm_format
+        if dwc_format == bcdm_format:
+            return lambda value: [str(value)]
+        @lru_cache(maxsize=65536)
+        def convert_date (value):
+            return [datetime.strptime(value, bcdm_format).strftime(dwc_format)]
+        return convert_date
+
+    if dwc_type in ('int', 'integer'):
+        return lambda value: [_number(value, int)]
+    if dwc_type in ('float', 'number'):
+        return lambda value: [_number(value, float)]
+
+    if bcdm_format != 'default' and dwc_format != 'default':
+        reformat = compile_reformat(bcdm_format, dwc_format)
+        return lambda value: [reformat(str(value))]
+    return lambda value: [value if isinstance(value, str) else json.dumps(value)]
+
+########## Mapping ##########
+
+class DwcColumn:
+    __slots__ = ('bcdm_field', 'terms', 'indexes', 'convert')
+
+    def __init__ (self, bcdm_field, terms, convert):
+        self.bcdm_field = bcdm_field
+        self.terms = terms
+        self.indexes = []
+        self.convert = convert
+
+def get_dwc_mapping (filepath):
+    """
+    Returns (terms, columns): the DwC terms of occurrence.txt in mapping order and one DwcColumn per mapped BCDM
+    field.  Rows without a dwc_field are dropped.  'decimalLatitude & decimalLongitude' splits a value over two
+    terms; 'country/waterBody' names alternative terms for one value.
+    """
+    terms = []
+    columns = []
+    for row in read_table (filepath):
+        if not row.get('bcdm_field') or not (row.get('dwc_field') or '').strip():
+            continue
+        column_terms = [term.strip() for term in re.split(r'\s*&\s*|/', row['dwc_field'].strip())]
+        convert = compile_converter (row['bcdm_type'], row.get('bcdm_format'), row.get('dwc_type'), row.get('dwc_format'))
+        column = DwcColumn (row['bcdm_field'], column_terms, convert)
+        for term in column_terms:
+            if term not in terms:
+                terms.append (term)
+            column.indexes.append (terms.index(term) + 1)       # column 0 is the record id
+        columns.append (column)
+    return terms, columns
+
+def get_water_bodies (filepath):
+    """country/ocean values that are water bodies: the registered areas without ISO codes (except the 'Exception - ' entries)."""
+    return {row['country/ocean'] for row in read_table (filepath)
+            if not row.get('iso_alpha3_code') and not row.get('iso_alpha2_code') and not row['country/ocean'].startswith('Exception')}
+
+def _clean (value):
+    return value.replace('\t', ' ').replace('\r', ' ').replace('\n', ' ')
+
+def convert_record (json_obj, columns, width, water_bodies=frozenset()):
+    """
+    Returns (occurrence row, warnings) for one submission object.  Values that cannot be converted are left empty.
+    """
+    packet = json_obj.get('submission_packet', json_obj)
+    row = [''] * width
+    row[0] = next((str(packet[field]) for field in __ACCEPTED_RECORDID_FIELDS if packet.get(field)), str(json_obj.get('id', '')))
+    warnings = []
+    for column in columns:
+        value = packet.get(column.bcdm_field)
+        if value in (None, '', []):
+            continue
+        try:
+            converted = column.convert(value)
+        except (ValueError, TypeError) as e:
+            warnings.append (f"[WARNING][Request {json_obj.get('id')}] Could not convert {column.bcdm_field} '{value}' to Darwin Core ({e}); value dropped.")
+            continue
+        if len(column.terms) == 2 and len(converted) == 1:       # alternative terms, e.g. country/waterBody
+            row[column.indexes[1] if isinstance(value, str) and value in water_bodies else column.indexes[0]] = _clean(converted[0])
+        else:
+            for index, dwc_value in zip (column.indexes, converted):
+                row[index] = _clean(dwc_value)
+    return row, warnings
+
+########## Archive Metadata ##########
+
+def build_meta_xml (terms):
+    archive = ET.Element('archive', {'xmlns': 'http://rs.tdwg.org/dwc/text/', 'metadata': 'eml.xml'})
+    core = ET.SubElement(archive, 'core', {'encoding': 'UTF-8', 'fieldsTerminatedBy': '\\t', 'linesTerminatedBy': '\\n', 'fieldsEnclosedBy': '',
+                                          'ignoreHeaderLines': '1', 'rowType': _DWC_NS + 'Occurrence'})
+    files = ET.SubElement(core, 'files')
+    ET.SubElement(files, 'location').text = 'occurrence.txt'
+    ET.SubElement(core, 'id', {'index': '0'})
+    for index, term in enumerate(terms, 1):
+        ET.SubElement(core, 'field', {'index': str(index), 'term': _DWC_NS + term})
+    ET.indent(archive)
+    return ET.tostring(archive, encoding='unicode', xml_declaration=True)
+
+def build_eml_xml (metadata):
+    """
+    EML (GBIF profile) dataset description from a data package descriptor such as package.metadata.template.json.
+    """
+    eml = ET.Element('eml:eml', {
+        'xmlns:eml': 'eml://ecoinformatics.org/eml-2.1.1',
+        'xmlns:xsi': 'http://www.w3.org/2001/XMLSchema-instance',
+        'xsi:schemaLocation': 'eml://ecoinformatics.org/eml-2.1.1 http://rs.gbif.org/schema/eml-gbif-profile/1.1/eml.xsd',
+        'packageId': str(metadata.get('id', '')), 'system': 'http://gbif.org', 'scope': 'system', 'xml:lang': 'en'})
+    dataset = ET.SubElement(eml, 'dataset')
+    ET.SubElement(dataset, 'title').text = metadata.get('title') or metadata.get('name', '')
+    contributors = metadata.get('contributors') or [{}]
+    for tag in ('creator', 'metadataProvider'):
+        ET.SubElement(ET.SubElement(dataset, tag), 'organizationName').text = contributors[0].get('title', '')
+    for contributor in contributors:
+        party = ET.SubElement(dataset, 'associatedParty')
+        ET.SubElement(party, 'organizationName').text = contributor.get('title', '')
+        ET.SubElement(party, 'role').text = contributor.get('role', '')
+    ET.SubElement(dataset, 'pubDate').text = date.today().isoformat()
+    ET.SubElement(dataset, 'language').text = 'en'
+    ET.SubElement(ET.SubElement(dataset, 'abstract'), 'para').text = metadata.get('description', '')
+    rights = ET.SubElement(dataset, 'intellectualRights')
+    for license in metadata.get('licenses', []):
+        ET.SubElement(rights, 'para').text = f"{license.get('title') or license.get('name', '')} ({license.get('path', '')})"
+    ET.SubElement(ET.SubElement(dataset, 'contact'), 'organizationName').text = contributors[0].get('title', '')
+    if metadata.get('version'):
+        ET.SubElement(ET.SubElement(eml, 'additionalMetadata'), 'metadata').text = f"version {metadata['version']}"
+    ET.indent(eml)
+    return ET.tostring(eml, encoding='unicode', xml_declaration=True)
+
+########## Export ##########
+
+def write_archive (stream, output_path, terms, columns, metadata, water_bodies=frozenset()):
+    """
+    Streams JSONL submissions from stream into occurrence.txt inside the zip at output_path, then adds meta.xml and
+    eml.xml.  Lines are converted and deflated as they are read, so memory does not grow with the input size.
+    Returns the number of records written.
+    """
+    width = len(terms) + 1
+    count = 0
+    with zipfile.ZipFile (output_path, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+        occurrence_info = zipfile.ZipInfo ('occurrence.txt', date_time=time.localtime()[:6])
+        occurrence_info.compress_type = zipfile.ZIP_DEFLATED
+        with archive.open (occurrence_info, 'w', force_zip64=True) as occurrence:
+            lines = ["\t".join(['id'] + terms)]
+            for line in stream:
+                if not line.strip(): continue
+                row, warnings = convert_record (loads(line), columns, width, water_bodies)
+                for warning in warnings:
+                    print (warning, file=sys.stderr)
+                lines.append ("\t".join(row))
+                count += 1
+                if len(lines) >= _WRITE_LINES:
+                    occurrence.write (("\n".join(lines) + "\n").encode('utf-8'))
+                    lines = []
+            if lines:
+                occurrence.write (("\n".join(lines) + "\n").encode('utf-8'))
+        archive.writestr ('meta.xml', build_meta_xml (terms))
+        archive.writestr ('eml.xml', build_eml_xml (metadata))
+    return count
+
+def main(args):
+
+    for filepath in (args.mapping_dwc, args.metadata, args.countries):
+        if filepath and not os.path.exists(filepath):
+            print ( f"[ABORT] Mapping file path not found: {filepath}", file=sys.stderr)
+            sys.exit (1)
+
+    terms, columns = get_dwc_mapping (args.mapping_dwc)
+    water_bodies = get_water_bodies (args.countries) if args.countries else frozenset()
+    with open (args.metadata) as metadata_file:
+        metadata = json.load (metadata_file)
+
+    count = write_archive (read_lines (), args.output, terms, columns, metadata, water_bodies)
+    print (f"[INFO] {count} records written to {args.output}", file=sys.stderr)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="""This tool takes a data JSONL in BCDM format and writes a Darwin Core Archive (occurrence.txt, meta.xml, eml.xml) for GBIF
+in a single streaming pass.  BCDM fields without a Darwin Core term in the mapping are dropped.
+
+Usage: cat data_bcdm.jsonl | python convert_BCDM_to_DWCA.py --mapping-dwc mapping_BCDM_to_DWC.tsv --metadata package.metadata.json --output dwca.zip
+""")
+    parser.add_argument("--mapping-dwc", type=str, required=True, help="File path for the BCDM field to Darwin Core term mapping")
+    parser.add_argument("--metadata", type=str, required=True, help="Data package descriptor (see package.metadata.template.json) used for eml.xml")
+    parser.add_argument("--output", type=str, required=True, help="File path of the Darwin Core Archive (zip) to write")
+    parser.add_argument("--countries", type=str, required=False, help="Path to registered_soverign_and_maritime_areas.tsv.  If set, country/ocean values that are oceans or seas go to waterBody instead of country.")
+    args = parser.parse_args()
+
+    main(args)
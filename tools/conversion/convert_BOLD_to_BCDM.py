@@ -0,0 +1,200 @@
+import argparse
+import sys, os
+import time
+
+import pandas as pd
+
+sys.path.append (os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from compiled_tables import read_table
+from jsonl_io import JsonlWriter, dumps, loads
+
+_COMPOSITE_TABLES = ('geopol_denorm', 'barcodecluster')     # exported either as <table>.<field> columns or as one JSON column
+_ARRAY_TYPES = ('array', 'array of string')
+_EXTENSION_FORMATS = {'.csv': 'csv', '.parquet': 'parquet', '.pq': 'parquet'}      # anything else is read as TSV
+
+class ConversionError (Exception):
+    pass
+
+########## Helper Functions ##########
+
+def get_bold_to_bcdm_mapping (filepath):
+    """
+    Returns a bold_field -> bcdm_field dictionary in mapping order.
+    """
+    return {row['bold_field']: row['bcdm_field'] for row in read_table (filepath) if row.get('bold_field') and row.get('bcdm_field')}
+
+def get_field_types (bcdm_def):
+    return {row['field']: row['data_type'] for row in read_table (bcdm_def) if row.get('field')}
+
+class ColumnPlan:
+    """
+    How the columns of a BOLD export map onto BCDM fields, worked out once from the header: plain renames, JSON
+    composite columns (geopol_denorm, barcodecluster) to split, and the unmapped columns that are dropped.
+    """
+    def __init__ (self, columns, bold_to_bcdm):
+        self.renames = {column: bold_to_bcdm[column] for column in columns if column in bold_to_bcdm}
+        self.composites = {}
+        for table in _COMPOSITE_TABLES:
+            if table in columns:
+                keys = {bold_field[len(table) + 1:]: bcdm_field for bold_field, bcdm_field in bold_to_bcdm.items()
+                        if bold_field.startswith(table + '.') and bold_field not in self.renames}
+                if keys:
+                    self.composites[table] = keys
+        self.dropped = [column for column in columns if column not in self.renames and column not in self.composites]
+        order = {bcdm_field: i for i, bcdm_field in enumerate(bold_to_bcdm.values())}
+        fields = list(self.renames.values()) + [bcdm_field for keys in self.composites.values() for bcdm_field in keys.values()]
+        self.fields = sorted(dict.fromkeys(fields), key=order.get)
+
+def parse_composite (value, table, row):
+    if not value:
+        return {}
+    try:
+        parsed = loads(value)
+    except ValueError as e:
+        raise ConversionError (f"Row {row}: invalid JSON in {table}: {e}")
+    if not isinstance(parsed, dict):
+        raise ConversionError (f"Row {row}: {table} is not a JSON object: {value}")
+    return parsed
+
+def split_composite (column, keys):
+    """
+    Expands a column of JSON objects (e.g. geopol_denorm = {"country": ..., "province": ...}) into one column per
+    mapped key.  Raises ConversionError for a value that is not a JSON object, naming its row (the index + 1).
+    """
+    parsed = pd.Series([parse_composite (value, column.name, index + 1) for index, value in column.items()], index=column.index, dtype=object)
+    expanded = pd.DataFrame(parsed.tolist(), index=column.index)
+    return pd.DataFrame({bcdm_field: expanded[key] if key in expanded else '' for key, bcdm_field in keys.items()}, index=column.index)
+
+def normalize_array (column):
+    """PostgreSQL array literals {a,"b c"} -> BCDM comma separated lists a,b c."""
+    is_literal = column.str.startswith('{') & column.str.endswith('}')
+    if not is_literal.any():
+        return column
+    items = column.str.slice(1, -1).str.replace('"', '', regex=False)
+    items = items.str.replace(r'(?:^|,)NULL(?=,|$)', '', regex=True).str.strip(',')        # NULL elements are dropped
+    return column.where(~is_literal, items)
+
+def truncate_timestamp (column):
+    """'2019-05-03 12:34:56+00' and '2019-05-03T12:34:56' -> '2019-05-03'."""
+    is_timestamp = column.str.match(r'\d{4}-\d{2}-\d{2}[ T]')
+    return column.where(~is_timestamp, column.str.slice(0, 10))
+
+def convert_chunk (chunk, plan, field_types):
+    """
+    Converts one chunk of a BOLD export (string columns, '' for missing) into a DataFrame of BCDM fields.
+    """
+    converted = chunk[list(plan.renames)].rename(columns=plan.renames)
+    for table, keys in plan.composites.items():
+        composite = split_composite(chunk[table], keys)
+        for bcdm_field in composite:
+            converted[bcdm_field] = composite[bcdm_field].fillna('').astype(str)
+    converted = converted.loc[:, ~converted.columns.duplicated()]
+
+    for bcdm_field in converted.columns:
+        data_type = field_types.get(bcdm_field)
+        if data_type in _ARRAY_TYPES:
+            converted[bcdm_field] = normalize_array(converted[bcdm_field])
+        elif data_type == 'string:date':
+            converted[bcdm_field] = truncate_timestamp(converted[bcdm_field])
+    return converted.reindex(columns=plan.fields, fill_value='')
+
+def read_chunks (filepath, input_format, chunk_size):
+    """
+    Yields DataFrames of at most chunk_size rows with every value as a string ('' for missing), indexed by row
+    number from 0 across the whole input.
+    """
+    if input_format == 'parquet':
+        import pyarrow.parquet as pq        # optional dependency, only needed for Parquet exports
+        offset = 0
+        for batch in pq.ParquetFile(filepath).iter_batches(batch_size=chunk_size):
+            chunk = batch.to_pandas()
+            chunk.index += offset
+            offset += len(chunk)
+            yield chunk.astype(str).where(chunk.notna(), '')
+        return
+    source = sys.stdin if filepath == '-' else filepath
+    sep = ',' if input_format == 'csv' else '\t'
+    yield from pd.read_csv(source, sep=sep, dtype=str, keep_default_na=False, chunksize=chunk_size)
+
+def write_jsonl (converted, writer, wrap_submission=False):
+    """
+    One BCDM record per line on a JsonlWriter; empty values are left out.  With wrap_submission every record is
+    wrapped in a specimen submission object so the output can be fed to 1_acceptability_check.py.
+    """
+    fields = list(converted.columns)
+    for row in converted.to_numpy(dtype=object):        # plain object rows: iterating the string columns cell by cell is far slower
+        packet = {field: value for field, value in zip(fields, row) if value}
+        if wrap_submission:
+            record_id = packet.get('processid') or packet.get('sampleid') or ''
+            packet = {'id': record_id, 'submission_type': 'specimen', 'submission_packet': packet}
+        writer.write (dumps(packet))
+
+def main(args):
+
+    for filepath in (args.mapping, args.bcdm_def, args.input):
+        if filepath != '-' and not os.path.exists(filepath):
+            print ( f"[ABORT] Mapping file path not found: {filepath}", file=sys.stderr)
+            sys.exit (1)
+
+    input_format = args.input_format or _EXTENSION_FORMATS.get(os.path.splitext(args.input)[1].lower(), 'tsv')
+    if input_format == 'parquet' and args.input == '-':
+        print ( f"[ABORT] Parquet input must be a file", file=sys.stderr)
+        sys.exit (1)
+
+    bold_to_bcdm = get_bold_to_bcdm_mapping (args.mapping)
+    field_types = get_field_types (args.bcdm_def)
+
+    start = time.perf_counter()
+    rows = 0
+    plan = None
+    stdout = JsonlWriter ()
+    try:
+        for chunk in read_chunks (args.input, input_format, args.chunk_size):
+            if plan is None:
+                plan = ColumnPlan (list(chunk.columns), bold_to_bcdm)
+                if plan.dropped:
+                    print (f"[WARNING] Unmapped BOLD columns dropped: {', '.join (plan.dropped)}", file=sys.stderr)
+            converted = convert_chunk (chunk, plan, field_types)
+            if args.output_format == 'tsv':
+                converted.to_csv (sys.stdout, sep='\t', index=False, header=(rows == 0))
+            else:
+                write_jsonl (converted, stdout, args.wrap_submission)
+            rows += len(chunk)
+    except pd.errors.EmptyDataError:
+        print (f"[ERROR] Input {args.input} is empty: no header row to map", file=sys.stderr)
+        sys.exit (1)
+    except pd.errors.ParserError as e:
+        print (f"[ERROR] Could not read {args.input}: {e}", file=sys.stderr)
+        sys.exit (1)
+    except ConversionError as e:
+        print (f"[ERROR] {e}", file=sys.stderr)
+        sys.exit (1)
+    stdout.flush()
+
+    elapsed = time.perf_counter() - start
+    print (f"[INFO] {rows} rows converted in {elapsed:.1f}s ({rows / elapsed * 60 / 1e6 if elapsed else 0:.2f}M rows/min)", file=sys.stderr)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="""This tool converts a BOLD database table export (TSV, CSV or Parquet) into BCDM records, reading and writing in fixed-size
+chunks so memory is bounded by --chunk-size.  Columns are named after the bold_field column of the mapping; geopol_denorm and
+barcodecluster may also be exported as single JSON columns.
+
+Usage: python convert_BOLD_to_BCDM.py --input bold_export.tsv --mapping mapping_BOLD_to_BCDM.tsv --bcdm-def field_definitions.tsv > records.jsonl
+""")
+    parser.add_argument("--input", type=str, required=True, help="BOLD export file, or - for TSV/CSV on stdin")
+    parser.add_argument("--input-format", type=str, required=False, choices=["tsv", "csv", "parquet"], help="Defaults to the extension of --input (tsv for stdin).  Parquet requires pyarrow.")
+    parser.add_argument("--mapping", type=str, required=True, help="File path for the BOLD DB field to BCDM field mapping")
+    parser.add_argument("--bcdm-def", type=str, required=True, help="Path to the BCDM definition file.  Array and date fields are normalized according to their data_type.")
+    parser.add_argument("--output-format", type=str, choices=["jsonl", "tsv"], default="jsonl", help="BCDM JSONL (one record per line) or BCDM TSV")
+    parser.add_argument("--wrap-submission", action="store_true", help="Wrap every JSONL record in a specimen submission object (id, submission_type, submission_packet)")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="Number of rows read, converted and written at a time")
+    args = parser.parse_args()
+
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be positive")
+    if args.wrap_submission and args.output_format != 'jsonl':
+        parser.error("--wrap-submission requires --output-format jsonl")
+
+    main(args)
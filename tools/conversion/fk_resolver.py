@@ -0,0 +1,165 @@
+import sys, os
+import collections
+import re
+import sqlite3
+
+sys.path.append (os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'validation'))
+from vocabulary import canonical_country_terms, normalize_term
+
+_MAX_SQL_PARAMS = 900     # stay below SQLITE_MAX_VARIABLE_NUMBER of older SQLite builds
+_RESOLVED_POLICIES = ('', 'lookup', 'append')    # 'overwrite' sub tables (notes) are written, never looked up
+
+class Reference:
+    """
+    A foreign key lookup described by the sub_table_field/constraint columns of mapping_BCDM_to_BOLD.tsv, e.g.
+    geopol.name with geopol.rank='country', or primer.code || ':' || primer.nuc.  A bare table name (tax, inst,
+    geopol) matches on its name column, or on id when the submitted value is already an integer id.
+    """
+    def __init__ (self, sub_table_field, constraint='', policy=''):
+        self.table = re.match(r'\s*(\w+)', sub_table_field).group(1)
+        self.bare = sub_table_field.strip() == self.table
+        self.key_expr = f"{self.table}.name" if self.bare else sub_table_field.strip()
+        self.constraint = constraint.strip()
+        self.policy = policy.strip()
+
+    @property
+    def cache_key (self):
+        return (self.key_expr, self.constraint, self.bare)      # bare references also match ids: not the same lookup
+
+    def __eq__ (self, other):
+        return isinstance(other, Reference) and self.cache_key == other.cache_key
+
+    def __hash__ (self):
+        return hash(self.cache_key)
+
+    def is_id (self, value):
+        return self.bare and (isinstance(value, int) and not isinstance(value, bool) or isinstance(value, str) and value.isdigit())
+
+    def query (self, column, count):
+        where = f"{column} IN ({','.join('?' * count)})"
+        if self.constraint:
+            where = f"({self.constraint}) AND {where}"
+        return f"SELECT {column}, {self.table}.id FROM {self.table} WHERE {where} ORDER BY {self.table}.id"
+
+def get_references (bcdm_to_bold_mapping):
+    """
+    Returns bcdm_field -> Reference for the mapped fields that point at a reference table.
+    """
+    references = {}
+    for bcdm_field, info in bcdm_to_bold_mapping.items():
+        if info.get('sub_table_field') and info.get('policy', '') in _RESOLVED_POLICIES:
+            references[bcdm_field] = Reference(info['sub_table_field'], info.get('constraint', ''), info.get('policy', ''))
+    return references
+
+class ForeignKeyResolver:
+    """
+    Resolves foreign key values of converted objects against a local SQLite snapshot of the reference tables
+    (geopol, tax, inst, primer).  Values are collected over a whole batch and resolved with one IN (...) query per
+    table and constraint; results, including misses, are kept in an LRU cache shared by all batches.
+
+    Values of array_fields are comma separated lists resolved term by term.  With the countries table, country/ocean
+    and country_iso values are first mapped to their canonical term, matching them as validation does (any case,
+    ISO alpha-2 or alpha-3).
+    """
+    def __init__ (self, db_path, bcdm_to_bold_mapping, cache_size=100000, array_fields=(), countries=None):
+        self.conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        self.references = get_references(bcdm_to_bold_mapping)
+        self.array_fields = frozenset(array_fields)
+        self.canonical = canonical_country_terms(countries) if countries else {}
+        self.cache = collections.OrderedDict()
+        self.cache_size = cache_size
+        self.queries = 0
+
+    def _cache_get (self, key):
+        self.cache.move_to_end(key)
+        return self.cache[key]
+
+    def _cache_put (self, key, fk_id):
+        self.cache[key] = fk_id
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def _lookup (self, reference, column, values):
+        resolved = {}
+        values = list(values)
+        for start in range(0, len(values), _MAX_SQL_PARAMS):
+            chunk = values[start:start + _MAX_SQL_PARAMS]
+            self.queries += 1
+            for key, fk_id in self.conn.execute(reference.query(column, len(chunk)), chunk):
+                resolved.setdefault(str(key), fk_id)
+        return resolved
+
+    def resolve_values (self, reference, values):
+        """
+        Returns value -> id (or None if not found) for a set of string values of one reference.
+        """
+        result = {}
+        missing = {'name': set(), 'id': set()}
+        for value in values:
+            key = (reference.cache_key, value)
+            if key in self.cache:
+                result[value] = self._cache_get(key)
+            else:
+                missing['id' if reference.is_id(value) else 'name'].add(value)
+
+        for kind, pending in missing.items():
+            if not pending: continue
+            column = f"{reference.table}.id" if kind == 'id' else reference.key_expr
+            resolved = self._lookup(reference, column, pending)
+            for value in pending:
+                result[value] = resolved.get(value)
+                self._cache_put((reference.cache_key, value), result[value])
+        return result
+
+    def _reference_fields (self, converted_obj):
+        return [bcdm_field for bcdm_field in converted_obj if bcdm_field in self.references]
+
+    def _lookup_values (self, bcdm_field, values):
+        """The values looked up for the submitted values of bcdm_field."""
+        canonical = self.canonical.get(bcdm_field)
+        if not canonical:
+            return values
+        return [canonical.get(normalize_term(value), value) for value in values]
+
+    def resolve (self, converted_objs):
+        """
+        Writes the resolved ids into the first db entry of every reference field as 'fk_id' (a list for list values
+        and for arrays of several terms).
+        Returns, per converted object, the [(bcdm_field, value)] pairs that could not be resolved under a 'lookup'
+        policy.  Unresolved 'append' values are left without an fk_id for the loader to insert.
+        """
+        distinct = collections.defaultdict(set)
+        for converted_obj in converted_objs:
+            for bcdm_field in self._reference_fields(converted_obj):
+                values = _values(converted_obj[bcdm_field][0]['value'], bcdm_field in self.array_fields)
+                distinct[bcdm_field].update(self._lookup_values(bcdm_field, values))
+
+        by_reference = collections.defaultdict(set)
+        for bcdm_field, values in distinct.items():
+            by_reference[self.references[bcdm_field]].update(values)
+        resolved = {reference: self.resolve_values(reference, values) for reference, values in by_reference.items()}
+
+        unresolved = []
+        for converted_obj in converted_objs:
+            failures = []
+            for bcdm_field in self._reference_fields(converted_obj):
+                reference = self.references[bcdm_field]
+                entry = converted_obj[bcdm_field][0]
+                values = _values(entry['value'], bcdm_field in self.array_fields)
+                if not values: continue
+                ids = [resolved[reference][value] for value in self._lookup_values(bcdm_field, values)]
+                failures += [(bcdm_field, value) for value, fk_id in zip(values, ids) if fk_id is None and reference.policy == 'lookup']
+                if all(fk_id is not None for fk_id in ids):
+                    entry['fk_id'] = ids if isinstance(entry['value'], list) or len(ids) > 1 else ids[0]
+            unresolved.append(failures)
+        return unresolved
+
+def _values (value, split=False):
+    """The terms of a value; with split, strings are comma separated lists as in BCDM array fields."""
+    if value in (None, ''):
+        return []
+    if isinstance(value, list):
+        return [str(item) for item in value if item not in (None, '')]
+    if split and isinstance(value, str):
+        return [item.strip() for item in value.split(',') if item.strip()]
+    return [str(value)]
@@ -0,0 +1,326 @@
+import argparse
+import json, sys, os
+import re
+import sqlite3
+import time
+
+sys.path.append (os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from jsonl_io import loads, read_lines
+from record_identity import RECORD_ID_FIELDS, IdentityConflict, SqliteIdentityIndex, record_identifiers
+
+_MAX_SQL_PARAMS = 900     # stay below SQLITE_MAX_VARIABLE_NUMBER of older SQLite builds
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+_IDENTITY_TABLE = '_record_identifiers'
+_checked_identifiers = set()
+
+# BCDM fields that write one shared column (specimen.fk_tax, location.fk_geopol and their verbatim_ copies), most
+# specific first.  Fields in one tuple are the same rank and must agree once resolved (a country by name and by ISO code).
+_FIELD_PRECEDENCE = [
+    [('taxid', 'identification'), ('subspecies',), ('species',), ('genus',), ('tribe',), ('subfamily',), ('family',),
+     ('order',), ('class',), ('phylum',), ('kingdom',)],
+    [('geoid',), ('province/state',), ('country/ocean', 'country_iso')],
+]
+_FIELD_RANK = {field: rank for ranks in _FIELD_PRECEDENCE for rank, fields in enumerate(ranks) for field in fields}
+_UNRANKED = len(_FIELD_RANK)
+
+class LoadError (Exception):
+    pass
+
+########## Helper Functions ##########
+
+def get_record_identifiers (converted_obj):
+    """
+    The (field, value) identifiers of a converted object, the ones 3_convert_BCDM_to_DB.py coalesces specimens on.
+    """
+    values = {}
+    for field in RECORD_ID_FIELDS:
+        for entry in converted_obj.get(field, []):
+            if entry.get('value') not in (None, ''):
+                values[field] = entry['value']
+    return record_identifiers (values)
+
+def entry_value (entry):
+    """The resolved id for foreign keys, otherwise the value."""
+    value = entry.get('fk_id')
+    if value is None:
+        value = entry.get('value')
+    return value
+
+def sql_value (value):
+    """Lists and objects are stored as JSON text."""
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+    return value
+
+def db_value (entry):
+    return sql_value (entry_value (entry))
+
+def check_identifier (name):
+    """Table and field names are quoted into the SQL, so only plain identifiers are accepted."""
+    if name not in _checked_identifiers:
+        if not isinstance(name, str) or not _IDENTIFIER.match(name):
+            raise LoadError (f"invalid table or field name '{name}'")
+        _checked_identifiers.add(name)
+
+def column_value (table, field, writers):
+    """
+    The one value loaded into a column written by several BCDM fields; writers holds (bcdm_field, entry) pairs in
+    converted object order.  A field with several distinct entries (the values 3_convert_BCDM_to_DB.py --coalesce
+    collects for an append policy) contributes all its non-null ones, as a JSON list.  The most specific field set, per
+    _FIELD_PRECEDENCE, wins.  Fields of the same rank must agree, compared on fk_id when all of them are resolved,
+    and so must fields without a rank; otherwise LoadError is raised.  An explicit null only stands when no field
+    sets the column.
+    """
+    entries = {}
+    for bcdm_field, entry in writers:
+        entries.setdefault(bcdm_field, [])
+        if entry_value(entry) is not None:
+            entries[bcdm_field].append(entry)
+    values = {}         # bcdm_field -> SQL value
+    resolved = {}       # bcdm_field -> True if every entry has an fk_id
+    for bcdm_field, set_entries in entries.items():
+        if set_entries:
+            distinct = {}       # 4_convert_to_verbatim.py may write a value twice to one column
+            for entry in set_entries:
+                distinct.setdefault(db_value(entry), entry_value(entry))
+            field_values = list(distinct.values())
+            values[bcdm_field] = sql_value (field_values[0] if len(field_values) == 1 else field_values)
+            resolved[bcdm_field] = all(entry.get('fk_id') is not None for entry in set_entries)
+    if not values:
+        return None
+
+    best = min(_FIELD_RANK.get(bcdm_field, _UNRANKED) for bcdm_field in values)
+    rank = [bcdm_field for bcdm_field in values if _FIELD_RANK.get(bcdm_field, _UNRANKED) == best]
+    comparable = best == _UNRANKED or all(resolved[bcdm_field] for bcdm_field in rank)
+    if comparable and len({values[bcdm_field] for bcdm_field in rank}) > 1:
+        conflicting = ', '.join (f"{bcdm_field}={values[bcdm_field]!r}" for bcdm_field in rank)
+        raise LoadError (f"conflicting values for {table}.{field}: {conflicting}")
+    return values[rank[0]]
+
+def table_rows (converted_obj):
+    """
+    Returns db_table -> {db_field: value} for one converted object.  Every column gets one scalar value; columns
+    written by several BCDM fields (e.g. specimen.fk_tax) are decided by column_value.
+    """
+    writers = {}        # (table, field) -> [(bcdm_field, entry)]
+    for bcdm_field, entries in converted_obj.items():
+        for entry in entries:
+            column = (entry['db_table'], entry['db_field'])
+            if column not in writers:
+                check_identifier (column[0])
+                check_identifier (column[1])
+                writers[column] = []
+            writers[column].append((bcdm_field, entry))
+
+    rows = {}
+    for (table, field), column_writers in writers.items():
+        if len(column_writers) == 1:
+            value = db_value(column_writers[0][1])
+        else:
+            value = column_value (table, field, column_writers)
+        rows.setdefault(table, {})[field] = value
+    return rows
+
+class BatchLoader:
+    """
+    Applies converted objects to a database with multi-row INSERT ... ON CONFLICT(record_key) DO UPDATE statements,
+    one per db_table (and per SQLite parameter limit) over a batch of records, on one connection kept for the whole
+    stream.  Every table has one row per specimen keyed on record_key.  A statement writes the union of the columns
+    the batch carries for the table; a record that does not carry one of them keeps the value already stored, read
+    beforehand, so an upsert only changes the columns the records carry.  The
+    record_key of a specimen comes from an IdentityIndex kept in the _record_identifiers table, so records naming
+    its processid, its sampleid or both load into the same rows.
+
+    Batches normally commit one by one.  With all_or_nothing the whole stream is a single transaction (each batch
+    runs inside a savepoint) that rollback() discards.
+    """
+    def __init__ (self, db_path, all_or_nothing=False, create_tables=False):
+        self.conn = sqlite3.connect(db_path, isolation_level=None)
+        self.all_or_nothing = all_or_nothing
+        self.create_tables = create_tables
+        self.columns = {}         # table -> set of columns, for the tables seen so far
+        self.rows = 0
+        self.statements = 0
+        self.queries = 0          # reads of stored rows, for records not carrying every column of their table
+        if all_or_nothing:
+            self.conn.execute("BEGIN")
+        self.index = SqliteIdentityIndex (self.conn, _IDENTITY_TABLE)
+
+    def _table_columns (self, table, fields):
+        if table not in self.columns:
+            columns = {row[1] for row in self.conn.execute(f'PRAGMA table_info("{table}")')}
+            if not columns:
+                if not self.create_tables:
+                    raise LoadError (f"table '{table}' does not exist (use --create-tables)")
+                self.conn.execute(f'CREATE TABLE "{table}" (record_key TEXT PRIMARY KEY)')
+                columns = {'record_key'}
+            self.columns[table] = columns
+        columns = self.columns[table]
+        for field in fields:
+            if field not in columns:
+                if not self.create_tables:
+                    raise LoadError (f"column '{table}.{field}' does not exist (use --create-tables)")
+                self.conn.execute(f'ALTER TABLE "{table}" ADD COLUMN "{field}"')
+                columns.add(field)
+
+    def _upsert (self, table, fields, rows):
+        column_list = ', '.join(f'"{name}"' for name in ('record_key',) + fields)
+        updates = ', '.join(f'"{field}" = excluded."{field}"' for field in fields)
+        placeholders = '(' + ', '.join('?' * (len(fields) + 1)) + ')'
+        per_statement = max(1, _MAX_SQL_PARAMS // (len(fields) + 1))
+        for start in range(0, len(rows), per_statement):
+            chunk = rows[start:start + per_statement]
+            sql = f'INSERT INTO "{table}" ({column_list}) VALUES {", ".join([placeholders] * len(chunk))} ON CONFLICT(record_key) DO UPDATE SET {updates}'
+            self.conn.execute(sql, [param for row in chunk for param in row])
+            self.statements += 1
+        self.rows += len(rows)
+
+    def _stored_rows (self, table, fields, record_keys):
+        """record_key -> {field: value} of the stored rows among record_keys."""
+        stored = {}
+        column_list = ', '.join(f'"{name}"' for name in ('record_key',) + fields)
+        for start in range(0, len(record_keys), _MAX_SQL_PARAMS):
+            chunk = record_keys[start:start + _MAX_SQL_PARAMS]
+            sql = f'SELECT {column_list} FROM "{table}" WHERE record_key IN ({", ".join("?" * len(chunk))})'
+            for row in self.conn.execute(sql, chunk):
+                stored[row[0]] = dict(zip(fields, row[1:]))
+            self.queries += 1
+        return stored
+
+    def load (self, records):
+        """
+        Writes one batch of (line_number, identifiers, table_rows) triples and returns the (line_number, message)
+        of the records left out because their identifiers conflict with known specimens.  Rows of the same
+        specimen are merged first, later values over earlier ones, since one statement may not upsert a row twice.
+        Raises sqlite3.Error or LoadError after rolling the batch back.
+        """
+        self.conn.execute("SAVEPOINT batch" if self.all_or_nothing else "BEGIN")
+        try:
+            rejected = []
+            merged = {}
+            for line_number, identifiers, rows in records:
+                try:
+                    record_key = self.index.resolve (identifiers)
+                except IdentityConflict as e:
+                    rejected.append ((line_number, str(e)))
+                    continue
+                for table, fields in rows.items():
+                    merged.setdefault(table, {}).setdefault(record_key, {}).update(fields)
+
+            for table, by_key in merged.items():
+                fields = tuple(dict.fromkeys(field for record_fields in by_key.values() for field in record_fields))
+                self._table_columns (table, fields)
+                partial = [record_key for record_key, record_fields in by_key.items() if len(record_fields) < len(fields)]
+                stored = self._stored_rows (table, fields, partial) if partial else {}
+                rows = []
+                for record_key, record_fields in by_key.items():
+                    kept = stored.get(record_key, {})
+                    rows.append((record_key,) + tuple(record_fields[field] if field in record_fields else kept.get(field) for field in fields))
+                self._upsert (table, fields, rows)
+        except Exception:
+            self.conn.execute("ROLLBACK TO batch" if self.all_or_nothing else "ROLLBACK")
+            if self.all_or_nothing:
+                self.conn.execute("RELEASE batch")
+            self.columns = {}     # columns added by the rolled back batch are gone
+            raise
+        self.conn.execute("RELEASE batch" if self.all_or_nothing else "COMMIT")
+        return rejected
+
+    def commit (self):
+        if self.all_or_nothing:
+            self.conn.execute("COMMIT")
+        self.conn.close()
+
+    def rollback (self):
+        if self.all_or_nothing:
+            self.conn.execute("ROLLBACK")
+        self.conn.close()
+
+def read_batches (stream, batch_size):
+    batch = []
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip(): continue
+        batch.append ((line_number, line))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def main(args):
+
+    db_dir = os.path.dirname(os.path.abspath(args.db))
+    if not os.path.isdir(db_dir) or not args.create_tables and not os.path.exists(args.db):
+        print ( f"[ABORT] Database path not found: {args.db}", file=sys.stderr)
+        sys.exit (1)
+
+    loader = BatchLoader (args.db, args.all_or_nothing, args.create_tables)
+    start = time.perf_counter()
+    records = 0
+    failed_batches = 0
+    aborted = False
+    for batch_number, lines in enumerate (read_batches (read_lines (), args.batch_size), start=1):
+        records_batch = []
+        for line_number, line in lines:
+            try:
+                converted_obj = loads(line)
+                identifiers = get_record_identifiers (converted_obj)
+                if not identifiers:
+                    raise LoadError (f"{' or '.join (RECORD_ID_FIELDS)} is required")
+                records_batch.append ((line_number, identifiers, table_rows (converted_obj)))
+            except (ValueError, KeyError, TypeError, AttributeError, LoadError) as e:
+                print (f"[ERROR][Line {line_number}] {e}", file=sys.stderr)
+                if args.all_or_nothing:
+                    aborted = True
+                    break
+        if aborted:
+            break
+
+        batch_range = f"({lines[0][0]}-{lines[-1][0]})"
+        try:
+            rejected = loader.load (records_batch)
+            records += len(records_batch) - len(rejected)
+        except (sqlite3.Error, LoadError) as e:
+            print (f"[BATCH {batch_number}][ABORT] {e} {batch_range}, batch rolled back", file=sys.stderr)
+            failed_batches += 1
+            if args.all_or_nothing:
+                aborted = True
+                break
+            continue
+        for line_number, message in rejected:
+            print (f"[ERROR][Line {line_number}] {message}", file=sys.stderr)
+        if rejected and args.all_or_nothing:
+            aborted = True
+            break
+
+    if aborted:
+        loader.rollback()
+        print (f"[ABORT] all-or-nothing: nothing was loaded", file=sys.stderr)
+        sys.exit (1)
+    loader.commit()
+
+    elapsed = time.perf_counter() - start
+    rate = f"{loader.rows / elapsed:.0f}" if elapsed > 0 else "-"
+    print (f"[INFO] {records} records loaded as {loader.rows} table rows with {loader.statements} statements in {elapsed:.2f}s ({rate} rows/s)", file=sys.stderr)
+    if failed_batches:
+        sys.exit (1)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="""This tool loads the JSONL output of 3_convert_BCDM_to_DB.py (or 4_convert_to_verbatim.py) into a SQLite database, the local
+stand-in for the BOLD database.  Writes are grouped by db_table over --batch-size records and applied as multi-row upserts keyed
+on the specimen (processid/sampleid), one transaction per batch.
+
+Usage: python 5_load_to_DB.py --db bold_local.db --create-tables < converted_records.jsonl
+""")
+    parser.add_argument("--db", type=str, required=True, help="Path to the SQLite database")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Number of records written per transaction")
+    parser.add_argument("--all-or-nothing", action="store_true", help="Load the whole input in one transaction, rolled back on the first invalid record or failed batch")
+    parser.add_argument("--create-tables", action="store_true", help="Create the database, missing tables (one row per specimen, keyed on record_key) and missing columns")
+    args = parser.parse_args()
+
+    if args.batch_size < 1:
+        parser.error("--batch-size must be positive")
+
+    main(args)
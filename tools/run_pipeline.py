@@ -0,0 +1,100 @@
+import argparse
+import importlib
+import sys, os
+
+_TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(_TOOLS_DIR, 'validation'), os.path.join(_TOOLS_DIR, 'conversion'), os.path.join(_TOOLS_DIR, 'common')]
+
+acceptability_check = importlib.import_module('1_acceptability_check')
+convert_bcdm_to_db = importlib.import_module('3_convert_BCDM_to_DB')
+convert_to_verbatim = importlib.import_module('4_convert_to_verbatim')
+
+from bcdm_schema import load_schema
+from transactional_output import TransactionalOutput
+from jsonl_io import JsonlWriter, dumps, loads, read_lines
+
+########## Helper Functions ##########
+
+def process_submission_obj (json_obj, schema, bcdm_to_bold_mapping, verbatim_mapping, is_update=False, mode="add"):
+    """
+    Run one parsed submission object through validation, BCDM to DB conversion and the verbatim mapping in memory.
+    Returns (converted_obj, msgs); converted_obj is None if any stage rejected the record, in which case msgs holds
+    the same messages the piped tools would have written to stderr.
+    """
+    isValid, msgs = acceptability_check.validate_submission_obj (json_obj, is_update, schema)
+    if not isValid:
+        return None, msgs
+
+    try:
+        converted_obj = convert_bcdm_to_db.convert_upload_single_package (json_obj, bcdm_to_bold_mapping)
+        if not converted_obj:
+            raise Exception (f"[ERROR][Request {json_obj['id']}]Error converting bcdm record to upload json object")
+        convert_to_verbatim.modify_update_obj (converted_obj, verbatim_mapping, mode)
+    except Exception as e:
+        return None, [str(e)]
+    return converted_obj, []
+
+def run_pipeline (lines, bcdm_def, mapping, mapping_verbatim, is_update=False, mode="add"):
+    """
+    Generator equivalent of `1_acceptability_check.py | 3_convert_BCDM_to_DB.py | 4_convert_to_verbatim.py`.  Each
+    JSONL line is parsed once and serialized once; yields (output_line, msgs) per input line, output_line being
+    None for rejected records.
+    """
+    schema = load_schema (bcdm_def)
+    bcdm_to_bold_mapping = convert_bcdm_to_db.get_bcdm_to_bold_mapping (convert_bcdm_to_db.__EXCLUDED_FIELDS, mapping)
+    verbatim_mapping = convert_to_verbatim.get_verbatim_mapping (mapping_verbatim)
+
+    for line in lines:
+        converted_obj, msgs = process_submission_obj (loads(line), schema, bcdm_to_bold_mapping, verbatim_mapping, is_update, mode)
+        yield (dumps(converted_obj) if converted_obj is not None else None), msgs
+
+def main(args):
+
+    for filepath in (args.bcdm_def, args.mapping, args.mapping_verbatim):
+        if not os.path.exists(filepath):
+            print ( f"[ABORT] Mapping file path not found: {filepath}", file=sys.stderr)
+            sys.exit (1)
+
+    error_count = 0
+    output = TransactionalOutput (args.batch_size) if args.all_or_nothing else None
+    stdout = JsonlWriter ()
+    for output_line, msgs in run_pipeline (read_lines (), args.bcdm_def, args.mapping, args.mapping_verbatim, args.update, args.mode):
+        if output_line is None:
+            print ( "\n".join (msgs), file=sys.stderr)
+            error_count+=1
+            if output: output.reject()
+        elif output:
+            output.write (output_line)
+        else:
+            stdout.write (output_line)
+    stdout.flush()
+
+    if output and not output.close():
+        if args.batch_size is None:
+            print (f"[ABORT] all-or-nothing: {error_count} records invalid. ", file=sys.stderr)
+        sys.exit (1)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="""This tool runs the acceptability check, the BCDM to DB conversion and the verbatim conversion on a data JSONL in BCDM format
+        in a single process.  The output is the same as piping the three tools together.  All error messages should be captured in stderr.
+
+Usage: cat data_bcdm.jsonl | python run_pipeline.py --bcdm-def field_definitions.tsv --mapping mapping_BCDM_to_BOLD.tsv --mapping-verbatim mapping_verbatim_to_BOLD.tsv --mode add --all-or-nothing > upload.jsonl 2> err.log
+""")
+    parser.add_argument("--update", default=False, action=argparse.BooleanOptionalAction, help="If set, record existence is required to proceed with the update. Otherwise, new record submission is requested.")
+    parser.add_argument("--bcdm-def", type=str, required=True, help="Path to the BCDM definition file.")
+    parser.add_argument("--mapping", type=str, required=True, help="File path for the BCDM field to BOLD DB field mapping")
+    parser.add_argument("--mapping-verbatim", type=str, required=True, help="File path for the verbatim to BOLD DB field mapping")
+    parser.add_argument("--mode", type = str, required=False, choices = ["add", "replace"], default="add")
+    parser.add_argument("--all-or-nothing", action="store_true", help="True indicates all or nothing mode; any record rejected by any stage aborts the run")
+    parser.add_argument("--batch-size", type=int, required=False, help="If set, the all-or-nothing applies to each batch.  Alternatively, all records submitted will be processed in single batch.")
+    args = parser.parse_args()
+
+    # Enforce dependency
+    if args.batch_size is not None and args.batch_size < 1:
+        parser.error("--batch-size must be positive")
+    if args.batch_size is not None and not args.all_or_nothing:
+        parser.error("--batch-size requires --all-or-nothing")
+
+    main(args)
@@ -0,0 +1,75 @@
+import sys, os
+import shutil
+import subprocess
+
+import pytest
+
+_TOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+_BCDM_DIR = os.path.join(_TOOLS_DIR, os.pardir)
+sys.path.append (os.path.join(_TOOLS_DIR, 'common'))
+sys.path.append (os.path.join(_TOOLS_DIR, 'validation'))
+sys.path.append (os.path.join(_TOOLS_DIR, 'benchmarks'))
+from generate_submissions import SubmissionGenerator, write_records
+
+_BCDM_DEF = os.path.join(_BCDM_DIR, 'field_definitions.tsv')
+
+@pytest.fixture(scope='module')
+def submissions (tmp_path_factory):
+    path = tmp_path_factory.mktemp('submissions') / 'submissions.jsonl'
+    generator = SubmissionGenerator (_BCDM_DEF, invalid_rate=0.3, seed=7)
+    with open(path, 'w') as stream:
+        write_records (generator, 300, stream)
+        stream.write ('{"id":"no-ids","submission_type":"specimen","submission_packet":{"notes":"no processid or sampleid"}}\n')
+    return path.read_text()
+
+def run (tool, submissions, checkpoint, *options, bcdm_def=_BCDM_DEF):
+    """Returns (stdout, stderr lines but the checkpoint summary, checkpoint summary) of one run."""
+    definition = ['--mapping', os.path.join(_BCDM_DIR, 'mapping_BCDM_to_BOLD.tsv')] if tool.startswith('conversion') else ['--bcdm-def', bcdm_def]
+    result = subprocess.run ([sys.executable, os.path.join(_TOOLS_DIR, tool), *definition, '--checkpoint', str(checkpoint), *options],
+                             input=submissions, capture_output=True, text=True, env=dict(os.environ, BCDM_CACHE_DIR=str(checkpoint) + '.cache'))
+    messages = result.stderr.splitlines()
+    summary = [message for message in messages if message.startswith('[INFO] checkpoint:')]
+    return result.stdout, [message for message in messages if message not in summary], summary
+
+@pytest.mark.parametrize('tool, options', [
+    ('validation/1_acceptability_check.py', []),
+    ('validation/1_acceptability_check.py', ['--workers', '2', '--all-or-nothing', '--batch-size', '70', '--chunk-size', '50']),
+    ('validation/1_acceptability_check.py', ['--fill-basecount']),
+    ('validation/2_validate.py', ['--all-or-nothing', '--batch-size', '70']),
+    ('conversion/3_convert_BCDM_to_DB.py', []),
+])
+def test_replay_gives_the_same_output_and_verdicts (tool, options, submissions, tmp_path):
+    checkpoint = tmp_path / 'checkpoint.db'
+    stdout, messages, summary = run (tool, submissions, checkpoint, *options)
+    assert summary == ["[INFO] checkpoint: 0 lines replayed, 301 processed"]
+    assert any(message.startswith('[ERROR]') for message in messages)
+
+    replayed = run (tool, submissions, checkpoint, *options)
+    assert replayed == (stdout, messages, ["[INFO] checkpoint: 301 lines replayed, 0 processed"])
+
+def test_an_edited_line_is_validated_again (submissions, tmp_path):
+    checkpoint = tmp_path / 'checkpoint.db'
+    run ('validation/1_acceptability_check.py', submissions, checkpoint)
+    lines = submissions.splitlines(keepends=True)
+    lines[5] = lines[5].replace('"submission_type"', '"submission_type" ', 1)
+    _, _, summary = run ('validation/1_acceptability_check.py', ''.join(lines), checkpoint)
+    assert summary == ["[INFO] checkpoint: 300 lines replayed, 1 processed"]
+
+def test_other_flags_start_over (submissions, tmp_path):
+    checkpoint = tmp_path / 'checkpoint.db'
+    run ('validation/1_acceptability_check.py', submissions, checkpoint)
+    _, messages, summary = run ('validation/1_acceptability_check.py', submissions, checkpoint, '--fill-basecount')
+    assert summary == ["[INFO] checkpoint: 0 lines replayed, 301 processed"]
+    assert any("starting over" in message for message in messages)
+
+def test_an_edited_field_definition_starts_over (submissions, tmp_path):
+    checkpoint = tmp_path / 'checkpoint.db'
+    bcdm_def = tmp_path / 'field_definitions.tsv'
+    shutil.copy (_BCDM_DEF, bcdm_def)
+    run ('validation/1_acceptability_check.py', submissions, checkpoint, bcdm_def=str(bcdm_def))
+    with open(bcdm_def, 'a') as definitions:
+        definitions.write ('\n')
+    os.utime (bcdm_def, ns=(1, 1))      # a new mtime even on coarse clocks
+    _, messages, summary = run ('validation/1_acceptability_check.py', submissions, checkpoint, bcdm_def=str(bcdm_def))
+    assert summary == ["[INFO] checkpoint: 0 lines replayed, 301 processed"]
+    assert any("starting over" in message for message in messages)
@@ -0,0 +1,71 @@
+import json, sys, os
+import subprocess
+
+import pytest
+
+_TOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.append (os.path.join(_TOOLS_DIR, 'common'))
+sys.path.append (os.path.join(_TOOLS_DIR, 'conversion'))
+from coalesce import Coalescer
+from record_identity import IdentityConflict, record_identifiers
+
+_MAPPING = {'processid': {}, 'sampleid': {}, 'notes': {}, 'province/state': {'policy': 'append'}}
+
+def converted (**values):
+    return {field.replace('__', '/'): [{'db_table': 't', 'db_field': field, 'value': value}] for field, value in values.items()}
+
+def coalesce (records, memory_records=100000):
+    coalescer = Coalescer (_MAPPING, memory_records)
+    try:
+        for packet, converted_obj in records:
+            coalescer.add (record_identifiers (packet), converted_obj)
+        return [{field: [entry['value'] for entry in entries] for field, entries in obj.items()} for obj in coalescer]
+    finally:
+        coalescer.close()
+
+@pytest.mark.parametrize('memory_records', [100000, 1])
+def test_processid_and_sampleid_with_the_same_value_stay_apart (memory_records):
+    result = coalesce ([
+        ({'processid': 'X'}, converted (processid='X', notes='a')),
+        ({'sampleid': 'X'}, converted (sampleid='X', notes='b')),
+    ], memory_records)
+    assert result == [{'processid': ['X'], 'notes': ['a']}, {'sampleid': ['X'], 'notes': ['b']}]
+
+@pytest.mark.parametrize('memory_records', [100000, 1])
+def test_mixed_identifier_updates_merge_into_one_specimen (memory_records):
+    result = coalesce ([
+        ({'processid': 'P'}, converted (processid='P', notes='a', province__state='Ontario')),
+        ({'processid': 'Q'}, converted (processid='Q')),
+        ({'processid': 'P', 'sampleid': 'S'}, converted (processid='P', sampleid='S', notes='b')),
+        ({'sampleid': 'S'}, converted (sampleid='S', province__state='Quebec')),
+    ], memory_records)
+    assert result == [
+        {'processid': ['P'], 'notes': ['b'], 'province/state': ['Ontario', 'Quebec'], 'sampleid': ['S']},
+        {'processid': ['Q']},
+    ]
+
+def test_contradicting_identifiers_are_rejected ():
+    coalescer = Coalescer (_MAPPING)
+    coalescer.add (record_identifiers ({'processid': 'P', 'sampleid': 'S1'}), converted (processid='P', sampleid='S1'))
+    coalescer.add (record_identifiers ({'processid': 'Q'}), converted (processid='Q'))
+    with pytest.raises (IdentityConflict):
+        coalescer.add (record_identifiers ({'processid': 'P', 'sampleid': 'S2'}), converted (processid='P', sampleid='S2'))
+    with pytest.raises (IdentityConflict):      # two known specimens
+        coalescer.add (record_identifiers ({'processid': 'Q', 'sampleid': 'S1'}), converted (processid='Q', sampleid='S1'))
+    assert (coalescer.added, coalescer.specimens) == (2, 2)
+    coalescer.close()
+
+def test_convert_tool_coalesces_by_field_and_value (tmp_path):
+    submissions = [
+        {'id': 'r1', 'submission_type': 'specimen', 'submission_packet': {'processid': 'X', 'notes': 'a'}},
+        {'id': 'r2', 'submission_type': 'specimen', 'submission_packet': {'sampleid': 'X', 'notes': 'b'}},
+        {'id': 'r3', 'submission_type': 'specimen', 'submission_packet': {'processid': 'X', 'sampleid': 'S', 'notes': 'c'}},
+    ]
+    result = subprocess.run ([sys.executable, os.path.join(_TOOLS_DIR, 'conversion', '3_convert_BCDM_to_DB.py'),
+                              '--mapping', os.path.join(_TOOLS_DIR, os.pardir, 'mapping_BCDM_to_BOLD.tsv'), '--coalesce'],
+                             input=''.join(json.dumps(submission) + '\n' for submission in submissions),
+                             capture_output=True, text=True, env=dict(os.environ, BCDM_CACHE_DIR=str(tmp_path)))
+    assert result.returncode == 0, result.stderr
+    specimens = [json.loads(line) for line in result.stdout.splitlines()]
+    assert [[entry['value'] for entry in obj['notes']] for obj in specimens] == [['c'], ['b']]
+    assert "coalesced 3 records into 2 specimens" in result.stderr
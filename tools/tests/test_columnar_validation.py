@@ -0,0 +1,75 @@
+import io
+import json, sys, os
+import subprocess
+
+import pytest
+
+_TOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+_BCDM_DIR = os.path.join(_TOOLS_DIR, os.pardir)
+sys.path.append (os.path.join(_TOOLS_DIR, 'common'))
+sys.path.append (os.path.join(_TOOLS_DIR, 'validation'))
+sys.path.append (os.path.join(_TOOLS_DIR, 'benchmarks'))
+from generate_submissions import SubmissionGenerator, write_records
+
+_BCDM_DEF = os.path.join(_BCDM_DIR, 'field_definitions.tsv')
+_VOCABULARIES = os.path.join(_BCDM_DIR, 'controlled_vocabularies.tsv')
+_COUNTRIES = os.path.join(_BCDM_DIR, 'registered_soverign_and_maritime_areas.tsv')
+
+# One record per error class of validate_submission_obj, as changes to a valid packet
+_ERROR_CLASSES = [
+    {'submission_type': 'sample'},
+    {'packet': {'sampleid': ''}},
+    {'drop': ['bold_recordset_code_arr']},
+    {'packet': {'not_a_bcdm_field': 'x'}},
+    {'packet': {'elev': 'high', 'collection_date_start': '2020-13-01', 'coord': '[1,2,3]'}},
+    {'packet': {'collection_date_start': '2021-05-02', 'collection_date_end': '2021-05-01'}},
+    {'packet': {'nuc': 'ACGTXACGT'}},
+    {'packet': {'nuc': 'ACGTACGT', 'nuc_basecount': '7'}},
+    {'packet': {'nuc': 'ACGTNNNNNNNN', 'nuc_basecount': '4'}},
+    {'packet': {'nuc': 'ACGT--------', 'nuc_basecount': '4'}},
+    {'packet': {'nuc': 'AC\nGT'}},
+    {'packet': {'identification_method': 'guesswork', 'sampling_protocol': 'Malaise trap,nets'}},
+    {'packet': {'country/ocean': 'Canadaa', 'country_iso': 'XX'}},
+    {'packet': {'country/ocean': 'canada', 'country_iso': 'ca'}},
+    {'packet': {'processid': '', 'sampleid': ''}},
+]
+
+@pytest.fixture(scope='module')
+def submissions (tmp_path_factory):
+    generator = SubmissionGenerator (_BCDM_DEF, _VOCABULARIES, _COUNTRIES, invalid_rate=0.5, seed=3)
+    stream = io.StringIO()
+    write_records (generator, 400, stream)
+    valid = next(SubmissionGenerator (_BCDM_DEF, _VOCABULARIES, _COUNTRIES, seed=5).records (1))
+    for i, change in enumerate(_ERROR_CLASSES):
+        record = json.loads(json.dumps(valid))
+        record['id'] = f"class{i}"
+        record['submission_type'] = change.get('submission_type', record['submission_type'])
+        record['submission_packet'].update (change.get('packet', {}))
+        for field in change.get('drop', []):
+            del record['submission_packet'][field]
+        stream.write (json.dumps(record) + '\n')
+    return stream.getvalue()
+
+def validate (submissions, *options):
+    result = subprocess.run ([sys.executable, os.path.join(_TOOLS_DIR, 'validation', '1_acceptability_check.py'), '--bcdm-def', _BCDM_DEF, *options],
+                             input=submissions, capture_output=True, text=True)
+    return result.returncode, result.stdout, result.stderr
+
+@pytest.mark.parametrize('options', [
+    [],
+    ['--vocabularies', _VOCABULARIES, '--countries', _COUNTRIES],
+    ['--update', '--fill-basecount'],
+])
+def test_columnar_engine_gives_the_record_engine_verdicts (submissions, options):
+    record = validate (submissions, '--engine', 'record', *options)
+    for engine, workers in [('columnar', []), ('columnar', ['--workers', '2', '--chunk-size', '64']), ('record', ['--workers', '2', '--chunk-size', '64'])]:
+        assert validate (submissions, '--engine', engine, *options, *workers) == record, (engine, workers)
+
+    required = "At least 1 of the following columns" if '--update' in options else "Required column sampleid"
+    for error in ("Invalid submission type", required, "Invalid data type/format", "Invalid date range", "Invalid nucleotide symbols",
+                  "does not match the", "ambiguity codes", "are gaps", "Invalid fields found", "[DEBUG] Bad type"):
+        assert error in record[2]
+    if '--vocabularies' in options:
+        assert "Invalid controlled vocabulary term for identification_method" in record[2]
+        assert "Invalid controlled vocabulary term for country/ocean" in record[2]
+        assert "[ERROR][Request class13]" not in record[2]         # country names and ISO codes in any case
@@ -0,0 +1,24 @@
+import os, sys
+import subprocess
+
+_TOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.append (os.path.join(_TOOLS_DIR, 'common'))
+import compiled_tables
+
+def test_tables_are_loaded_once_per_process (tmp_path, monkeypatch):
+    monkeypatch.setenv ('BCDM_CACHE_DIR', str(tmp_path / 'cache'))
+    table = tmp_path / 'controlled_vocabularies.tsv'
+    table.write_text ('field\tterm\nsex\tmale\n')
+    first = compiled_tables.read_table (str(table))
+    assert first == [{'field': 'sex', 'term': 'male'}]
+    assert compiled_tables.read_table (str(table)) is first
+
+    table.write_text ('field\tterm\nsex\tfemale\n')
+    os.utime (table, ns=(1, 1))         # a new mtime even on coarse clocks
+    assert compiled_tables.read_table (str(table)) == [{'field': 'sex', 'term': 'female'}]
+
+def test_validation_modules_import_without_the_common_path ():
+    validation_dir = os.path.join(_TOOLS_DIR, 'validation')
+    result = subprocess.run ([sys.executable, '-c', 'import bcdm_schema, vocabulary'], cwd=validation_dir, capture_output=True, text=True,
+                             env=dict(os.environ, PYTHONPATH=validation_dir))
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,29 @@
+import sys, os
+import subprocess
+
+import pytest
+
+_TOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+_BCDM_DIR = os.path.join(_TOOLS_DIR, os.pardir)
+
+def convert (export, tmp_path, *options):
+    return subprocess.run ([sys.executable, os.path.join(_TOOLS_DIR, 'conversion', 'convert_BOLD_to_BCDM.py'), '--input', '-',
+                            '--mapping', os.path.join(_BCDM_DIR, 'mapping_BOLD_to_BCDM.tsv'), '--bcdm-def', os.path.join(_BCDM_DIR, 'field_definitions.tsv'), *options],
+                           input=export, capture_output=True, text=True, env=dict(os.environ, BCDM_CACHE_DIR=str(tmp_path)))
+
+def test_composite_columns_are_split (tmp_path):
+    result = convert ('processid\tgeopol_denorm\nP1\t{"country":"Canada","province":"Ontario"}\nP2\t\n', tmp_path)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.splitlines() == ['{"province/state":"Ontario","country/ocean":"Canada"}', '{}']
+
+def test_empty_input_is_an_error (tmp_path):
+    result = convert ('', tmp_path)
+    assert result.returncode == 1
+    assert "[ERROR] Input - is empty" in result.stderr
+
+@pytest.mark.parametrize('value, message', [('{"country":', "Row 3: invalid JSON in geopol_denorm"), ('["Canada"]', "Row 3: geopol_denorm is not a JSON object")])
+def test_malformed_composite_is_an_error (value, message, tmp_path):
+    result = convert (f'processid\tgeopol_denorm\nP1\t{{"country":"Canada"}}\nP2\t\nP3\t{value}\n', tmp_path, '--chunk-size', '2')
+    assert result.returncode == 1
+    assert f"[ERROR] {message}" in result.stderr
+    assert "Traceback" not in result.stderr
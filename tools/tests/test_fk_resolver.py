@@ -0,0 +1,62 @@
+import sys, os
+import sqlite3
+
+import pytest
+
+_TOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.append (os.path.join(_TOOLS_DIR, 'common'))
+sys.path.append (os.path.join(_TOOLS_DIR, 'conversion'))
+from fk_resolver import ForeignKeyResolver
+
+_COUNTRIES = os.path.join(_TOOLS_DIR, os.pardir, 'registered_soverign_and_maritime_areas.tsv')
+_MAPPING = {
+    'taxid': {'sub_table_field': 'tax'},
+    'class': {'sub_table_field': 'tax.name'},
+    'family': {'sub_table_field': 'tax'},
+    'country/ocean': {'sub_table_field': 'geopol.name', 'constraint': "geopol.rank='country'", 'policy': 'lookup'},
+    'country_iso': {'sub_table_field': 'geopol.iso3', 'constraint': "geopol.rank='country'", 'policy': 'lookup'},
+    'primers_forward': {'sub_table_field': "primer.code || ':' || primer.nuc", 'policy': 'lookup'},
+}
+
+@pytest.fixture
+def resolver (tmp_path):
+    db_path = tmp_path / 'reference.db'
+    conn = sqlite3.connect(db_path)
+    conn.execute('CREATE TABLE tax (id integer primary key, name text)')
+    conn.execute('CREATE TABLE geopol (id integer primary key, name text, iso3 text, rank text)')
+    conn.execute('CREATE TABLE primer (id integer primary key, code text, nuc text)')
+    conn.executemany('INSERT INTO tax VALUES (?, ?)', [(1, 'Insecta'), (2, 'Noctuidae'), (3, '2')])
+    conn.execute("INSERT INTO geopol VALUES (10, 'Canada', 'CAN', 'country')")
+    conn.executemany('INSERT INTO primer VALUES (?, ?, ?)', [(20, 'LepF1', 'ATTC'), (21, 'MLepF1', 'GCTT')])
+    conn.commit()
+    conn.close()
+    resolver = ForeignKeyResolver (str(db_path), _MAPPING, array_fields=['primers_forward'], countries=_COUNTRIES)
+    yield resolver
+    resolver.conn.close()
+
+def converted (**values):
+    return {field.replace('__', '/'): [{'db_table': 't', 'db_field': field, 'value': value}] for field, value in values.items()}
+
+def fk_ids (obj):
+    return {field: entries[0].get('fk_id') for field, entries in obj.items()}
+
+def test_taxid_resolves_by_id_next_to_name_references (resolver):
+    objs = [converted (taxid='1'), converted (taxid='3', **{'class': 'Insecta'}, family='Noctuidae')]
+    assert resolver.resolve (objs) == [[], []]
+    assert [fk_ids (obj) for obj in objs] == [{'taxid': 1}, {'taxid': 3, 'class': 1, 'family': 2}]
+
+    # name and id misses are cached apart: a later batch still resolves '2' as an id
+    obj = converted (taxid='2', **{'class': '2'})
+    resolver.resolve ([obj])
+    assert fk_ids (obj) == {'taxid': 2, 'class': 3}
+
+def test_array_terms_are_resolved_one_by_one (resolver):
+    objs = [converted (primers_forward='LepF1:ATTC, MLepF1:GCTT'), converted (primers_forward='LepF1:ATTC'), converted (primers_forward='LepF1:ATTC,Nope:A')]
+    assert resolver.resolve (objs) == [[], [], [('primers_forward', 'Nope:A')]]
+    assert [fk_ids (obj) for obj in objs] == [{'primers_forward': [20, 21]}, {'primers_forward': 20}, {'primers_forward': None}]
+
+@pytest.mark.parametrize('field, value', [('country__ocean', 'Canada'), ('country__ocean', ' canada'), ('country_iso', 'can'), ('country_iso', 'CA')])
+def test_countries_match_as_validation_accepts_them (resolver, field, value):
+    obj = converted (**{field: value})
+    assert resolver.resolve ([obj]) == [[]]
+    assert list(fk_ids (obj).values()) == [10]
@@ -0,0 +1,45 @@
+import io
+import sys, os
+import random
+import struct
+
+import pytest
+
+sys.path.append (os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+import jsonl_io
+
+@pytest.fixture
+def stdlib_only (monkeypatch):
+    monkeypatch.setattr (jsonl_io, 'orjson', None)
+
+def random_floats (count, seed=0):
+    rng = random.Random(seed)
+    values = [1e16, 1e15, 1e-5, -1.2345e-5, 1e-4, 5e-324, -0.0, 1e308, 0.1, 123456789.125]
+    for _ in range(count):
+        values.append(struct.unpack('d', struct.pack('Q', rng.getrandbits(64)))[0])
+        values.append(10 ** rng.uniform(-30, 30))
+    return values
+
+def test_stdlib_fallback_writes_the_same_bytes_as_orjson (monkeypatch):
+    orjson = pytest.importorskip ('orjson')
+    objs = [{'v': value, 's': 'é "1e-05" NaN \\ 2e+16', 'l': [value, 1, None, True]} for value in random_floats (20000)]
+    objs.append ({'v': [float('nan'), float('inf'), -float('inf')]})
+    expected = [orjson.dumps(obj) for obj in objs]
+    monkeypatch.setattr (jsonl_io, 'orjson', None)
+    assert [jsonl_io.dumps(obj) for obj in objs] == expected
+
+@pytest.mark.parametrize('document', ['{"a":NaN}', '[Infinity]', '[-Infinity]', '[1e400]'])
+@pytest.mark.parametrize('backend', ['default', 'stdlib'])
+def test_non_finite_numbers_are_rejected (document, backend, monkeypatch):
+    if backend == 'stdlib':
+        monkeypatch.setattr (jsonl_io, 'orjson', None)
+    with pytest.raises (ValueError):
+        jsonl_io.loads (document)
+
+def test_stdlib_fallback_keeps_big_integers_and_text (stdlib_only):
+    assert jsonl_io.loads ('{"n":123456789012345678901234567890,"s":"é"}') == {'n': 123456789012345678901234567890, 's': 'é'}
+    assert jsonl_io.dumps ({'n': 2 ** 70, 'f': 1e-05, 's': 'é'}) == '{"n":1180591620717411303424,"f":0.00001,"s":"é"}'.encode('utf-8')
+
+def test_read_lines_keeps_carriage_returns ():
+    stream = io.BytesIO (b'{"a":1}\r\n{"b":2}\n{"c":3}')
+    assert list(jsonl_io.read_lines (stream, block_size=4)) == [b'{"a":1}\r', b'{"b":2}', b'{"c":3}']
@@ -0,0 +1,123 @@
+import importlib
+import json, sys, os
+import sqlite3
+import subprocess
+
+import pytest
+
+_TOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.append (os.path.join(_TOOLS_DIR, 'common'))
+sys.path.append (os.path.join(_TOOLS_DIR, 'loading'))
+load_to_db = importlib.import_module('5_load_to_DB')
+
+def entry (table, field, value, fk_id=None):
+    result = {'db_table': table, 'db_field': field, 'value': value}
+    if fk_id is not None:
+        result['fk_id'] = fk_id
+    return result
+
+def specimen (processid=None, sampleid=None, **fields):
+    obj = {}
+    if processid is not None:
+        obj['processid'] = [entry('seqentry', 'processid', processid)]
+    if sampleid is not None:
+        obj['sampleid'] = [entry('specimen', 'sampleid', sampleid)]
+    obj.update(fields)
+    return obj
+
+def load (loader, objs):
+    return loader.load ([(line_number, load_to_db.get_record_identifiers (obj), load_to_db.table_rows (obj))
+                         for line_number, obj in enumerate(objs, start=1)])
+
+def rows (loader, table):
+    return loader.conn.execute(f'SELECT * FROM "{table}" ORDER BY record_key').fetchall()
+
+@pytest.fixture
+def loader ():
+    loader = load_to_db.BatchLoader (':memory:', create_tables=True)
+    yield loader
+    loader.conn.close()
+
+def test_rows_and_upsert_on_conflict (loader):
+    assert load (loader, [
+        specimen ('P1', 'S1', notes=[entry('specimendetails', 'fk_notes', 'first')]),
+        specimen ('P2'),
+    ]) == []
+    assert rows (loader, 'specimen') == [('processid:P1', 'S1')]
+    assert rows (loader, 'specimendetails') == [('processid:P1', 'first')]
+
+    # a later batch naming only the sampleid updates the same specimen, and leaves other columns alone
+    assert load (loader, [specimen (sampleid='S1', notes=[entry('specimendetails', 'fk_notes', 'second')])]) == []
+    assert rows (loader, 'specimendetails') == [('processid:P1', 'second')]
+    assert rows (loader, 'seqentry') == [('processid:P1', 'P1'), ('processid:P2', 'P2')]
+
+def test_sparse_records_share_one_statement_per_table (loader):
+    load (loader, [specimen ('P1', notes=[entry('specimendetails', 'fk_notes', 'first')], collection_notes=[entry('specimendetails', 'fk_collectionnote', 'kept')])])
+    statements = loader.statements
+    assert load (loader, [
+        specimen ('P1', notes=[entry('specimendetails', 'fk_notes', 'second')]),
+        specimen ('P2', collection_notes=[entry('specimendetails', 'fk_collectionnote', 'c2')]),
+        specimen ('P3', notes=[entry('specimendetails', 'fk_notes', None)]),
+    ]) == []
+    assert loader.statements - statements == 2      # seqentry and specimendetails
+    # columns a record does not carry keep their stored value; an explicit null is written
+    assert rows (loader, 'specimendetails') == [('processid:P1', 'second', 'kept'), ('processid:P2', None, 'c2'), ('processid:P3', None, None)]
+
+def test_appended_values_are_all_loaded ():
+    obj = specimen ('P1', **{'province/state': [entry('location', 'fk_geopol', 'Ontario', 3), entry('location', 'fk_geopol', 'Quebec', 4)],
+                             'country/ocean': [entry('location', 'fk_geopol', 'Canada', 1)]})
+    assert load_to_db.table_rows (obj)['location'] == {'fk_geopol': '[3, 4]'}
+    # a value the verbatim stage repeats in the same column is loaded once
+    obj = specimen ('P1', **{'country/ocean': [entry('location', 'fk_geopol', 'Canada', 1), entry('location', 'fk_geopol', 'Canada', 1)]})
+    assert load_to_db.table_rows (obj)['location'] == {'fk_geopol': 1}
+
+def test_processid_and_sampleid_with_the_same_value_stay_apart (loader):
+    load (loader, [specimen ('X'), specimen (sampleid='X')])
+    assert rows (loader, 'seqentry') == [('processid:X', 'X')]
+    assert rows (loader, 'specimen') == [('sampleid:X', 'X')]
+
+def test_conflicting_identifiers_are_left_out (loader):
+    load (loader, [specimen ('P1', 'S1')])
+    rejected = load (loader, [specimen ('P2'), specimen ('P1', 'S2')])
+    assert [line_number for line_number, _ in rejected] == [2]
+    assert rows (loader, 'seqentry') == [('processid:P1', 'P1'), ('processid:P2', 'P2')]
+
+def test_shared_fk_column_gets_the_most_specific_value ():
+    obj = specimen ('P1',
+                    family=[entry('specimen', 'fk_tax', 'Noctuidae', 11)],
+                    **{'class': [entry('specimen', 'fk_tax', 'Insecta', 7)]},
+                    genus=[entry('specimen', 'fk_tax', 'Agrotis', 12)])
+    assert load_to_db.table_rows (obj)['specimen'] == {'fk_tax': 12}
+
+
+def test_conflicting_values_of_one_rank_are_rejected ():
+    obj = specimen ('P1', **{'country/ocean': [entry('location', 'fk_geopol', 'Canada', 1)],
+                             'country_iso': [entry('location', 'fk_geopol', 'USA', 2)]})
+    with pytest.raises (load_to_db.LoadError):
+        load_to_db.table_rows (obj)
+    # unresolved, a name and an ISO code cannot be compared: the first field of the rank is loaded
+    obj = specimen ('P1', **{'country/ocean': [entry('location', 'fk_geopol', 'Canada')],
+                             'country_iso': [entry('location', 'fk_geopol', 'CAN')]})
+    assert load_to_db.table_rows (obj)['location'] == {'fk_geopol': 'Canada'}
+
+def run_loader (db_path, objs, *options):
+    return subprocess.run ([sys.executable, os.path.join(_TOOLS_DIR, 'loading', '5_load_to_DB.py'), '--db', str(db_path), *options],
+                           input=''.join(json.dumps(obj) + '\n' for obj in objs), capture_output=True, text=True)
+
+def test_all_or_nothing_rolls_back (tmp_path):
+    db_path = tmp_path / 'bold.db'
+    result = run_loader (db_path, [specimen ('P1', 'S1')], '--create-tables')
+    assert result.returncode == 0, result.stderr
+
+    result = run_loader (db_path, [specimen ('P2'), specimen ('P3'), specimen ('P1', 'S2')], '--create-tables', '--all-or-nothing', '--batch-size', '2')
+    assert result.returncode == 1
+    assert "[ERROR][Line 3]" in result.stderr and "nothing was loaded" in result.stderr
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('SELECT record_key FROM seqentry ORDER BY record_key').fetchall() == [('processid:P1',)]
+    conn.close()
+
+    result = run_loader (db_path, [specimen ('P2'), specimen ('P3'), specimen ('P1', 'S2')], '--create-tables', '--batch-size', '2')
+    assert result.returncode == 0
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('SELECT record_key FROM seqentry ORDER BY record_key').fetchall() == [('processid:P1',), ('processid:P2',), ('processid:P3',)]
+    conn.close()
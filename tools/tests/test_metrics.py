@@ -0,0 +1,20 @@
+import json, sys, os
+
+sys.path.append (os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from metrics import Metrics
+
+def test_latency_percentiles (tmp_path):
+    metrics = Metrics ('test', str(tmp_path / 'metrics.json'))
+    for i in range(100):
+        metrics.record (f"r{i}", 0.001 if i < 98 else 0.1, True)
+    metrics.record (None, 0.0, True, replayed=True)        # replayed records carry no latency
+    metrics.close()
+    latency = json.load(open(tmp_path / 'metrics.json'))['latency_ms']
+    assert 1.0 <= latency['p50'] <= 1.1
+    assert 100.0 <= latency['p99'] <= 110.0
+    assert latency['max'] == 100.0
+
+def test_no_latency_without_records (tmp_path):
+    metrics = Metrics ('test', str(tmp_path / 'metrics.json'))
+    metrics.close()
+    assert json.load(open(tmp_path / 'metrics.json'))['latency_ms'] == {'p50': None, 'p99': None, 'max': None}
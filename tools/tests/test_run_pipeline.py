@@ -0,0 +1,57 @@
+import io
+import sys, os
+import subprocess
+
+import pytest
+
+_TOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+_BCDM_DIR = os.path.join(_TOOLS_DIR, os.pardir)
+sys.path.append (os.path.join(_TOOLS_DIR, 'common'))
+sys.path.append (os.path.join(_TOOLS_DIR, 'validation'))
+sys.path.append (os.path.join(_TOOLS_DIR, 'benchmarks'))
+from generate_submissions import SubmissionGenerator, write_records
+
+_BCDM_DEF = ['--bcdm-def', os.path.join(_BCDM_DIR, 'field_definitions.tsv')]
+_MAPPING = ['--mapping', os.path.join(_BCDM_DIR, 'mapping_BCDM_to_BOLD.tsv')]
+_MAPPING_VERBATIM = ['--mapping-verbatim', os.path.join(_BCDM_DIR, 'mapping_verbatim_to_BOLD.tsv')]
+
+@pytest.fixture(scope='module')
+def submissions ():
+    stream = io.StringIO()
+    write_records (SubmissionGenerator (_BCDM_DEF[1], invalid_rate=0.3, seed=11), 300, stream)
+    return stream.getvalue().encode('utf-8')
+
+def tool (path, *options):
+    return [sys.executable, os.path.join(_TOOLS_DIR, path), *options]
+
+def error_lines (stderr):
+    return sorted(line for line in stderr.decode('utf-8').splitlines() if line.startswith('[ERROR]'))
+
+def piped (submissions, stages, tmp_path):
+    """stdout and stderr of the stages piped into each other."""
+    stderr_path = tmp_path / 'piped.err'
+    with open(stderr_path, 'wb') as stderr:
+        procs = []
+        for i, argv in enumerate(stages):
+            procs.append (subprocess.Popen (argv, stdin=subprocess.PIPE if i == 0 else procs[-1].stdout, stdout=subprocess.PIPE, stderr=stderr))
+            if i > 0:
+                procs[-2].stdout.close()
+        procs[0].stdin.write (submissions)
+        procs[0].stdin.close()
+        stdout = procs[-1].stdout.read()
+        for proc in procs:
+            proc.wait()
+    return stdout, stderr_path.read_bytes()
+
+@pytest.mark.parametrize('mode, update', [('add', []), ('replace', []), ('add', ['--update'])])
+def test_fused_pipeline_matches_the_piped_tools (submissions, mode, update, tmp_path):
+    stdout, stderr = piped (submissions, [
+        tool ('validation/1_acceptability_check.py', *_BCDM_DEF, *update),
+        tool ('conversion/3_convert_BCDM_to_DB.py', *_MAPPING),
+        tool ('conversion/4_convert_to_verbatim.py', *_MAPPING_VERBATIM, '--mode', mode),
+    ], tmp_path)
+    fused = subprocess.run (tool ('run_pipeline.py', *_BCDM_DEF, *_MAPPING, *_MAPPING_VERBATIM, '--mode', mode, *update),
+                            input=submissions, capture_output=True)
+    assert fused.returncode == 0, fused.stderr
+    assert stdout and fused.stdout == stdout
+    assert error_lines (fused.stderr) == error_lines (stderr)
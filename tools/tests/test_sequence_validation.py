@@ -0,0 +1,68 @@
+import importlib
+import json, sys, os
+
+import pytest
+
+_TOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.append (os.path.join(_TOOLS_DIR, 'common'))
+sys.path.append (os.path.join(_TOOLS_DIR, 'validation'))
+sys.path.append (os.path.join(_TOOLS_DIR, 'benchmarks'))
+from sequence_validation import SequenceCounts, basecount_value, count_packet_sequences, count_sequences
+from bench_sequences import scalar_counts
+acceptability_check = importlib.import_module('1_acceptability_check')
+
+_BCDM_DEF = os.path.join(_TOOLS_DIR, os.pardir, 'field_definitions.tsv')
+
+def test_counts_match_the_scalar_reference ():
+    sequences = ['ACGTACGT', 'acgtuACGTU', 'ACGTNRY--', 'ACXGT Z', 'AÄGT', 'AC\nGT', '', 'NNNN', 'ac-gt']
+    assert count_sequences (sequences) == [scalar_counts (sequence) for sequence in sequences]
+
+def test_counts ():
+    assert count_sequences (['acgtu']) == [SequenceCounts(5, 5, 0, 0, 0)]
+    assert count_sequences (['ACGTNRY--']) == [SequenceCounts(9, 4, 3, 2, 0)]
+    assert count_sequences (['AÄGT']) == [SequenceCounts(4, 3, 0, 0, 1)]
+    assert count_sequences (['AC\nGT', 'ACGT']) == [SequenceCounts(5, 4, 0, 0, 1), SequenceCounts(4, 4, 0, 0, 0)]
+    assert count_sequences ([]) == []
+
+def test_packets_without_a_sequence ():
+    assert count_packet_sequences ([{'nuc': 'ACGT'}, {}, {'nuc': ''}, {'nuc': 5}]) == [SequenceCounts(4, 4, 0, 0, 0), None, SequenceCounts(0, 0, 0, 0, 0), None]
+
+@pytest.mark.parametrize('value, expected', [(None, None), ('', None), ('12', 12), (12, 12), ('12a', None), ([1], None)])
+def test_basecount_value (value, expected):
+    assert basecount_value (value) == expected
+
+def validate (packet):
+    json_obj = {'id': 'r1', 'submission_type': 'specimen', 'submission_packet': dict(packet, sampleid='S1', bold_recordset_code_arr='DS-A1')}
+    schema = acceptability_check.load_schema (_BCDM_DEF)
+    return acceptability_check.validate_submission_obj (json_obj, False, schema)
+
+@pytest.mark.parametrize('packet, valid, message', [
+    ({'nuc': 'ACGTNacgu', 'nuc_basecount': '8'}, True, None),
+    ({'nuc': 'ACGTACGT', 'nuc_basecount': '7'}, False, 'nuc_basecount (7) does not match the 8 non-degenerate bases of nuc'),
+    ({'nuc': 'ACGT\nACGT'}, False, "Invalid nucleotide symbols in nuc: '\\n'"),
+    ({'nuc': '', 'nuc_basecount': '5'}, False, 'nuc_basecount (5) does not match the 0 non-degenerate bases of nuc'),
+    ({'nuc': '', 'nuc_basecount': '0'}, True, None),
+    ({'nuc_basecount': '5'}, True, None),
+])
+def test_validate_sequence (packet, valid, message):
+    isValid, msgs = validate (packet)
+    assert isValid == valid
+    if message:
+        assert any(msg.endswith(message) for msg in msgs), msgs
+
+def test_ambiguity_warning (capsys):
+    isValid, _ = validate ({'nuc': 'ACGTN' * 10})
+    assert isValid
+    assert "10 of 50 symbols of nuc are ambiguity codes" in capsys.readouterr().err
+
+def fill (packet):
+    json_obj = {'id': 'r1', 'submission_packet': packet}
+    filled = acceptability_check.fill_basecount (json_obj, count_packet_sequences ([packet])[0])
+    return json.loads(filled)['submission_packet'] if filled else None
+
+def test_fill_basecount ():
+    assert fill ({'nuc': 'ACGTNacgu'}) == {'nuc': 'ACGTNacgu', 'nuc_basecount': 8}
+    assert fill ({'nuc': 'ACGT', 'nuc_basecount': ''}) == {'nuc': 'ACGT', 'nuc_basecount': 4}
+    assert fill ({'nuc': 'ACGT', 'nuc_basecount': '4'}) is None
+    assert fill ({'nuc': ''}) is None
+    assert fill ({}) is None
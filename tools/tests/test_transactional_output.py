@@ -0,0 +1,44 @@
+import io
+import sys, os
+import subprocess
+
+import pytest
+
+_TOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.append (os.path.join(_TOOLS_DIR, 'common'))
+from transactional_output import TransactionalOutput
+
+def test_batches_commit_independently ():
+    stream = io.BytesIO()
+    output = TransactionalOutput (2, stream=stream)
+    output.write ('a')
+    output.write ('b')
+    output.write ('c')
+    output.reject ()
+    output.write ('e')
+    assert not output.close ()
+    assert stream.getvalue() == b'a\nb\ne\n'
+    assert (output.committed_batches, output.aborted_batches) == (2, 1)
+
+@pytest.mark.parametrize('batch_size', [0, -1])
+def test_batch_size_must_be_positive (batch_size):
+    with pytest.raises (ValueError):
+        TransactionalOutput (batch_size)
+
+_BCDM_DIR = os.path.join(_TOOLS_DIR, os.pardir)
+_BCDM_DEF = ['--bcdm-def', os.path.join(_BCDM_DIR, 'field_definitions.tsv')]
+_MAPPING = ['--mapping', os.path.join(_BCDM_DIR, 'mapping_BCDM_to_BOLD.tsv')]
+_MAPPING_VERBATIM = ['--mapping-verbatim', os.path.join(_BCDM_DIR, 'mapping_verbatim_to_BOLD.tsv')]
+
+@pytest.mark.parametrize('tool, options', [
+    ('validation/1_acceptability_check.py', _BCDM_DEF),
+    ('validation/2_validate.py', _BCDM_DEF),
+    ('conversion/3_convert_BCDM_to_DB.py', _MAPPING),
+    ('conversion/4_convert_to_verbatim.py', _MAPPING_VERBATIM),
+    ('run_pipeline.py', _BCDM_DEF + _MAPPING + _MAPPING_VERBATIM),
+])
+def test_tools_reject_a_batch_size_of_zero (tool, options):
+    result = subprocess.run ([sys.executable, os.path.join(_TOOLS_DIR, tool), *options, '--all-or-nothing', '--batch-size', '0'],
+                             input='', capture_output=True, text=True)
+    assert result.returncode == 2
+    assert "--batch-size must be positive" in result.stderr
@@ -1,100 +1,51 @@
 import sys, os
 import argparse
-import json
-import re
-import dateparser
-from datetime import datetime
-import pandas as pd
+import collections
+import io
+import multiprocessing
+import time
+from contextlib import redirect_stderr
+
+sys.path.append (os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from transactional_output import TransactionalOutput
+from metrics import CheckStats, Metrics, timed_stage
+from checkpoint import captured_stderr, open_checkpoint
+from jsonl_io import JsonlWriter, dumps, loads, read_lines
+from bcdm_schema import compile_value_check, load_schema, placeholder_to_regex
+from date_validation import invalid_date_ranges
+from sequence_validation import (BASECOUNT_FIELD, MAX_AMBIGUOUS_FRACTION, MAX_GAP_FRACTION, SEQUENCE_FIELD,
+                                 basecount_value, count_packet_sequences, invalid_symbols)
 
 _ACCEPTED_SUB_TYPES = ['specimen']
+metrics = None      # Metrics when --metrics-out is set
 _MIN_REQUIRED_FIELDS = {
     'specimen:update': [tuple(['sampleid', 'processid'])],
     'specimen:new':['bold_recordset_code_arr', 'sampleid']
 }
 
-PLACEHOLDER_REGEX = {
-    "%s": ".+",          # any non-empty string
-    "%d": r"\d+",        # integer number
-    "%f": r"[-+]?\d*\.?\d+",  # float number
-}
-
 def convert_placeholder_to_regex (value, match_empty_string = False):
-    regex_str = re.escape(value)  # escape all special characters
-    if match_empty_string:
-        PLACEHOLDER_REGEX["%s"]=".*"
-    for placeholder, replacement in PLACEHOLDER_REGEX.items():
-        # replace the escaped placeholder with the regex pattern
-        regex_str = regex_str.replace(re.escape(placeholder), replacement)
-    return re.compile(regex_str)
+    return placeholder_to_regex (value, match_empty_string)
 
 def read_mapping (file):
+    import pandas as pd
     return pd.read_csv(file, sep='\t') #, index_col="field")
 
 def isvalid_value (value, expected_datatype, expected_dataformat):
-    if value == "": return True
-    # 1. Type check
-    try:
-        if expected_datatype == 'string':
-            str(value)
-        elif expected_datatype in ['int', 'integer']:
-            int(value)
-        elif expected_datatype in ['float', 'number']:
-            float(value)
-        elif expected_datatype == ['string:date', 'date']:
-            str(value)
-            dateparser.parse(value)
-        elif expected_datatype == 'char':
-            if not isinstance (value, str) or not len(value)==1:
-                return False
-        elif expected_datatype == 'geopoint':       # TODO: confirm input format
-            temp_array = value.split(",")
-            if len(temp_array) != 2:
-                return False
-        elif expected_datatype == 'array':
-            value.split(",")
-        elif expected_datatype == 'array of string':
-            temp_array = value.split(",")
-            for val in temp_array:
-                str(val)
-        elif expected_datatype == 'json':
-            json.loads(value)
-        
-    except Exception as e:
-        #print (e, file=sys.stderr)
-        return False
-        
-    # 2. Format check
-    
-    try: 
-        if expected_dataformat != 'default':
-            #print (f"Value:{value}; Type:{expected_datatype}; Format:{expected_dataformat} Checking...")
-            if expected_datatype =='string:date':
-                #blah = dateparser.parse(value, date_formats=[expected_dataformat], settings={'STRICT_PARSING': True})
-                parsed_date = datetime.strptime(value, expected_dataformat)
-                if parsed_date.strftime(expected_dataformat) != date_str:
-                    #print (value, file=sys.stderr)
-                    #print (parsed_date, file=sys.stderr)
-                    #print (parsed_date.strftime(expected_dataformat), file=sys.stderr)
-                    return False
-
-            elif expected_datatype == 'string':
-                regex_format = convert_placeholder_to_regex (expected_dataformat)
-                if not re.fullmatch(regex_format, value):
-                    #print ("WHY", value, expected_dataformat, regex_format)
-                    return False
-                
-    except Exception as e:
-        #print (e, file=sys.stderr)
-        return False
-    return True
-            
-def validate_submission_obj (json_obj, is_update):
+    return compile_value_check (expected_datatype, expected_dataformat)(value)
+
+def validate_submission_obj (json_obj, is_update, schema = None, field_report = None, sequence_counts = None):
+    """
+    field_report is an optional precomputed (unknown_fields, invalid_fields) for the packet, as produced by the columnar
+    engine; if omitted the packet is checked against the schema here.  Likewise sequence_counts is the SequenceCounts
+    of the packet's nuc when a whole chunk was counted at once.
+    """
     isValid = True
     msgs = []
-    bcdm_mapping = read_mapping (args.bcdm_def)
+    if schema is None:
+        schema = load_schema (args.bcdm_def, args.vocabularies, args.countries)
     
     if json_obj['submission_type'] not in _ACCEPTED_SUB_TYPES:
-        msgs.append ( f"[ERROR] Invalid submission type: Expected {','.join (_ACCEPTED_SUB_TYPES)}, received {json_obj['submission_type']}")
+        msgs.append ( f"[ERROR][Request {json_obj['id']}] Invalid submission type: Expected {','.join (_ACCEPTED_SUB_TYPES)}, received {json_obj['submission_type']}")
         isValid = False
 
     # min required field checks
@@ -112,56 +63,248 @@ def validate_submission_obj (json_obj, is_update):
                     isValid = False
 
     # data model validator
-    submitted_fields = json_obj['submission_packet'].keys()
-    #print ("[DEBUG] submitted_fields: ", submitted_fields)
-    
-    invalid_fields = [ field for field in submitted_fields if (bcdm_mapping['field'] != field).all() ]
+    unknown_fields, invalid_fields = field_report or schema.validate (json_obj['submission_packet'])
 
-    if len(invalid_fields) > 0:
-        print (f"[WARNING][Request {json_obj['id']}] Invalid fields found ", invalid_fields, file = sys.stderr)
+    if len(unknown_fields) > 0:
+        print (f"[WARNING][Request {json_obj['id']}] Invalid fields found ", unknown_fields, file = sys.stderr)
         #TODO: confirm with Sujeevan filter out bad fields?  Or throw an error? 
 
-    # TODO: datatype chexk against mapping
-    invalid_fields = []
-    for bcdm_field in json_obj['submission_packet']:
-        if json_obj['submission_packet'][bcdm_field] and (bcdm_mapping['field'] == bcdm_field).any():    # only if data submitted and also valid fields
-            #print (f"[DEBUG] Check type for {bcdm_field}")
-            row = bcdm_mapping[bcdm_mapping['field']== bcdm_field].iloc[0]
-            if not isvalid_value (json_obj['submission_packet'][bcdm_field], row['data_type'], row['data_format']):
-                print (f"[DEBUG] Bad type for {bcdm_field}; value:{json_obj['submission_packet'][bcdm_field]}; type:{row['data_type']}; format:{row['data_format']}", file=sys.stderr)
-                invalid_fields.append (bcdm_field)
+    for bcdm_field in invalid_fields:
+        spec = schema.fields[bcdm_field]
+        print (f"[DEBUG] Bad type for {bcdm_field}; value:{json_obj['submission_packet'][bcdm_field]}; type:{spec.data_type}; format:{spec.data_format}", file=sys.stderr)
     if len(invalid_fields)>0:
         isValid = False
         msgs.append (f"[ERROR][Request {json_obj['id']}] Invalid data type/format for {len(invalid_fields)} fields: {','.join (invalid_fields)}")
+
+    # date ranges
+    for start_field, end_field in invalid_date_ranges (json_obj['submission_packet'], schema):
+        isValid = False
+        msgs.append (f"[ERROR][Request {json_obj['id']}] Invalid date range: {start_field} ({json_obj['submission_packet'][start_field]}) is after {end_field} ({json_obj['submission_packet'][end_field]})")
+
+    # nucleotide sequence
+    if sequence_counts is None:
+        sequence_counts = count_packet_sequences ([json_obj['submission_packet']])[0]
+    if sequence_counts is not None:
+        if sequence_counts.invalid:
+            isValid = False
+            symbols = ', '.join (repr (symbol) for symbol in invalid_symbols (json_obj['submission_packet'][SEQUENCE_FIELD]))
+            msgs.append (f"[ERROR][Request {json_obj['id']}] Invalid nucleotide symbols in {SEQUENCE_FIELD}: {symbols}")
+        basecount = basecount_value (json_obj['submission_packet'].get(BASECOUNT_FIELD))
+        if basecount is not None and basecount != sequence_counts.bases:
+            isValid = False
+            msgs.append (f"[ERROR][Request {json_obj['id']}] {BASECOUNT_FIELD} ({basecount}) does not match the {sequence_counts.bases} non-degenerate bases of {SEQUENCE_FIELD}")
+        if sequence_counts.ambiguous > MAX_AMBIGUOUS_FRACTION * sequence_counts.length:
+            print (f"[WARNING][Request {json_obj['id']}] {sequence_counts.ambiguous} of {sequence_counts.length} symbols of {SEQUENCE_FIELD} are ambiguity codes", file=sys.stderr)
+        if sequence_counts.gaps > MAX_GAP_FRACTION * sequence_counts.length:
+            print (f"[WARNING][Request {json_obj['id']}] {sequence_counts.gaps} of {sequence_counts.length} symbols of {SEQUENCE_FIELD} are gaps", file=sys.stderr)
+
+    # controlled vocabulary and country checks
+    if schema.vocabulary is not None:
+        for bcdm_field, invalid_terms in schema.vocabulary.check (json_obj['submission_packet']):
+            isValid = False
+            terms = '; '.join (schema.vocabulary.describe (bcdm_field, term) for term in invalid_terms)
+            msgs.append (f"[ERROR][Request {json_obj['id']}] Invalid controlled vocabulary term for {bcdm_field}: {terms}")
     return isValid, msgs
 
+def fill_basecount (json_obj, sequence_counts):
+    """
+    --fill-basecount: sets a missing or empty nuc_basecount of a valid record from its (non-empty) sequence.  Returns
+    the re-serialized line, or None if the record is left as it is.
+    """
+    packet = json_obj['submission_packet']
+    if sequence_counts is None or not sequence_counts.length or packet.get(BASECOUNT_FIELD) not in (None, ''):
+        return None
+    packet[BASECOUNT_FIELD] = sequence_counts.bases
+    return dumps(json_obj)
+
+def read_chunks (stream, chunk_size):
+    chunk = []
+    for line in stream:
+        chunk.append (line)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _init_worker (worker_args):
+    global args
+    args = worker_args
+
+def validate_chunk (lines):
+    """
+    Validate a chunk of JSONL lines.  Returns (outputs, errors, chunk_metrics) where outputs holds, per input line,
+    the line itself if valid (re-serialized if --fill-basecount changed it) or None if rejected, and errors what the
+    validator wrote to stderr for the line, captured so that the parent process can emit it in input order.  With
+    --metrics-out, chunk_metrics is the (CheckStats, [(seconds, request_id, accepted)]) collected for the chunk,
+    otherwise None.
+    """
+    schema = load_schema (args.bcdm_def, args.vocabularies, args.countries)
+    if args.metrics_out and schema.check_stats is None:
+        schema.collect_stats (CheckStats())       # worker process
+    outputs = []
+    errors = []
+    timings = []
+    json_objs = [loads(line) for line in lines]
+    if args.engine == 'columnar':
+        from columnar_validation import validate_packets      # pulls in pandas, only paid for by the columnar engine
+        field_reports = validate_packets (schema, [json_obj['submission_packet'] for json_obj in json_objs])
+    else:
+        field_reports = [None] * len(json_objs)
+    all_sequence_counts = count_packet_sequences ([json_obj['submission_packet'] for json_obj in json_objs])
+    for line, json_obj, field_report, sequence_counts in zip (lines, json_objs, field_reports, all_sequence_counts):
+        err = io.StringIO()
+        with redirect_stderr (err):
+            if args.metrics_out:
+                start = time.perf_counter()
+            isValid, msgs = validate_submission_obj (json_obj, args.update, schema, field_report, sequence_counts)
+            if args.metrics_out:
+                timings.append ((time.perf_counter() - start, json_obj.get('id'), isValid))
+            if not isValid:
+                print ( "\n".join (msgs), file=sys.stderr)
+                outputs.append (None)
+            else:
+                filled = fill_basecount (json_obj, sequence_counts) if args.fill_basecount else None
+                outputs.append (filled or line)
+        errors.append (err.getvalue())
+    chunk_metrics = (schema.check_stats.take(), timings) if args.metrics_out else None
+    return outputs, errors, chunk_metrics
+
+def split_replayed (chunk, checkpoint):
+    """
+    Returns the checkpointed result (or None) of every line of the chunk and the lines that still need validating.
+    """
+    return checkpoint.split (chunk) if checkpoint else ([None] * len(chunk), chunk)
+
+def merge_replayed (chunk, replays, result, checkpoint):
+    """
+    Puts the replayed results and the validate_chunk result of the remaining lines back in input order, storing the
+    new verdicts in the checkpoint.
+    """
+    if checkpoint is None:
+        return result
+    fresh_outputs, fresh_errors, chunk_metrics = result
+    fresh = zip (fresh_outputs, fresh_errors)
+    outputs, errors = [], []
+    for line, replay in zip (chunk, replays):
+        if replay is not None:
+            accepted, output, err_text = replay
+            output = output if accepted else None
+            if metrics is not None:
+                metrics.record (None, 0.0, accepted, replayed=True)
+        else:
+            output, err_text = next (fresh)
+            checkpoint.store (line, output is not None, None if output == line else output, err_text)
+        outputs.append (output)
+        errors.append (err_text)
+    return outputs, errors, chunk_metrics
+
+def iter_validated_chunks (stream, args, checkpoint=None):
+    """
+    Validate stdin chunks in a pool of args.workers processes (or in this process if workers is 1) and yield the
+    validate_chunk results in input order.  At most 4 chunks per worker are in flight so memory does not grow with
+    the input size.  Lines found in the checkpoint are replayed instead of validated.
+    """
+    if args.workers == 1:
+        for chunk in read_chunks (stream, args.chunk_size):
+            replays, fresh = split_replayed (chunk, checkpoint)
+            yield merge_replayed (chunk, replays, validate_chunk (fresh) if fresh else ([], [], None), checkpoint)
+        return
+    with multiprocessing.Pool (args.workers, initializer=_init_worker, initargs=(args,)) as pool:
+        pending = collections.deque()
+        for chunk in read_chunks (stream, args.chunk_size):
+            replays, fresh = split_replayed (chunk, checkpoint)
+            pending.append ((chunk, replays, pool.apply_async (validate_chunk, (fresh,)) if fresh else None))
+            if len(pending) >= args.workers * 4:
+                chunk, replays, result = pending.popleft()
+                yield merge_replayed (chunk, replays, result.get() if result else ([], [], None), checkpoint)
+        while pending:
+            chunk, replays, result = pending.popleft()
+            yield merge_replayed (chunk, replays, result.get() if result else ([], [], None), checkpoint)
+
+def iter_verdicts (stream, args, schema, checkpoint=None):
+    """
+    Yields, in input order, each input line if it is valid (or the filled line, with --fill-basecount) or None if it
+    was rejected.  Error messages are written to stderr as records are validated, or replayed from the checkpoint.
+    """
+    if args.workers > 1 or args.engine == 'columnar':
+        for outputs, errors, chunk_metrics in iter_validated_chunks (stream, args, checkpoint):
+            sys.stderr.write ("".join (errors))
+            if metrics is not None and chunk_metrics is not None:
+                check_stats, timings = chunk_metrics
+                metrics.checks.merge (check_stats)
+                for seconds, request_id, isValid in timings:
+                    metrics.record (request_id, seconds, isValid)
+            yield from outputs
+        return
+    # Records are read a chunk ahead so the sequences of the chunk are counted in one batch
+    for chunk in read_chunks (stream, args.chunk_size):
+        replays, fresh = split_replayed (chunk, checkpoint)
+        json_objs = [loads(line) for line in fresh]
+        all_sequence_counts = iter (count_packet_sequences ([json_obj['submission_packet'] for json_obj in json_objs]))
+        json_objs = iter (json_objs)
+        for line, replay in zip (chunk, replays):
+            if replay is not None:
+                isValid, output, err_text = replay
+                sys.stderr.write (err_text)
+                if metrics is not None:
+                    metrics.record (None, 0.0, isValid, replayed=True)
+                yield output if isValid else None
+                continue
+            if metrics is not None:
+                start = time.perf_counter()
+            json_obj, sequence_counts = next (json_objs), next (all_sequence_counts)
+            with captured_stderr (checkpoint) as err:
+                isValid, msgs = validate_submission_obj (json_obj, args.update, schema, sequence_counts=sequence_counts)
+                if metrics is not None:
+                    metrics.record (json_obj.get('id'), time.perf_counter() - start, isValid)
+                if not isValid:
+                    print ( "\n".join (msgs), file=sys.stderr)
+            filled = fill_basecount (json_obj, sequence_counts) if isValid and args.fill_basecount else None
+            if checkpoint:
+                checkpoint.store (line, isValid, filled, err.getvalue())
+            yield (filled or line) if isValid else None
+
 def main(args):
+    global metrics
     error_count = 0
 
     # Validate params
-    if not os.path.exists(args.bcdm_def):
-        print ( f"[ABORT] Mapping file path not found: {args.bcdm_def}", file=sys.stderr)
-        sys.exit (1)
+    for filepath in (args.bcdm_def, args.vocabularies, args.countries):
+        if filepath and not os.path.exists(filepath):
+            print ( f"[ABORT] Mapping file path not found: {filepath}", file=sys.stderr)
+            sys.exit (1)
+
+    if args.metrics_out:
+        metrics = Metrics ('1_acceptability_check', args.metrics_out, args.metrics_slowest)
+    with timed_stage (metrics, 'load'):
+        schema = load_schema (args.bcdm_def, args.vocabularies, args.countries)
+    if metrics:
+        schema.collect_stats (metrics.checks)
+    checkpoint = open_checkpoint (args, __file__, ['update', 'bcdm_def', 'vocabularies', 'countries', 'fill_basecount'])
 
     # Process Input Data Jsonl
-    results = []
-    for line in sys.stdin:
-        line = line.strip("\n")
-        isValid, msgs = validate_submission_obj (json.loads(line), args.update)
-        if not isValid: 
-            print ( "\n".join (msgs), file=sys.stderr)
-            error_count+=1
-        else:
-            if not args.all_or_nothing: 
-                print (line)
+    output = TransactionalOutput (args.batch_size) if args.all_or_nothing else None
+    stdout = JsonlWriter ()
+    with timed_stage (metrics, 'validate'):
+        for line in iter_verdicts (read_lines (), args, schema, checkpoint):     # valid lines are written back as read, unless filled
+            if line is None:
+                error_count+=1
+                if output: output.reject()
+            elif output:
+                output.write (line)
             else:
-                results.append (line)
+                stdout.write (line)
+    stdout.flush()
 
-    if error_count > 0 and args.all_or_nothing:
-        print (f"[ABORT] all-or-nothing: {error_count} records invalid. ", file=sys.stderr)
+    with timed_stage (metrics, 'commit'):
+        committed = output.close() if output else True
+    if checkpoint:
+        checkpoint.close()
+    if not committed:
+        if args.batch_size is None:
+            print (f"[ABORT] all-or-nothing: {error_count} records invalid. ", file=sys.stderr)
         sys.exit (1)
-    elif error_count== 0 and args.all_or_nothing:
-        print ("\n".join (results))
 
 if __name__ == "__main__":
 
@@ -174,6 +317,25 @@ Usage: cat data_bcdm.jsonl | python acceptability_check.py  --bcdm_def /file/pat
     #parser.add_argument("--username", type=str, required=True, help="Username")
     parser.add_argument("--update", default=False, action=argparse.BooleanOptionalAction, help="If set, record existence is required to proceed with the update. Otherwise, new record submission is requested.")
     parser.add_argument("--bcdm-def", type=str, required=True, help="Path to the BCDM definition file.")
+    parser.add_argument("--vocabularies", type=str, required=False, help="Path to controlled_vocabularies.tsv.  If set, controlled fields must use one of its terms.")
+    parser.add_argument("--countries", type=str, required=False, help="Path to registered_soverign_and_maritime_areas.tsv.  If set, country/ocean and country_iso must match it.")
     parser.add_argument("--all-or-nothing", action="store_true", help="True indicates all or nothing mode")
+    parser.add_argument("--fill-basecount", action="store_true", help="If set, valid records with a nuc but no nuc_basecount get it filled in from the sequence (such records are written re-serialized).")
+    parser.add_argument("--workers", type=int, default=1, help="Number of validation processes.  Output order always follows the input order.")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Number of records validated together by a worker or by the columnar engine; the record engine reads this many ahead to count their sequences in one batch.")
+    parser.add_argument("--engine", type=str, choices=["record", "columnar"], default="record", help="'record' checks one record at a time; 'columnar' checks each field of a whole chunk in one vectorized pass.  Verdicts are identical.")
+    parser.add_argument("--batch-size", type=int, required=False, help="If set, the all-or-nothing applies to each batch.  Alternatively, all records submitted will be validated in single batch.")
+    parser.add_argument("--checkpoint", type=str, required=False, help="SQLite file recording the verdict and messages of every validated line.  On a rerun, lines already in it are replayed instead of validated, so only new or edited records are checked.")
+    parser.add_argument("--metrics-out", type=str, required=False, help="If set, per-stage, per-field and per-checker timings, record counts and the slowest records are written to this JSON file (periodically while running and at exit).")
+    parser.add_argument("--metrics-slowest", type=int, default=10, help="Number of slowest records kept in the metrics (only used with --metrics-out).")
     args = parser.parse_args()
+
+    if args.workers < 1 or args.chunk_size < 1:
+        parser.error("--workers and --chunk-size must be positive")
+    # Enforce dependency
+    if args.batch_size is not None and args.batch_size < 1:
+        parser.error("--batch-size must be positive")
+    if args.batch_size is not None and not args.all_or_nothing:
+        parser.error("--batch-size requires --all-or-nothing")
+
     main(args)
\ No newline at end of file
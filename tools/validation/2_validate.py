@@ -1,23 +1,33 @@
 import sys, os
 import argparse
 import json 
-import pandas as pd
+import time
 
+sys.path.append (os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from transactional_output import TransactionalOutput
+from metrics import Metrics, timed_stage
+from checkpoint import captured_stderr, open_checkpoint
+from jsonl_io import JsonlWriter, loads, read_lines
+from bcdm_schema import load_schema
+
+metrics = None      # Metrics when --metrics-out is set
 _MIN_REQUIRED_FIELDS = {
     'specimen:update': [tuple(['sampleid', 'processid'])],
     'specimen:new':['bold_recordset_code_arr', 'sampleid']
 }
 
 def read_mapping (file):
+    import pandas as pd
     return pd.read_csv(file, sep='\t')
 
-def validate_submission_obj (json_obj, is_update):
+def validate_submission_obj (json_obj, is_update, schema = None):
     isValid = True
     msgs = []
-    bcdm_mapping = read_mapping (args.mapping)
+    if schema is None:
+        schema = load_schema (args.bcdm_def)
     
     if json_obj['submission_type'] != 'specimen':
-        msgs.append ( f"[ERROR] Invalid submission type: Expected specimen, received {json_obj['submission_type']}")
+        msgs.append ( f"[ERROR][Request {json_obj['id']}] Invalid submission type: Expected specimen, received {json_obj['submission_type']}")
         isValid = False
 
     # min required field checks
@@ -35,34 +45,74 @@ def validate_submission_obj (json_obj, is_update):
                     isValid = False
 
     # data model validator
-    submitted_fields = json_obj['submission_packet'].keys()
-    
-    invalid_fields = [ field for field in submitted_fields if (bcdm_mapping['bcdm_field'] != field).all() ]
+    unknown_fields, invalid_fields = schema.validate (json_obj['submission_packet'])
 
-    if len(invalid_fields) > 0:
-        print (f"[WARNING][Request {json_obj['id']}] Invalid fields found ", invalid_fields, file = sys.stderr)
+    if len(unknown_fields) > 0:
+        print (f"[WARNING][Request {json_obj['id']}] Invalid fields found ", unknown_fields, file = sys.stderr)
         #TODO: confirm with Sujeevan filter out bad fields?  Or throw an error? 
 
+    if len(invalid_fields) > 0:
+        isValid = False
+        msgs.append (f"[ERROR][Request {json_obj['id']}] Invalid data type/format for {len(invalid_fields)} fields: {','.join (invalid_fields)}.")
+
     return isValid, msgs
 
 def main(args):
+    global metrics
     error_count = 0
 
     # Validate params
+    if not os.path.exists(args.bcdm_def):
+        print ( f"[ABORT] Mapping file path not found: {args.bcdm_def}", file=sys.stderr)
+        sys.exit (1)
+    if args.metrics_out:
+        metrics = Metrics ('2_validate', args.metrics_out, args.metrics_slowest)
+    with timed_stage (metrics, 'load'):
+        schema = load_schema (args.bcdm_def)
+    if metrics:
+        schema.collect_stats (metrics.checks)
+    checkpoint = open_checkpoint (args, __file__, ['update', 'bcdm_def'])
 
     # Process Input Data Jsonl
-    results = []
-    for line in sys.stdin:
-        line = line.strip("\n")
-        print (line)
-
-    '''
-    if error_count > 0:
-        print (f"[ABORT] all-or-nothing: {error_count} records invalid. ", file=sys.stderr)
+    output = TransactionalOutput (args.batch_size) if args.all_or_nothing else None
+    stdout = JsonlWriter ()
+    with timed_stage (metrics, 'validate'):
+        for line in read_lines ():
+            replay = checkpoint.lookup (line) if checkpoint else None
+            if replay is not None:
+                isValid, _, err_text = replay
+                sys.stderr.write (err_text)
+                if metrics is not None:
+                    metrics.record (None, 0.0, isValid, replayed=True)
+            else:
+                if metrics is not None:
+                    start = time.perf_counter()
+                json_obj = loads(line)
+                with captured_stderr (checkpoint) as err:
+                    isValid, msgs = validate_submission_obj (json_obj, args.update, schema)
+                    if metrics is not None:
+                        metrics.record (json_obj.get('id'), time.perf_counter() - start, isValid)
+                    if not isValid:
+                        print ( "\n".join (msgs), file=sys.stderr)
+                if checkpoint:
+                    checkpoint.store (line, isValid, None, err.getvalue())
+            if not isValid:
+                error_count+=1
+                if output: output.reject()
+            elif output:
+                output.write (line)
+            else:
+                stdout.write (line)      # written back as read
+    stdout.flush()
+
+    with timed_stage (metrics, 'commit'):
+        committed = output.close() if output else True
+    if checkpoint:
+        checkpoint.close()
+    if not committed:
+        if args.batch_size is None:
+            print (f"[ABORT] all-or-nothing: {error_count} records invalid. ", file=sys.stderr)
         sys.exit (1)
-    elif len(error_count)== 0 and args.all_or_nothing:
-        print ("\n".join (results))
-    '''
 
 if __name__ == "__main__":
     
@@ -77,10 +127,15 @@ Usage: cat data_bcdm.jsonl | python acceptability_check.py --data-tsv data_recor
     parser.add_argument("--batch-size", type=int, required=False, help="If set, the all-or-nothing applies to each batch.  Alternatively, all records submitted will be validated in single batch.")
     parser.add_argument("--all-or-nothing", action="store_true", help="True indicates all or nothing mode")
     parser.add_argument("--bcdm-def", type=str, required=True, help="Path to the BCDM definition file.")
+    parser.add_argument("--checkpoint", type=str, required=False, help="SQLite file recording the verdict and messages of every validated line.  On a rerun, lines already in it are replayed instead of validated, so only new or edited records are checked.")
+    parser.add_argument("--metrics-out", type=str, required=False, help="If set, per-stage, per-field and per-checker timings, record counts and the slowest records are written to this JSON file (periodically while running and at exit).")
+    parser.add_argument("--metrics-slowest", type=int, default=10, help="Number of slowest records kept in the metrics (only used with --metrics-out).")
 
     args = parser.parse_args()
 
     # Enforce dependency
+    if args.batch_size is not None and args.batch_size < 1:
+        parser.error("--batch-size must be positive")
     if args.batch_size is not None and not args.all_or_nothing:
         parser.error("--batch-size requires --all-or-nothing")
 
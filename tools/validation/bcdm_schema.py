@@ -0,0 +1,189 @@
+import sys, os
+import json
+import re
+import time
+from functools import lru_cache
+
+sys.path.append (os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from compiled_tables import read_table
+from date_validation import compile_date_check
+from vocabulary import VocabularyIndex
+
+PLACEHOLDER_REGEX = {
+    "%s": ".+",          # any non-empty string
+    "%d": r"\d+",        # integer number
+    "%f": r"[-+]?\d*\.?\d+",  # float number
+}
+
+########## Value Checkers ##########
+
+def placeholder_to_regex (value, match_empty_string = False):
+    """
+    Compile a data_format such as '%s@%s.%s' or 'BOLD:%s' into a regex.  The module level PLACEHOLDER_REGEX is
+    never modified; match_empty_string only affects the pattern returned by this call.
+    """
+    placeholders = dict(PLACEHOLDER_REGEX)
+    if match_empty_string:
+        placeholders["%s"] = ".*"
+    regex_str = re.escape(value)  # escape all special characters
+    for placeholder, replacement in placeholders.items():
+        regex_str = regex_str.replace(re.escape(placeholder), replacement)
+    return re.compile(regex_str)
+
+def _check_split (value):
+    value.split(",")
+    return True
+
+def _check_geopoint (value):
+    return len(value.split(",")) == 2
+
+def _check_char (value):
+    return isinstance(value, str) and len(value) == 1
+
+def _check_json (value):
+    json.loads(value)
+    return True
+
+def _check_int (value):
+    int(value)
+    return True
+
+def _check_float (value):
+    float(value)
+    return True
+
+# data_type -> type checker.  A checker either returns a bool or raises, raising means invalid.
+TYPE_CHECKS = {
+    'int': _check_int,
+    'integer': _check_int,
+    'float': _check_float,
+    'number': _check_float,
+    'char': _check_char,
+    'geopoint': _check_geopoint,
+    'array': _check_split,
+    'array of string': _check_split,
+    'json': _check_json,
+}
+
+def compile_format_check (data_type, data_format):
+    """
+    Returns the format checker for a data_type/data_format pair, or None if no format constraint applies.
+    """
+    if not data_format or data_format == 'default':
+        return None
+    if data_type == 'string:date':
+        return compile_date_check(data_format)
+    if data_type == 'string':
+        regex_format = placeholder_to_regex(data_format)
+        return lambda value: regex_format.fullmatch(value) is not None
+    return None
+
+@lru_cache(maxsize=None)
+def compile_value_check (data_type, data_format):
+    """
+    Returns a single callable(value) -> bool combining the type and format checks of a field.
+    """
+    type_check = TYPE_CHECKS.get(data_type)
+    format_check = compile_format_check(data_type, data_format)
+
+    def check (value):
+        if value == "": return True
+        try:
+            if type_check is not None and not type_check(value):
+                return False
+            if format_check is not None and not format_check(value):
+                return False
+        except Exception:
+            return False
+        return True
+    return check
+
+########## Schema ##########
+
+class FieldSpec:
+    __slots__ = ('name', 'data_type', 'data_format', 'check')
+
+    def __init__ (self, name, data_type, data_format):
+        self.name = name
+        self.data_type = data_type
+        self.data_format = data_format
+        self.check = compile_value_check(data_type, data_format)
+
+class BCDMSchema:
+    """
+    field_definitions.tsv compiled into a field -> FieldSpec index.  Build it once per process (see load_schema)
+    and reuse it for every record.
+    """
+    def __init__ (self, rows):
+        self.fields = {}
+        self.vocabulary = None
+        self.check_stats = None      # metrics.CheckStats while --metrics-out is collecting
+        for row in rows:
+            if not row.get('field'): continue
+            self.fields[row['field']] = FieldSpec(row['field'], row['data_type'], row['data_format'])
+
+    @property
+    def array_fields (self):
+        return [field for field, spec in self.fields.items() if spec.data_type in ('array', 'array of string')]
+
+    @classmethod
+    def from_tsv (cls, filepath):
+        return cls(read_table(filepath))
+
+    def __contains__ (self, field):
+        return field in self.fields
+
+    def unknown_fields (self, record):
+        return [field for field in record if field not in self.fields]
+
+    def invalid_fields (self, record):
+        """
+        Returns the submitted fields whose value fails the type/format check.  Empty values and fields not in the
+        definitions are skipped.
+        """
+        fields = self.fields
+        return [field for field, value in record.items() if value and field in fields and not fields[field].check(value)]
+
+    def timed_invalid_fields (self, record):
+        """
+        invalid_fields that also adds the time and outcome of every check to self.check_stats.
+        """
+        fields = self.fields
+        stats = self.check_stats
+        invalid = []
+        for field, value in record.items():
+            if value and field in fields:
+                spec = fields[field]
+                start = time.perf_counter()
+                valid = spec.check(value)
+                stats.add(field, spec.data_type, time.perf_counter() - start, not valid)
+                if not valid:
+                    invalid.append(field)
+        return invalid
+
+    def collect_stats (self, check_stats):
+        """
+        Start (or, with None, stop) timing the value and vocabulary checks into check_stats.
+        """
+        self.check_stats = check_stats
+        if self.vocabulary is not None:
+            self.vocabulary.check_stats = check_stats
+
+    def validate (self, record):
+        """
+        Validate a single submission packet.  Returns (unknown_fields, invalid_fields).
+        """
+        if self.check_stats is not None:
+            return self.unknown_fields(record), self.timed_invalid_fields(record)
+        return self.unknown_fields(record), self.invalid_fields(record)
+
+@lru_cache(maxsize=None)
+def load_schema (filepath, vocabularies=None, countries=None):
+    """
+    Build the schema for a field definitions file, optionally with the controlled vocabulary and country indexes
+    attached as schema.vocabulary.  Cached, so every caller in a process shares one instance.
+    """
+    schema = BCDMSchema.from_tsv(filepath)
+    if vocabularies or countries:
+        schema.vocabulary = VocabularyIndex.from_tsv(vocabularies, countries, schema.array_fields)
+    return schema
@@ -0,0 +1,135 @@
+import collections
+import re
+import time
+from operator import itemgetter
+
+import pandas as pd
+
+from bcdm_schema import TYPE_CHECKS, compile_format_check, placeholder_to_regex
+
+########## Vectorized String Checks ##########
+# Each function takes the non-empty string values of one field and returns a boolean mask of the values that are
+# certainly valid.  Everything outside the mask is re-checked with the scalar FieldSpec.check, so the verdicts are
+# identical to the per-record path; the vectorized pass only needs to accept the common well-formed values.
+
+_INT_REGEX = r'[+-]?[0-9]+'
+_ISO_DATE_REGEX = r'[0-9]{4}-[0-9]{2}-[0-9]{2}'
+_GEOPOINT_REGEX = r'[^,\n]*,[^,\n]*'
+
+def fullmatch_mask (strings, pattern):
+    """
+    Vectorized strings.str.fullmatch(pattern).  The column is joined into one newline separated buffer and the
+    anchored pattern is counted in a single re pass; if every line matches, no per-value work is needed.
+    """
+    if len(strings) == 0:
+        return pd.Series(True, index=strings.index)
+    joined = "\n".join(strings)
+    if joined.count("\n") == len(strings) - 1:
+        line_regex = re.compile(f"^(?:{pattern})$", re.MULTILINE)
+        if len(line_regex.findall(joined)) == len(strings):
+            return pd.Series(True, index=strings.index)
+    return strings.str.fullmatch(pattern).astype(bool)
+
+def _accept_all (spec, strings):
+    return pd.Series(True, index=strings.index)
+
+def _accept_none (spec, strings):
+    return pd.Series(False, index=strings.index)
+
+def _fast_string (spec, strings):
+    if compile_format_check(spec.data_type, spec.data_format) is None:
+        return _accept_all(spec, strings)
+    return fullmatch_mask(strings, placeholder_to_regex(spec.data_format).pattern)
+
+def _fast_int (spec, strings):
+    return fullmatch_mask(strings, _INT_REGEX)
+
+def _fast_float (spec, strings):
+    return pd.to_numeric(strings, errors='coerce').notna()
+
+def _fast_char (spec, strings):
+    return fullmatch_mask(strings, '.')
+
+def _fast_geopoint (spec, strings):
+    return fullmatch_mask(strings, _GEOPOINT_REGEX)
+
+def _fast_date (spec, strings):
+    if compile_format_check(spec.data_type, spec.data_format) is None:
+        return _accept_all(spec, strings)
+    if spec.data_format == '%Y-%m-%d':
+        # zero padded shape + valid calendar date is exactly what the strptime/strftime round trip accepts
+        shaped = fullmatch_mask(strings, _ISO_DATE_REGEX)
+        parsed = pd.to_datetime(strings.where(shaped), format='%Y-%m-%d', errors='coerce')
+        return shaped & parsed.notna() & (parsed.dt.year >= 1000)
+    parsed = pd.to_datetime(strings, format=spec.data_format, errors='coerce')
+    return parsed.notna() & (parsed.dt.strftime(spec.data_format) == strings)
+
+FAST_CHECKS = {
+    'string': _fast_string,
+    'string:date': _fast_date,
+    'int': _fast_int,
+    'integer': _fast_int,
+    'float': _fast_float,
+    'number': _fast_float,
+    'char': _fast_char,
+    'geopoint': _fast_geopoint,
+    'array': _accept_all,
+    'array of string': _accept_all,
+    'json': _accept_none,
+}
+
+########## Batch Validation ##########
+
+def needs_check (spec):
+    return spec.data_type in TYPE_CHECKS or compile_format_check(spec.data_type, spec.data_format) is not None
+
+def invalid_rows (spec, values):
+    """
+    Returns the positions in values (one field, one entry per record) that fail the field's type/format check.
+    """
+    if set(map(type, values)) == {str} and "" not in values:
+        # common case: every record submitted a non-empty string
+        strings = pd.Series(values, dtype=object)
+        invalid = []
+    else:
+        column = pd.Series(values, dtype=object)
+        is_str = column.map(type) == str
+        strings = column[is_str]
+        strings = strings[strings != ""]
+
+        # non-string values (JSON numbers, lists, objects) are rare; check them one by one
+        invalid = [row for row, value in column[~is_str].items() if value and not spec.check(value)]
+
+    accepted = FAST_CHECKS.get(spec.data_type, _accept_all)(spec, strings)
+    invalid += [row for row, value in strings[~accepted].items() if not spec.check(value)]
+    return invalid
+
+def validate_packets (schema, packets):
+    """
+    Column-oriented equivalent of [schema.validate(packet) for packet in packets].  Every checked field is
+    validated for the whole batch in one vectorized pass and the failures are mapped back to their records.
+    """
+    bad_fields = collections.defaultdict(set)
+    submitted_fields = set().union(*packets) if packets else set()
+    for field in submitted_fields:
+        spec = schema.fields.get(field)
+        if spec is None or not needs_check(spec): continue
+        try:
+            values = list(map(itemgetter(field), packets))
+        except KeyError:
+            values = [packet.get(field, "") for packet in packets]      # missing fields are never checked, same as ""
+        start = time.perf_counter() if schema.check_stats is not None else 0
+        rows = invalid_rows(spec, values)
+        if schema.check_stats is not None:
+            calls = sum(1 for value in values if value)
+            schema.check_stats.add(field, spec.data_type, time.perf_counter() - start, len(rows), calls)
+        for row in rows:
+            bad_fields[row].add(field)
+
+    unknown = submitted_fields.difference(schema.fields)
+    reports = []
+    for row, packet in enumerate(packets):
+        invalid_fields = [field for field in packet if field in bad_fields[row]] if row in bad_fields else []
+        unknown_fields = [field for field in packet if field in unknown] if unknown else []
+        reports.append((unknown_fields, invalid_fields))
+    return reports
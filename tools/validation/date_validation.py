@@ -0,0 +1,65 @@
+import re
+from datetime import datetime
+from functools import lru_cache
+
+DATE_CACHE_SIZE = 65536     # distinct date strings remembered per format
+DATE_RANGES = [
+    ('collection_date_start', 'collection_date_end'),
+]
+
+# data_format -> fullmatch regex capturing (year, month, day).  Only ASCII digits and 4 digit years from 1000 are
+# accepted, which is exactly what the strptime/strftime round trip allows for these formats.
+_FAST_FORMATS = {
+    '%Y-%m-%d': re.compile(r'([1-9][0-9]{3})-([0-9]{2})-([0-9]{2})'),
+}
+
+def _compile_parser (data_format):
+    regex = _FAST_FORMATS.get(data_format)
+    if regex is not None:
+        def parse (value):
+            match = regex.fullmatch(value)
+            if match is None:
+                return None
+            try:
+                return datetime(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+            except ValueError:      # day or month out of range
+                return None
+        return parse
+
+    def parse (value):
+        try:
+            parsed = datetime.strptime(value, data_format)
+        except ValueError:
+            return None
+        return parsed if parsed.strftime(data_format) == value else None
+    return parse
+
+@lru_cache(maxsize=None)
+def compile_date_parser (data_format, cache_size=DATE_CACHE_SIZE):
+    """
+    Returns parse(value) -> datetime, or None if value is not a date written exactly in data_format.  Results
+    are memoized in a bounded LRU cache since collection and upload dates repeat heavily within a submission.
+    """
+    return lru_cache(maxsize=cache_size)(_compile_parser(data_format))
+
+def compile_date_check (data_format):
+    parse = compile_date_parser(data_format)
+    return lambda value: parse(value) is not None
+
+def invalid_date_ranges (record, schema, ranges=DATE_RANGES):
+    """
+    Returns [(start_field, end_field)] for the ranges of a submission packet whose start is after its end.  Ranges
+    with an empty or unparsable bound are skipped; the field checks report those.
+    """
+    errors = []
+    for start_field, end_field in ranges:
+        start, end = record.get(start_field), record.get(end_field)
+        if not start or not end or not isinstance(start, str) or not isinstance(end, str):
+            continue
+        if start_field not in schema.fields or end_field not in schema.fields:
+            continue
+        start_date = compile_date_parser(schema.fields[start_field].data_format)(start)
+        end_date = compile_date_parser(schema.fields[end_field].data_format)(end)
+        if start_date is not None and end_date is not None and start_date > end_date:
+            errors.append((start_field, end_field))
+    return errors
@@ -0,0 +1,82 @@
+import collections
+from functools import lru_cache
+
+SEQUENCE_FIELD = 'nuc'
+BASECOUNT_FIELD = 'nuc_basecount'
+MAX_AMBIGUOUS_FRACTION = 0.01     # warn above this share of ambiguity codes (BOLD barcode compliance asks for < 1% N)
+MAX_GAP_FRACTION = 0.05           # warn above this share of gaps
+
+_BASES = b'ACGTUacgtu'                        # IUPAC non-degenerate symbols, the ones nuc_basecount counts
+_AMBIGUOUS = b'RYSWKMBDHVNryswkmbdhvn'
+_GAPS = b'-'
+_SYMBOLS = frozenset((_BASES + _AMBIGUOUS + _GAPS).decode('ascii'))
+BASE, AMBIGUOUS, GAP, INVALID = range(4)
+
+SequenceCounts = collections.namedtuple('SequenceCounts', ['length', 'bases', 'ambiguous', 'gaps', 'invalid'])
+
+@lru_cache(maxsize=None)
+def symbol_classes ():
+    """
+    NumPy lookup table mapping each of the 256 byte values to BASE, AMBIGUOUS, GAP or INVALID.  Non-ASCII
+    characters arrive as their UTF-8 bytes, all of them INVALID (count_sequences counts characters, not bytes).
+    """
+    import numpy as np
+    table = np.full(256, INVALID, dtype=np.intp)
+    table[np.frombuffer(_AMBIGUOUS, dtype=np.uint8)] = AMBIGUOUS
+    table[np.frombuffer(_GAPS, dtype=np.uint8)] = GAP
+    table[np.frombuffer(_BASES, dtype=np.uint8)] = BASE
+    return table
+
+def count_sequences (sequences):
+    """
+    Returns the SequenceCounts of every sequence (str) of a batch.  The batch is joined into one newline separated
+    buffer and the non-degenerate bases are deleted in a single bytes.translate pass; the residue (ambiguity codes,
+    gaps, invalid bytes) is usually a small fraction of the input and is classified with the symbol_classes lookup
+    table and counted per sequence in one bincount.  A batch of clean sequences (bases only) never reaches NumPy.
+    Lengths and invalid counts are in characters, a non-ASCII character being one invalid symbol.
+    """
+    try:
+        encoded = list(map(str.encode, sequences))
+    except UnicodeEncodeError:      # lone surrogates, which the stdlib JSON parser lets through
+        encoded = [sequence.encode('utf-8', 'surrogatepass') for sequence in sequences]
+    if not encoded:
+        return []
+    residues = b'\n'.join(encoded).translate(None, _BASES).split(b'\n')
+    if len(residues) != len(encoded):
+        residues = [sequence.translate(None, _BASES) for sequence in encoded]     # a sequence holds a newline itself
+    if not any(residues):
+        return [SequenceCounts(length, length, 0, 0, 0) for length in map(len, encoded)]
+
+    import numpy as np      # only paid for by batches with ambiguity codes, gaps or invalid symbols
+    lengths = np.fromiter(map(len, sequences), dtype=np.intp, count=len(encoded))
+    residue_lengths = np.fromiter(map(len, residues), dtype=np.intp, count=len(residues))
+    bases = np.fromiter(map(len, encoded), dtype=np.intp, count=len(encoded)) - residue_lengths
+    classes = symbol_classes()[np.frombuffer(b''.join(residues), dtype=np.uint8)]
+    owners = np.repeat(np.arange(len(residues), dtype=np.intp) * 4, residue_lengths)
+    counts = np.bincount(owners + classes, minlength=4 * len(residues)).reshape(-1, 4)
+    invalid = lengths - bases - counts[:, AMBIGUOUS] - counts[:, GAP]
+    return list(map(SequenceCounts, lengths.tolist(), bases.tolist(),
+                    counts[:, AMBIGUOUS].tolist(), counts[:, GAP].tolist(), invalid.tolist()))
+
+def count_packet_sequences (packets, field=SEQUENCE_FIELD):
+    """
+    count_sequences over the sequences of a batch of submission packets; None for packets without one.  An empty
+    nuc counts as a sequence of length 0, so a nuc_basecount submitted with it must be 0.
+    """
+    positions = [i for i, packet in enumerate(packets) if isinstance(packet.get(field), str)]
+    result = [None] * len(packets)
+    for i, counts in zip(positions, count_sequences([packets[i][field] for i in positions])):
+        result[i] = counts
+    return result
+
+def invalid_symbols (sequence):
+    return sorted(set(sequence) - _SYMBOLS)
+
+def basecount_value (value):
+    """The submitted nuc_basecount as an int, or None if it is empty or not an integer (the type check reports that)."""
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
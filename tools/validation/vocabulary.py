@@ -0,0 +1,120 @@
+import sys, os
+import collections
+import time
+
+sys.path.append (os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from compiled_tables import read_table
+
+# field in registered_soverign_and_maritime_areas.tsv -> BCDM fields it validates
+COUNTRY_COLUMNS = {
+    'country/ocean': ['country/ocean'],
+    'country_iso': ['iso_alpha3_code', 'iso_alpha2_code'],
+}
+
+def normalize_term (term):
+    """Case and whitespace insensitive form used for every lookup."""
+    return " ".join(term.split()).casefold()
+
+def canonical_country_terms (countries):
+    """
+    Returns field -> {normalized term: canonical term} for the country fields of registered_soverign_and_maritime_areas.tsv,
+    matched the way validation accepts them: names and ISO codes in any case, alpha-2 codes standing for their alpha-3 code.
+    """
+    terms = {field: {} for field in COUNTRY_COLUMNS}
+    for row in read_table(countries):
+        if row.get('country/ocean'):
+            terms['country/ocean'].setdefault(normalize_term(row['country/ocean']), row['country/ocean'])
+        if row.get('iso_alpha3_code'):
+            for column in COUNTRY_COLUMNS['country_iso']:
+                if row.get(column):
+                    terms['country_iso'].setdefault(normalize_term(row[column]), row['iso_alpha3_code'])
+    return terms
+
+def ngrams (term, n=3):
+    padded = f"{' ' * (n - 1)}{term} "
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+class FieldVocabulary:
+    """
+    Accepted terms of one field: a normalized term -> canonical term dict for O(1) membership, plus a trigram
+    inverted index so suggestions only look at terms sharing at least one trigram with the rejected value.
+    """
+    def __init__ (self, terms):
+        self.exact = frozenset(terms)
+        self.terms = {}
+        for term in terms:
+            self.terms.setdefault(normalize_term(term), term)
+        self.index = collections.defaultdict(set)
+        for normalized in self.terms:
+            for gram in ngrams(normalized):
+                self.index[gram].add(normalized)
+
+    def __contains__ (self, term):
+        return term in self.exact or normalize_term(term) in self.terms
+
+    def suggest (self, term, limit=3, min_score=0.3):
+        query = ngrams(normalize_term(term))
+        shared = collections.Counter()
+        for gram in query:
+            shared.update(self.index.get(gram, ()))
+        scored = []
+        for normalized, count in shared.items():
+            score = 2 * count / (len(query) + len(ngrams(normalized)))      # Dice coefficient
+            if score >= min_score:
+                scored.append((-score, normalized))
+        return [self.terms[normalized] for _, normalized in sorted(scored)[:limit]]
+
+class VocabularyIndex:
+    """
+    Controlled vocabulary (controlled_vocabularies.tsv) and country/ISO (registered_soverign_and_maritime_areas.tsv)
+    indexes, built once at startup.  array_fields lists the fields whose values are comma separated term lists.
+    """
+    def __init__ (self, terms_by_field, array_fields=()):
+        self.fields = {field: FieldVocabulary(terms) for field, terms in terms_by_field.items()}
+        self.array_fields = frozenset(array_fields)
+        self.check_stats = None      # metrics.CheckStats while --metrics-out is collecting
+
+    @classmethod
+    def from_tsv (cls, vocabularies=None, countries=None, array_fields=()):
+        terms_by_field = collections.defaultdict(list)
+        if vocabularies:
+            for row in read_table(vocabularies):
+                if row.get('field') and row.get('term'):
+                    terms_by_field[row['field']].append(row['term'])
+        if countries:
+            for row in read_table(countries):
+                for field, columns in COUNTRY_COLUMNS.items():
+                    terms_by_field[field].extend(row[column] for column in columns if row.get(column))
+        return cls(terms_by_field, array_fields)
+
+    def invalid_terms (self, field, value):
+        """
+        Returns the terms of value not in the field's vocabulary.  Array fields are split on commas.
+        """
+        vocabulary = self.fields[field]
+        terms = value.split(",") if field in self.array_fields else [value]
+        return [term.strip() for term in terms if term.strip() and term not in vocabulary]
+
+    def check (self, record):
+        """
+        Returns [(field, invalid_terms)] for the controlled fields of a submission packet.  Empty and non-string
+        values are left to the type checks.
+        """
+        errors = []
+        stats = self.check_stats
+        for field in self.fields:
+            value = record.get(field)
+            if value and isinstance(value, str):
+                start = time.perf_counter() if stats is not None else 0
+                invalid_terms = self.invalid_terms(field, value)
+                if stats is not None:
+                    stats.add(field, 'vocabulary', time.perf_counter() - start, bool(invalid_terms))
+                if invalid_terms:
+                    errors.append((field, invalid_terms))
+        return errors
+
+    def describe (self, field, term):
+        suggestions = self.fields[field].suggest(term)
+        if not suggestions:
+            return f"'{term}'"
+        return f"'{term}' (did you mean: {', '.join(repr(suggestion) for suggestion in suggestions)}?)"